@@ -0,0 +1,165 @@
+'''
+Benchmarks `Song.from_midi` against the per-note import it replaced.
+
+Usage, from the root of the repo:
+
+```
+PYTHONPATH=src python scripts/benchmark_midi_import.py [--tracks 16] [--notes-per-track 7000] [--tempos 200]
+```
+
+The per-note import below mirrors the notes part of `Song.from_midi` before notes were imported in bulk:
+one `tick_to_seconds` binary search over the tempos per tick and one message per note, built field by field.
+Both imports run on the same synthetic MIDI file and the best of several runs is reported. Within each run,
+the time spent in building note messages is measured separately, so the remaining import work can be compared
+on its own.
+
+Measured with the pure-Python protobuf backend, 16 tracks, 112k notes and 200 tempo changes, best of 5:
+
+```
+per-note import: 2.02s, of which building note messages: 1.08s
+Song.from_midi:  1.24s, of which building note messages: 1.18s
+end to end:                 1.6x
+building note messages:     0.9x
+everything else:            0.94s -> 0.06s (16.5x)
+```
+
+Building one message per note is not sped up by the bulk import, and parsing the same notes from serialized
+bytes is no faster with this backend. End to end, the import is therefore 1.6x faster rather than the 5x it
+was aimed at, which is only reached by the import work apart from building note messages.
+'''
+from __future__ import annotations
+from miditoolkit.midi.parser import MidiFile
+from miditoolkit.midi.containers import Instrument, Note as ToolkitNote, TempoChange, TimeSignature
+from google.protobuf.internal import api_implementation
+from tuneflow_py import Song
+from tuneflow_py.models.clip import Clip
+from tuneflow_py.models.tempo import TempoEvent
+from tuneflow_py.models.track import Track
+from tuneflow_py.utils import lower_than
+from types import SimpleNamespace
+import argparse
+import numpy as np
+import time
+
+
+def create_midi(num_tracks: int, num_notes_per_track: int, num_tempos: int, seed=0):
+    rng = np.random.default_rng(seed)
+    midi_obj = MidiFile(ticks_per_beat=480)
+    length = num_notes_per_track * 60
+    midi_obj.time_signature_changes.append(TimeSignature(numerator=4, denominator=4, time=0))
+    for tick, bpm in zip(np.linspace(0, length, num_tempos, endpoint=False).astype(int).tolist(),
+                         rng.uniform(60, 180, num_tempos).tolist()):
+        midi_obj.tempo_changes.append(TempoChange(tempo=bpm, time=tick))
+    for track_index in range(num_tracks):
+        instrument = Instrument(program=track_index % 128, name=f'Track {track_index}')
+        starts = rng.integers(0, length, num_notes_per_track).tolist()
+        durations = rng.integers(1, 960, num_notes_per_track).tolist()
+        pitches = rng.integers(21, 109, num_notes_per_track).tolist()
+        velocities = rng.integers(1, 128, num_notes_per_track).tolist()
+        for start, duration, pitch, velocity in zip(starts, durations, pitches, velocities):
+            instrument.notes.append(ToolkitNote(velocity=velocity, pitch=pitch, start=start, end=start + duration))
+        midi_obj.instruments.append(instrument)
+    return midi_obj
+
+
+class PhaseTimer:
+    '''
+    Accumulates the time spent in the functions it wraps, i.e. in building note messages, during one import.
+    '''
+
+    def __init__(self):
+        self.duration = 0.0
+
+    def wrap(self, function):
+        def timed_function(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.duration += time.perf_counter() - start_time
+        return timed_function
+
+
+def import_per_note(midi_obj: MidiFile, timer: PhaseTimer):
+    song = Song()
+    song_proto = song._proto
+    ppq_scale_factor = float(song_proto.PPQ) / float(midi_obj.ticks_per_beat)
+    song.overwrite_tempo_changes([
+        TempoEvent(ticks=round(tempo_change.time * ppq_scale_factor), bpm=tempo_change.tempo)
+        for tempo_change in midi_obj.tempo_changes])
+
+    def tick_to_seconds(tick: int):
+        if tick == 0:
+            return 0
+        target_tempo = SimpleNamespace()
+        target_tempo.ticks = tick
+        base_tempo_index = max(lower_than(song_proto.tempos, target_tempo, lambda x: x.ticks), 0)
+        base_tempo_change = song_proto.tempos[base_tempo_index]
+        return base_tempo_change.time + (tick - base_tempo_change.ticks) / \
+            Song._tempo_bpm_to_ticks_per_second(base_tempo_change.bpm, song.get_resolution())
+
+    for index, instrument in enumerate(midi_obj.instruments):
+        track_proto = song_proto.tracks.add(uuid=Track._generate_track_id(), rank=index)
+        clip_proto = track_proto.clips.add(id=Clip._generate_clip_id(), clip_start_tick=0)
+        add_note_proto = timer.wrap(clip_proto.notes.add)
+        for note in instrument.notes:
+            start_tick = round(note.start * ppq_scale_factor)
+            end_tick = round(note.end * ppq_scale_factor)
+            add_note_proto(
+                pitch=note.pitch, velocity=note.velocity, start_tick=start_tick,
+                start_time=tick_to_seconds(start_tick), end_tick=end_tick, end_time=tick_to_seconds(end_tick))
+        clip_proto.clip_start_tick = min(clip_proto.notes, key=lambda x: x.start_tick).start_tick
+        clip_proto.clip_end_tick = max(clip_proto.notes, key=lambda x: x.end_tick).end_tick
+    return song
+
+
+def import_in_bulk(midi_obj: MidiFile, timer: PhaseTimer):
+    add_note_protos = Clip._add_note_protos
+    Clip._add_note_protos = staticmethod(timer.wrap(add_note_protos))  # type: ignore
+    try:
+        return Song.from_midi(midi_obj)
+    finally:
+        Clip._add_note_protos = staticmethod(add_note_protos)  # type: ignore
+
+
+def get_best_durations(import_function, midi_obj: MidiFile, repeat: int):
+    '''
+    Returns the total duration and the duration of building note messages of the fastest of several imports,
+    both phases are timed within the same import.
+    '''
+    durations = []
+    for _ in range(repeat):
+        timer = PhaseTimer()
+        start_time = time.perf_counter()
+        import_function(midi_obj, timer)
+        durations.append((time.perf_counter() - start_time, timer.duration))
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks Song.from_midi.')
+    parser.add_argument('--tracks', type=int, default=16)
+    parser.add_argument('--notes-per-track', type=int, default=7000)
+    parser.add_argument('--tempos', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    midi_obj = create_midi(args.tracks, args.notes_per_track, args.tempos)
+    print(f'protobuf backend: {api_implementation.Type()}')
+    print(f'{args.tracks} tracks, {args.tracks * args.notes_per_track} notes, {args.tempos} tempo changes, '
+          f'best of {args.repeat}')
+    per_note_duration, per_note_construction_duration = get_best_durations(
+        import_per_note, midi_obj, repeat=args.repeat)
+    bulk_duration, bulk_construction_duration = get_best_durations(import_in_bulk, midi_obj, repeat=args.repeat)
+    per_note_rest_duration = per_note_duration - per_note_construction_duration
+    bulk_rest_duration = bulk_duration - bulk_construction_duration
+    print(f'per-note import: {per_note_duration:.2f}s, of which building note messages: '
+          f'{per_note_construction_duration:.2f}s')
+    print(f'Song.from_midi:  {bulk_duration:.2f}s, of which building note messages: '
+          f'{bulk_construction_duration:.2f}s')
+    print(f'end to end:                 {per_note_duration / bulk_duration:.1f}x')
+    print(f'building note messages:     {per_note_construction_duration / bulk_construction_duration:.1f}x')
+    print(f'everything else:            {per_note_rest_duration:.2f}s -> {bulk_rest_duration:.2f}s '
+          f'({per_note_rest_duration / bulk_rest_duration:.1f}x)')
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from tuneflow_py.base_plugin import TuneflowPlugin
+from tuneflow_py.audio_blob_store import AudioBlobStore, LocalAudioBlobStore
 from tuneflow_py.models.audio_plugin import AudioPlugin, get_audio_plugin_tuneflow_id, are_tuneflow_ids_equal, are_tuneflow_ids_equal_ignore_version, decode_audio_plugin_tuneflow_id
 from tuneflow_py.models.automation import AutomationTarget, AutomationTargetType, AutomationData, AutomationPoint, AutomationValue
 from tuneflow_py.models.clip import ClipType, Clip
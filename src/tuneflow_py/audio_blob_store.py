@@ -0,0 +1,99 @@
+from __future__ import annotations
+from hashlib import sha256
+from pathlib import Path
+import mmap
+import os
+import tempfile
+
+
+class AudioBlobStore:
+    '''
+    The base class of a content-addressed store of audio data.
+
+    When a song is serialized with a store, the audio data of its clips is put into the store and
+    the serialized song only contains references to it, so the same audio is stored once no matter
+    how many clips share it, and it is not copied into the serialized song.
+
+    If the song itself is given a store, it is used whenever the song is serialized or saved, and references
+    to the store in `audio_data.data` are resolved by `Clip.get_audio_data`.
+    '''
+
+    REFERENCE_PREFIX = b'tuneflow-audio-blob:sha256:'
+    '''
+    The prefix of the references that replace the audio data in serialized songs.
+    '''
+
+    def put(self, data) -> str:
+        '''
+        Stores the data if it is not already stored and returns its key.
+
+        @param data A bytes-like object.
+        '''
+        raise Exception("put must be overwritten.")
+
+    def get(self, key: str):
+        '''
+        Returns a read-only bytes-like object of the data stored under the key.
+        '''
+        raise Exception("get must be overwritten.")
+
+    @staticmethod
+    def get_key(data) -> str:
+        return sha256(data).hexdigest()
+
+    @staticmethod
+    def to_reference(key: str) -> bytes:
+        return AudioBlobStore.REFERENCE_PREFIX + key.encode('ascii')
+
+    @staticmethod
+    def is_reference(data) -> bool:
+        return data[:len(AudioBlobStore.REFERENCE_PREFIX)] == AudioBlobStore.REFERENCE_PREFIX
+
+    @staticmethod
+    def get_key_from_reference(reference) -> str:
+        return bytes(reference[len(AudioBlobStore.REFERENCE_PREFIX):]).decode('ascii')
+
+
+class LocalAudioBlobStore(AudioBlobStore):
+    '''
+    Stores audio data as files in a local directory, named by the SHA-256 of their content.
+    '''
+
+    def __init__(self, directory: str) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def put(self, data) -> str:
+        key = AudioBlobStore.get_key(data)
+        path = self._get_path(key)
+        if path.exists():
+            return key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that readers never see a partial blob.
+        file_descriptor, temp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return key
+
+    def get(self, key: str):
+        '''
+        Returns a read-only memory map of the stored data, the data is only read from disk when it is accessed.
+        '''
+        path = self._get_path(key)
+        if not path.exists():
+            raise Exception(f'Audio blob {key} is not found in {self.directory}.')
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # Empty files cannot be memory-mapped.
+                return b''
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _get_path(self, key: str):
+        if len(key) != 64 or any(character not in '0123456789abcdef' for character in key):
+            raise Exception(f'Invalid audio blob key {key}.')
+        return self.directory / key[:2] / key
@@ -0,0 +1,304 @@
+'''
+Runs a plugin over a directory of songs, one song per task in a pool of processes.
+
+Songs are either files saved by `Song.save`, or base64-serialized songs from `Song.serialize`, e.g. as sent
+by the TuneFlow desktop app, which are read and written as text files.
+
+Only file paths are sent to the workers, each worker loads, processes and saves its song by itself,
+so songs are never pickled between processes.
+
+From the command line:
+
+```
+python -m tuneflow_py.batch_runner my_plugins.analyzer:Analyzer songs/ --output-directory out/ --timeout 60
+```
+'''
+from __future__ import annotations
+from tuneflow_py.base_plugin import TuneflowPlugin
+from tuneflow_py.models.song import Song
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List, Type
+from typing_extensions import TypedDict, NotRequired
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+SONG_FORMATS = ['file', 'base64']
+'''
+The formats of song files, 'file' for `Song.save` and 'base64' for `Song.serialize`.
+'''
+
+_STARTED_POLL_INTERVAL = 0.1
+'''
+How often in seconds the deadlines of songs are checked while waiting for songs to start.
+'''
+
+
+class BatchRunResult(TypedDict):
+    path: str
+    '''
+    The path of the input song.
+    '''
+
+    output_path: NotRequired[str]
+    '''
+    Where the processed song is saved, only set if an output directory is given.
+    '''
+
+    result: NotRequired[Any]
+    '''
+    What `run` of the plugin returns, only set if the plugin succeeds.
+    '''
+
+    error: NotRequired[str]
+    '''
+    The error if the plugin fails or times out.
+    '''
+
+    duration: float
+    '''
+    How long it takes to load, process and save the song in seconds.
+    '''
+
+
+def run_plugin_on_directory(plugin_class: Type[TuneflowPlugin],
+                            input_directory: str,
+                            params: Dict[str, Any] | None = None,
+                            output_directory: str | None = None,
+                            pattern='*.tfsong',
+                            max_workers: int | None = None,
+                            timeout: float | None = None,
+                            compression: str | None = None,
+                            lazy=False,
+                            song_format='file') -> List[BatchRunResult]:
+    '''
+    Runs a plugin on every song in a directory that matches the pattern.
+
+    @param plugin_class The plugin class, which must be importable by the worker processes.
+    @param params Overrides the default values of the params of the plugin, which are collected for each song.
+    @param output_directory If provided, each processed song is saved there under its input file name.
+    @param max_workers The number of worker processes, defaults to the number of CPUs.
+    @param timeout The time limit of each song in seconds, counted from when a worker starts on the song.
+    A worker that exceeds it is terminated and the other songs that were in progress are restarted in new workers.
+    @param compression How processed songs are saved, same as in `Song.save`. Only used for the 'file' format.
+    @param lazy Whether songs are loaded lazily, same as in `Song.load`.
+    @param song_format One of `SONG_FORMATS`, processed songs are saved in the same format.
+    @returns The results in the order of the input paths.
+    '''
+    paths = sorted(str(path) for path in Path(input_directory).glob(pattern) if path.is_file())
+    return run_plugin_on_paths(plugin_class, paths, params=params, output_directory=output_directory,
+                               max_workers=max_workers, timeout=timeout, compression=compression, lazy=lazy,
+                               song_format=song_format)
+
+
+def run_plugin_on_paths(plugin_class: Type[TuneflowPlugin],
+                        paths: List[str],
+                        params: Dict[str, Any] | None = None,
+                        output_directory: str | None = None,
+                        max_workers: int | None = None,
+                        timeout: float | None = None,
+                        compression: str | None = None,
+                        lazy=False,
+                        song_format='file') -> List[BatchRunResult]:
+    '''
+    Same as `run_plugin_on_directory` but with a list of song paths.
+    '''
+    if song_format not in SONG_FORMATS:
+        raise Exception(f'Unsupported song format {song_format}, expected one of {SONG_FORMATS}.')
+    if song_format != 'file' and compression is not None:
+        raise Exception(f'Compression is not supported for the {song_format} format.')
+    if output_directory is not None:
+        Path(output_directory).mkdir(parents=True, exist_ok=True)
+    results: List[BatchRunResult | None] = [None] * len(paths)
+    max_workers = max_workers or os.cpu_count() or 1
+    mp_context = multiprocessing.get_context()
+    pending_indexes = list(range(len(paths)))
+    # Each iteration runs a pool until all songs are processed, or until a song times out or a worker crashes,
+    # in which case the workers are terminated and the unfinished songs are run in a new pool.
+    while len(pending_indexes) > 0:
+        started_queue = None if timeout is None else mp_context.SimpleQueue()
+        # Workers started by spawn, the default on macOS and Windows, do not inherit the changes of `sys.path`
+        # made by this process, so the plugin module would not be importable there.
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context, initializer=_initialize_worker,
+                                       initargs=(list(sys.path), started_queue))
+        # Only as many songs as there are workers are submitted, so each song starts as soon as it is submitted.
+        index_by_future = {}
+        deadline_by_index: Dict[int, float] = {}
+        needs_new_pool = False
+        try:
+            while not needs_new_pool and (len(pending_indexes) > 0 or len(index_by_future) > 0):
+                while len(pending_indexes) > 0 and len(index_by_future) < max_workers:
+                    index = pending_indexes.pop(0)
+                    output_path = None if output_directory is None else \
+                        str(Path(output_directory) / Path(paths[index]).name)
+                    try:
+                        future = executor.submit(
+                            _run_plugin_on_path, index, plugin_class, paths[index], params, output_path, compression,
+                            lazy, song_format)
+                    except BrokenProcessPool:
+                        pending_indexes.insert(0, index)
+                        needs_new_pool = True
+                        break
+                    index_by_future[future] = index
+                if len(index_by_future) == 0:
+                    continue
+                done_futures, _ = wait(index_by_future, timeout=_get_wait_timeout(
+                    timeout, index_by_future.values(), deadline_by_index), return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    index = index_by_future.pop(future)
+                    try:
+                        results[index] = future.result()
+                    except Exception as e:
+                        # The worker crashed or the result cannot be pickled.
+                        results[index] = {'path': paths[index], 'error': repr(e), 'duration': 0.0}
+                        needs_new_pool = needs_new_pool or isinstance(e, BrokenProcessPool)
+                if started_queue is None:
+                    continue
+                while not started_queue.empty():
+                    index, start_time = started_queue.get()
+                    deadline_by_index[index] = start_time + timeout
+                for future, index in list(index_by_future.items()):
+                    if index in deadline_by_index and time.time() >= deadline_by_index[index]:
+                        del index_by_future[future]
+                        results[index] = {
+                            'path': paths[index],
+                            'error': f'TimeoutError: The song is not processed within {timeout} seconds.',
+                            'duration': timeout,
+                        }
+                        needs_new_pool = True
+        finally:
+            if needs_new_pool:
+                # Songs still in progress are processed again from the start.
+                pending_indexes[:0] = sorted(index_by_future.values())
+                _terminate_workers(executor)
+            executor.shutdown(wait=not needs_new_pool, cancel_futures=True)
+    return results  # type: ignore
+
+
+def _get_wait_timeout(timeout: float | None, running_indexes, deadline_by_index: Dict[int, float]):
+    '''
+    Gets how long to wait for a song to finish before checking the deadlines again.
+    '''
+    if timeout is None:
+        return None
+    wait_timeout = None
+    for index in running_indexes:
+        # Poll for songs that are not started yet, since their deadlines are not known.
+        remaining_time = deadline_by_index[index] - time.time() if index in deadline_by_index else \
+            _STARTED_POLL_INTERVAL
+        wait_timeout = remaining_time if wait_timeout is None else min(wait_timeout, remaining_time)
+    return None if wait_timeout is None else max(wait_timeout, 0)
+
+
+def _terminate_workers(executor: ProcessPoolExecutor):
+    terminate_workers = getattr(executor, 'terminate_workers', None)
+    if terminate_workers is not None:
+        terminate_workers()
+        return
+    # Before Python 3.14, the executor does not expose its worker processes.
+    for process in list((executor._processes or {}).values()):  # type: ignore
+        process.terminate()
+
+
+_started_queue = None
+'''
+Where a worker reports the index of each song and when it starts processing it.
+'''
+
+
+def _initialize_worker(parent_sys_path: List[str], started_queue):
+    global _started_queue
+    _started_queue = started_queue
+    for path in reversed(parent_sys_path):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def _run_plugin_on_path(index: int, plugin_class: Type[TuneflowPlugin], path: str, params: Dict[str, Any] | None,
+                        output_path: str | None, compression: str | None, lazy: bool,
+                        song_format: str) -> BatchRunResult:
+    if _started_queue is not None:
+        _started_queue.put((index, time.time()))
+    start_time = time.perf_counter()
+    run_result: BatchRunResult = {'path': path, 'duration': 0.0}
+    try:
+        if song_format == 'base64':
+            song = Song.deserialize(Path(path).read_text(encoding='ascii').strip(), lazy=lazy)
+        else:
+            song = Song.load(path, lazy=lazy)
+        song_params = plugin_class._get_default_params(plugin_class.params(song))
+        if params is not None:
+            song_params.update(params)
+        run_result['result'] = plugin_class.run(song, song_params)
+        if output_path is not None:
+            if song_format == 'base64':
+                _write_text_atomically(output_path, song.serialize())
+            else:
+                song.save(output_path, compression=compression)
+            run_result['output_path'] = output_path
+    except Exception:
+        run_result.pop('result', None)
+        run_result['error'] = traceback.format_exc()
+    run_result['duration'] = time.perf_counter() - start_time
+    return run_result
+
+
+def _write_text_atomically(path: str, text: str):
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(file_descriptor, 'w', encoding='ascii') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _load_plugin_class(plugin_class_path: str) -> Type[TuneflowPlugin]:
+    '''
+    @param plugin_class_path The module and the name of the plugin class, e.g. `my_plugins.analyzer:Analyzer`.
+    '''
+    module_name, _, class_name = plugin_class_path.partition(':')
+    if class_name == '':
+        raise Exception(f'Expected the plugin class in the form of module:ClassName, got {plugin_class_path}.')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description='Runs a TuneFlow plugin over a directory of songs.')
+    parser.add_argument('plugin', help='The plugin class in the form of module:ClassName.')
+    parser.add_argument('input_directory', help='The directory of songs.')
+    parser.add_argument('--output-directory', help='Where to save the processed songs.')
+    parser.add_argument('--params', help='A JSON object overriding the default params of the plugin.')
+    parser.add_argument('--pattern', default='*.tfsong', help='The pattern of song file names.')
+    parser.add_argument('--workers', type=int, help='The number of worker processes.')
+    parser.add_argument('--timeout', type=float, help='The time limit of each song in seconds.')
+    parser.add_argument('--compression', choices=list(Song.FILE_COMPRESSION_CODES.keys()),
+                        help='How the processed songs are compressed.')
+    parser.add_argument('--lazy', action='store_true', help='Load the content of tracks only when accessed.')
+    parser.add_argument('--format', choices=SONG_FORMATS, default='file',
+                        help='file for songs saved by Song.save, base64 for songs serialized by Song.serialize.')
+    args = parser.parse_args(argv)
+    if '' not in sys.path:
+        # Makes plugins in the current directory importable, as with `python -m`.
+        sys.path.insert(0, '')
+    results = run_plugin_on_directory(
+        _load_plugin_class(args.plugin), args.input_directory,
+        params=None if args.params is None else json.loads(args.params),
+        output_directory=args.output_directory, pattern=args.pattern, max_workers=args.workers,
+        timeout=args.timeout, compression=args.compression, lazy=args.lazy, song_format=args.format)
+    for result in results:
+        print(json.dumps(result, default=repr))
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
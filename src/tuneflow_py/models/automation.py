@@ -1,9 +1,11 @@
 from __future__ import annotations
 from tuneflow_py.models.protos import song_pb2
-from tuneflow_py.utils import greater_equal, greater_than, lower_than
+from tuneflow_py.utils import greater_equal, greater_than, lower_than, remove_where, sort_by_keys
 from types import SimpleNamespace
-from typing import List
+from typing import Dict, List
 from typing_extensions import TypedDict, Required, Any
+import math
+import numpy as np
 
 AutomationTargetType = song_pb2.AutomationTarget.TargetType
 
@@ -121,7 +123,11 @@ class AutomationValue:
     The points and settings of an automation param.
     '''
 
-    def __init__(self, proto: song_pb2.AutomationValue | None = None):
+    def __init__(self, proto: song_pb2.AutomationValue | None = None, song=None):
+        '''
+        @param song The song that the automation belongs to, if provided, sorting points is deferred in its batch mode.
+        '''
+        self.song = song
         if proto is not None:
             self._proto = proto
         else:
@@ -136,9 +142,11 @@ class AutomationValue:
         self._proto.disabled = is_disabled
 
     def get_points(self) -> List[AutomationPoint]:
+        self._flush_pending_sorts()
         return self._proto.points
 
     def get_points_in_range(self, start_tick: int, end_tick: int):
+        self._flush_pending_sorts()
         target_point = SimpleNamespace()
         target_point.tick = start_tick
         start_index = greater_equal(
@@ -155,10 +163,47 @@ class AutomationValue:
 
         return results
 
+    def sample(self, ticks: np.ndarray, default_value: float = np.nan) -> np.ndarray:
+        '''
+        Evaluates the automation curve at the given ticks in one pass.
+
+        Values are linearly interpolated between points and held before the first point and after
+        the last point. Where several points are at the same tick, the curve jumps at that tick and
+        takes the value of the last of them.
+
+        @param ticks An array of ticks of any shape, ticks can be fractional.
+        @param default_value The value returned everywhere if the automation is disabled or has no points,
+        e.g. the volume of the track when sampling its volume automation.
+        @returns A float64 array of the same shape.
+        '''
+        ticks = np.asarray(ticks, dtype=np.float64)
+        if self._proto.disabled or len(self._proto.points) == 0:
+            return np.full(ticks.shape, default_value, dtype=np.float64)
+        point_ticks, point_values = self._get_point_arrays()
+        right_indices = np.searchsorted(point_ticks, ticks, side='right')
+        left_indices = np.maximum(right_indices - 1, 0)
+        right_indices = np.minimum(right_indices, len(point_ticks) - 1)
+        left_ticks = point_ticks[left_indices]
+        left_values = point_values[left_indices]
+        tick_spans = point_ticks[right_indices] - left_ticks
+        ratios = np.divide(ticks - left_ticks, tick_spans, out=np.zeros(ticks.shape), where=tick_spans > 0)
+        return left_values + (point_values[right_indices] - left_values) * ratios
+
+    def sample_seconds(self, seconds: np.ndarray, default_value: float = np.nan) -> np.ndarray:
+        '''
+        Same as `sample` but at the given times in seconds, converted with the tempo map of the song.
+
+        @param seconds An array of seconds of any shape.
+        '''
+        if self.song is None:
+            raise Exception('The automation must belong to a song to be sampled in seconds.')
+        return self.sample(self.song._get_tempo_map().seconds_to_fractional_ticks_array(seconds), default_value)
+
     def add_point(self, tick: int, value: float, overwrite=False):
         '''
         @param overwrite Whether to overwrite the points at the insert tick.
         '''
+        self._flush_pending_sorts()
         new_point = song_pb2.AutomationValue.ParamValue(
             tick=tick,
             value=max(0, min(1, value)),
@@ -166,15 +211,86 @@ class AutomationValue:
         )
         return self._ordered_insert_point(self._proto.points, new_point, overwrite)
 
+    def add_points(self, ticks, values, overwrite=False) -> List[song_pb2.AutomationValue.ParamValue]:
+        '''
+        Adds points given as parallel arrays and returns the added points.
+
+        This is equivalent to calling `add_point` for each point in order, but the points are
+        merged into the existing points in a single pass.
+
+        @param ticks Integer values indicating the ticks of the points.
+        @param values Float values between 0 - 1, values out of the range are clamped.
+        @param overwrite Whether to overwrite the points at the ticks of the new points, including the new points
+        added earlier in the same call.
+        @returns The added points in the order they are given, points overwritten by later points are skipped.
+        '''
+        self._flush_pending_sorts()
+        ticks = np.asarray(ticks, dtype=np.int64)
+        values = np.clip(np.asarray(values, dtype=np.float64), 0, 1)
+        num_new_points = len(ticks)
+        if num_new_points == 0:
+            return []
+        ids = np.asarray(self._get_next_point_ids(num_new_points), dtype=np.int64)
+        points = self._proto.points
+        target_point = SimpleNamespace()
+        target_point.tick = int(ticks.min())
+        # Only the points at or after the earliest new point need to be merged.
+        merge_start_index = greater_equal(points, target_point, lambda x: x.tick)
+        existing_ticks = np.fromiter(
+            (points[index].tick for index in range(merge_start_index, len(points))),
+            dtype=np.int64, count=len(points) - merge_start_index)
+        if overwrite:
+            # Only the last new point at each tick is kept, and it replaces the existing points at the tick.
+            _, last_occurrence_indices = np.unique(ticks[::-1], return_index=True)
+            kept_indices = np.sort(num_new_points - 1 - last_occurrence_indices)
+            ticks, values, ids = ticks[kept_indices], values[kept_indices], ids[kept_indices]
+            is_existing_point_overwritten = np.isin(existing_ticks, ticks)
+            remove_where(points, [False] * merge_start_index + is_existing_point_overwritten.tolist())
+            existing_ticks = existing_ticks[~is_existing_point_overwritten]
+            num_new_points = len(ticks)
+        # A new point is inserted before all points at the same tick, so
+        # reversing the new points and placing them first mimics inserting them one by one.
+        merge_order = np.argsort(np.concatenate([ticks[::-1], existing_ticks]), kind='stable')
+        merged_positions = np.empty(len(merge_order), dtype=np.int64)
+        merged_positions[merge_order] = np.arange(merge_start_index, merge_start_index + len(merge_order))
+        # The new points are appended and then sorted into place, which does not copy the existing points.
+        add_point_proto = points.add
+        added_points = [
+            add_point_proto(tick=tick, value=value, id=id)
+            for tick, value, id in zip(ticks.tolist(), values.tolist(), ids.tolist())]
+        sort_by_keys(points, list(range(merge_start_index)) + np.concatenate(
+            [merged_positions[num_new_points:], merged_positions[num_new_points - 1::-1]]).tolist())
+        return added_points
+
     def remove_points(self, point_ids: List[int]):
         '''
         Remove points that match the given ids.
+
+        @returns The number of removed points.
         '''
-        id_set = set(point_ids)
-        for i in range(len(self._proto.points)-1, -1, -1):
-            point = self._proto.points[i]
-            if point.id in id_set:
-                self._proto.points.pop(i)
+        id_set = set(np.asarray(point_ids, dtype=np.int64).tolist())
+        if len(id_set) == 0:
+            return 0
+        return self._remove_points_where([point.id in id_set for point in self._proto.points])
+
+    def remove_points_where(self, predicate_or_mask) -> int:
+        '''
+        Removes the points that match the given predicate or mask in one pass.
+
+        @param predicate_or_mask Either a function that takes a point and returns whether to remove it, or
+        a boolean array with one value per point in the order of `get_points`, e.g. computed with `sample`.
+        @returns The number of removed points.
+        '''
+        self._flush_pending_sorts()
+        if callable(predicate_or_mask):
+            remove_mask = [bool(predicate_or_mask(point)) for point in self._proto.points]
+        else:
+            remove_mask = np.asarray(predicate_or_mask, dtype=bool)
+            if remove_mask.shape != (len(self._proto.points),):
+                raise Exception(
+                    f'Point mask must have one value per point, expected {len(self._proto.points)} but got {remove_mask.shape}')
+            remove_mask = remove_mask.tolist()
+        return self._remove_points_where(remove_mask)
 
     def remove_points_in_range(self, start_tick: int, end_tick: int):
         '''
@@ -182,6 +298,7 @@ class AutomationValue:
         @param start_tick Inclusive
         @param end_tick Inclusive
         '''
+        self._flush_pending_sorts()
         target_point = SimpleNamespace()
         target_point.tick = start_tick
         start_index = greater_equal(
@@ -197,6 +314,25 @@ class AutomationValue:
             end_index += 1
         del self._proto.points[start_index:end_index+1]
 
+    def simplify(self, tolerance: float) -> int:
+        '''
+        Removes points that are not needed to keep the curve within `tolerance` of the original curve,
+        using the Ramer-Douglas-Peucker algorithm over (tick, value).
+
+        The deviation is measured in value at the same tick, so `sample` of the simplified curve differs
+        from `sample` of the original curve by at most `tolerance` at any tick. The first and last points
+        and the points where the curve jumps, i.e. the first and last of several points at the same tick,
+        are always kept.
+
+        @param tolerance The maximum deviation in value, e.g. 1 / 127 for curves recorded from MIDI CCs.
+        @returns The number of removed points.
+        '''
+        if tolerance < 0:
+            raise Exception('tolerance must not be negative.')
+        point_ticks, point_values = self._get_point_arrays()
+        keep_mask = AutomationValue._get_simplified_point_mask(point_ticks, point_values, tolerance)
+        return self._remove_points_where((~keep_mask).tolist())
+
     def move_points_in_range(
         self,
         start_tick: int,
@@ -234,6 +370,9 @@ class AutomationValue:
         if (len(point_ids) == 0):
             return
 
+        if overwrite_values_in_drag_area:
+            # The drag area is located by the order of the points.
+            self._flush_pending_sorts()
         point_id_set = set(point_ids)
         drag_area_left_index = None
         drag_area_right_index = None
@@ -289,27 +428,97 @@ class AutomationValue:
 
         # Maintain the order of points.
         if (abs(offset_tick) > 0):
-            self._proto.points.sort(key=lambda x: x.tick)
+            if self.song is not None:
+                self.song._sort_or_defer(self._proto.points, AutomationValue._get_point_tick)
+            else:
+                self._proto.points.sort(key=AutomationValue._get_point_tick)
 
     def clone(self):
+        self._flush_pending_sorts()
         new_proto = song_pb2.AutomationValue()
         new_proto.CopyFrom(self._proto)
-        return AutomationValue(proto=new_proto)
+        return AutomationValue(proto=new_proto, song=self.song)
+
+    def _flush_pending_sorts(self):
+        if self.song is not None:
+            self.song._flush_pending_sorts()
+
+    def _remove_points_where(self, remove_mask: List[bool]) -> int:
+        '''
+        Removes the points whose mask value is True in place, see `remove_where`.
+        '''
+        return remove_where(self._proto.points, remove_mask)
+
+    @staticmethod
+    def _get_simplified_point_mask(point_ticks: np.ndarray, point_values: np.ndarray, tolerance: float) -> np.ndarray:
+        '''
+        Gets which of the sorted points are kept by `simplify`.
+        '''
+        num_points = len(point_ticks)
+        keep_mask = np.ones(num_points, dtype=bool)
+        if num_points <= 2:
+            return keep_mask
+        keep_mask[1:-1] = False
+        # The first and last of several points at the same tick.
+        is_same_tick_as_previous = np.zeros(num_points, dtype=bool)
+        is_same_tick_as_previous[1:] = point_ticks[1:] == point_ticks[:-1]
+        is_same_tick_as_next = np.zeros(num_points, dtype=bool)
+        is_same_tick_as_next[:-1] = is_same_tick_as_previous[1:]
+        keep_mask |= is_same_tick_as_previous ^ is_same_tick_as_next
+        anchor_indices = np.flatnonzero(keep_mask).tolist()
+        segments = [
+            (start_index, end_index) for start_index, end_index in zip(anchor_indices[:-1], anchor_indices[1:])
+            if end_index - start_index > 1 and point_ticks[start_index] != point_ticks[end_index]]
+        while len(segments) > 0:
+            start_index, end_index = segments.pop()
+            start_tick = point_ticks[start_index]
+            start_value = point_values[start_index]
+            interpolated_values = start_value + (point_values[end_index] - start_value) * (
+                point_ticks[start_index + 1:end_index] - start_tick) / (point_ticks[end_index] - start_tick)
+            deviations = np.abs(point_values[start_index + 1:end_index] - interpolated_values)
+            max_deviation_index = int(np.argmax(deviations))
+            if deviations[max_deviation_index] <= tolerance:
+                continue
+            split_index = start_index + 1 + max_deviation_index
+            keep_mask[split_index] = True
+            if split_index - start_index > 1:
+                segments.append((start_index, split_index))
+            if end_index - split_index > 1:
+                segments.append((split_index, end_index))
+        return keep_mask
+
+    def _get_point_arrays(self):
+        self._flush_pending_sorts()
+        point_protos = self._proto.points
+        point_ticks = np.fromiter((point.tick for point in point_protos), dtype=np.float64, count=len(point_protos))
+        point_values = np.fromiter((point.value for point in point_protos), dtype=np.float64, count=len(point_protos))
+        return point_ticks, point_values
+
+    @staticmethod
+    def _get_point_tick(point: song_pb2.AutomationValue.ParamValue):
+        return point.tick
 
     def _get_next_point_id(self):
+        return self._get_next_point_ids(1)[0]
+
+    def _get_next_point_ids(self, count: int):
+        '''
+        Gets `count` consecutive new point ids, which wrap around to 1 after the max int32 value.
+        '''
         if self._next_point_id is None:
             if len(self._proto.points) == 0:
                 self._next_point_id = 1
             else:
                 self._next_point_id = max([point.id for point in self._proto.points]) + 1
 
-        point_id = self._next_point_id
-        if (self._next_point_id >= 2147483647):
-            self._next_point_id = 1
-        else:
-            self._next_point_id += 1
-
-        return point_id
+        point_ids = []
+        while len(point_ids) < count:
+            num_point_ids = min(count - len(point_ids), max(2147483647 - self._next_point_id + 1, 1))
+            point_ids.extend(range(self._next_point_id, self._next_point_id + num_point_ids))
+            self._next_point_id += num_point_ids
+            if self._next_point_id > 2147483647:
+                self._next_point_id = 1
+        return point_ids
 
     def __eq__(self, __value: AutomationValue) -> bool:
         return self._proto == __value._proto
@@ -354,7 +563,11 @@ class AutomationData:
     * the same automation value.
     '''
 
-    def __init__(self, proto: song_pb2.AutomationData | None = None):
+    def __init__(self, proto: song_pb2.AutomationData | None = None, song=None):
+        '''
+        @param song The song that the automation belongs to, passed on to the automation values.
+        '''
+        self.song = song
         if proto is not None:
             self._proto = proto
         else:
@@ -382,7 +595,7 @@ class AutomationData:
         @param tf_automation_target_id The targetId that can be retrieved from `AutomationTarget.prototype.toTfAutomationTargetId` or `AutomationTarget.encodeAutomationTarget`.
         @returns The automation value of the given target if exists, otherwise creates a new one and returns it.
         '''
-        return AutomationValue(proto=self._proto.target_values[tf_automation_target_id])
+        return AutomationValue(proto=self._proto.target_values[tf_automation_target_id], song=self.song)
 
     def get_automation_value_by_id(self, tf_automation_target_id: str):
         '''
@@ -391,7 +604,7 @@ class AutomationData:
         '''
         if tf_automation_target_id not in self._proto.target_values:
             return None
-        return AutomationValue(proto=self._proto.target_values[tf_automation_target_id])
+        return AutomationValue(proto=self._proto.target_values[tf_automation_target_id], song=self.song)
 
     def get_automation_value_by_target(self, target: AutomationTarget):
         tf_automation_target_id = target.to_tf_automation_target_id()
@@ -441,7 +654,7 @@ class AutomationData:
         @param end_tick Inclusive
         '''
         for tf_automation_target_id in self._proto.target_values:
-            automation_value = AutomationValue(proto=self._proto.targetValues[tf_automation_target_id])
+            automation_value = AutomationValue(proto=self._proto.target_values[tf_automation_target_id], song=self.song)
             automation_value.remove_points_in_range(start_tick, end_tick)
 
     def move_all_points_within_range(
@@ -456,7 +669,7 @@ class AutomationData:
         @param end_tick Inclusive
         '''
         for tf_automation_target_id in self._proto.target_values:
-            automation_value = AutomationValue(proto=self._proto.targetValues[tf_automation_target_id])
+            automation_value = AutomationValue(proto=self._proto.target_values[tf_automation_target_id], song=self.song)
             automation_value.move_points_in_range(
                 start_tick,
                 end_tick,
@@ -465,10 +678,59 @@ class AutomationData:
                 overwrite_values_in_drag_area=False,
             )
 
+    def sample_all(self, ticks: np.ndarray) -> Dict[str, np.ndarray]:
+        '''
+        Samples all automated targets at the same ticks, see `AutomationValue.sample`.
+
+        Targets that are disabled or have no points are not automated and are left out.
+
+        @returns The sampled values by the `tf_automation_target_id` of each target.
+        '''
+        envelopes = {}
+        for tf_automation_target_id in self._proto.target_values:
+            value_proto = self._proto.target_values[tf_automation_target_id]
+            if value_proto.disabled or len(value_proto.points) == 0:
+                continue
+            envelopes[tf_automation_target_id] = AutomationValue(proto=value_proto, song=self.song).sample(ticks)
+        return envelopes
+
+    def render_envelopes(self, sample_rate: int, num_samples: int | None = None, block_size: int | None = None,
+                         start_seconds=0.0) -> Dict[str, np.ndarray]:
+        '''
+        Renders the envelopes of all automated targets in the time of the song, e.g. for offline rendering.
+
+        @param sample_rate The number of samples per second.
+        @param num_samples The number of samples to render, defaults to the duration of the song.
+        @param block_size If provided, renders one value per block of samples, taken at the start of the block,
+        otherwise renders one value per sample.
+        @param start_seconds The time of the first sample.
+        @returns The envelopes by the `tf_automation_target_id` of each automated target,
+        see `AutomationTarget.decode_automation_target` to get the target back.
+        '''
+        if self.song is None:
+            raise Exception('The automation must belong to a song to render envelopes.')
+        return self.sample_all(AutomationData.get_render_ticks(self.song, sample_rate, num_samples, block_size,
+                                                               start_seconds))
+
     def clone(self):
         '''
         Creates a clone of this automation data.
         '''
+        if self.song is not None:
+            self.song._flush_pending_sorts()
         new_proto = song_pb2.AutomationData()
         new_proto.CopyFrom(self._proto)
-        return AutomationData(proto=new_proto)
+        return AutomationData(proto=new_proto, song=self.song)
+
+    @staticmethod
+    def get_render_ticks(song, sample_rate: int, num_samples: int | None = None, block_size: int | None = None,
+                         start_seconds=0.0) -> np.ndarray:
+        '''
+        Gets the fractional ticks of the samples or blocks rendered by `render_envelopes`, so that
+        they can be converted once and shared by several `sample_all` calls.
+        '''
+        if num_samples is None:
+            num_samples = max(math.ceil((song.get_duration() - start_seconds) * sample_rate), 0)
+        step = 1 if block_size is None else block_size
+        seconds = start_seconds + np.arange(0, num_samples, step, dtype=np.float64) / sample_rate
+        return song._get_tempo_map().seconds_to_fractional_ticks_array(seconds)
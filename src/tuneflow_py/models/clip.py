@@ -1,11 +1,14 @@
 from __future__ import annotations
 from tuneflow_py.descriptors.clip_descriptor import AudioClipData
+from tuneflow_py.audio_blob_store import AudioBlobStore
 from tuneflow_py.models.protos import song_pb2
 from tuneflow_py.models.note import Note
-from tuneflow_py.utils import lower_than, greater_than, greater_equal
+from tuneflow_py.models.song_wire_format import copy_without_field
+from tuneflow_py.utils import lower_than, greater_than, greater_equal, remove_where, sort_by_keys
 from nanoid import generate as generate_nanoid
 from typing import List
 from types import SimpleNamespace
+import numpy as np
 
 
 ClipType = song_pb2.ClipType
@@ -30,6 +33,8 @@ class Clip:
         self.song = song
         self.track = track
         self._next_note_id = None
+        # The tempo version the notes were last timed at, only used if the clip is not in a track.
+        self._note_times_version = None
         if proto is not None:
             self._proto = proto
             return
@@ -203,6 +208,7 @@ class Clip:
         )
         self._proto.clip_end_tick = Clip._calculate_scaled_new_tick(
             self.get_clip_end_tick(), reference_tick, stretch_factor)
+        self._on_clip_range_changed()
 
     def _time_stretch_audio_clip(
             self,
@@ -233,6 +239,7 @@ class Clip:
         audio_clip_data.start_tick = new_audio_start_tick
         self._proto.clip_start_tick = new_left_tick
         self._proto.clip_end_tick = new_right_tick
+        self._on_clip_range_changed()
 
     @staticmethod
     def validate_audio_speed_ratio(speed_ratio: float):
@@ -328,6 +335,61 @@ class Clip:
         for note_proto in note_protos:
             yield Note(proto=note_proto, clip=self)
 
+    def get_note_array(self) -> np.ndarray:
+        '''
+        @returns Notes within the clip's range as a structured array of `Clip.NOTE_ARRAY_DTYPE`, sorted by start tick.
+        '''
+        note_protos = Clip._get_notes_in_range(
+            raw_notes=self._proto.notes, start_tick=self.get_clip_start_tick(),
+            end_tick=self.get_clip_end_tick())
+        return Clip._note_protos_to_array(note_protos)
+
+    def get_raw_note_array(self) -> np.ndarray:
+        '''
+        @returns All notes contained by the clip as a structured array of `Clip.NOTE_ARRAY_DTYPE`, including those that
+        are not within the clip's range.
+        '''
+        return Clip._note_protos_to_array(self._proto.notes)
+
+    def set_notes_from_array(self, notes: np.ndarray):
+        '''
+        Replaces all notes of the clip with the given notes in one pass.
+
+        Notes are sorted by start tick, invalid notes are skipped like `create_note` does, and notes without
+        a positive unique id are assigned a new id. The clip range is not changed.
+
+        @param notes A structured array with the fields of `Clip.NOTE_ARRAY_DTYPE`, e.g. one returned by `get_note_array`.
+        '''
+        if self.get_type() != ClipType.MIDI_CLIP:
+            # Only MIDI clips can create notes.
+            return
+        notes = np.asarray(notes)
+        valid_notes_mask = (
+            (notes['pitch'] >= 0) & (notes['pitch'] <= 127) &
+            (notes['velocity'] >= 0) & (notes['velocity'] <= 127) &
+            (notes['end_tick'] >= 0) & (notes['start_tick'] <= notes['end_tick'])
+        )
+        notes = notes[valid_notes_mask]
+        notes = notes[np.argsort(notes['start_tick'], kind='stable')]
+        ids = notes['id'].astype(np.int64)
+        _, first_occurrence_indices = np.unique(ids, return_index=True)
+        is_id_reusable = np.zeros(len(ids), dtype=bool)
+        is_id_reusable[first_occurrence_indices] = True
+        is_id_reusable &= ids > 0
+        self._next_note_id = int(ids[is_id_reusable].max()) + 1 if np.any(is_id_reusable) else 1
+        for index in np.flatnonzero(~is_id_reusable).tolist():
+            ids[index] = self._get_next_note_id()
+
+        self.clear_notes()
+        Clip._add_note_protos(
+            self._proto.notes,
+            pitches=notes['pitch'],
+            velocities=notes['velocity'],
+            start_ticks=notes['start_tick'],
+            end_ticks=notes['end_tick'],
+            ids=ids)
+        self._invalidate_note_times()
+
     def create_note(
         self,
         pitch: int,
@@ -373,6 +435,114 @@ class Clip:
         self._ordered_insert_note(note)
         return note
 
+    def create_notes(
+        self,
+        pitches,
+        velocities,
+        start_ticks,
+        end_ticks,
+        update_clip_range: bool = True,
+        resolve_clip_conflict: bool = True
+    ) -> List[Note]:
+        '''
+        Adds notes given as parallel arrays to the clip and returns the created notes.
+
+        This is equivalent to calling `create_note` for each note in order, but the clip range is
+        updated at most once and the notes are merged into the clip in a single pass.
+
+        @param pitches Integer values between 0 - 127
+        @param velocities Integer values between 0 - 127
+        @param start_ticks Integer values indicating the start ticks.
+        @param end_ticks Integer values indicating the end ticks.
+        @param update_clip_range Whether to update the clip's range if the notes stretch outside the clip.
+        @param resolve_clip_conflict Whether to resolve clip conflict if the clip range is updated.
+        @returns The created notes in the order they are given, invalid notes are skipped.
+        '''
+        if self.get_type() != ClipType.MIDI_CLIP:
+            # Only MIDI clips can create notes.
+            return []
+        pitches = Clip._to_int_array(pitches, 'pitches')
+        velocities = Clip._to_int_array(velocities, 'velocities')
+        start_ticks = Clip._to_int_array(start_ticks, 'start_ticks')
+        end_ticks = Clip._to_int_array(end_ticks, 'end_ticks')
+        valid_notes_mask = (
+            (pitches >= 0) & (pitches <= 127) &
+            (velocities >= 0) & (velocities <= 127) &
+            (end_ticks >= 0) & (start_ticks <= end_ticks)
+        )
+        pitches = pitches[valid_notes_mask].tolist()
+        velocities = velocities[valid_notes_mask].tolist()
+        start_ticks = start_ticks[valid_notes_mask]
+        end_ticks = end_ticks[valid_notes_mask]
+        num_new_notes = len(start_ticks)
+        if num_new_notes == 0:
+            return []
+
+        ids = [self._get_next_note_id() for _ in range(num_new_notes)]
+        if update_clip_range:
+            min_start_tick = int(start_ticks.min())
+            max_end_tick = int(end_ticks.max())
+            if min_start_tick < self.get_clip_start_tick():
+                self.adjust_clip_left(min_start_tick, resolve_clip_conflict)
+            if max_end_tick > self.get_clip_end_tick():
+                self.adjust_clip_right(max_end_tick, resolve_clip_conflict)
+
+        # Only the notes starting at or after the earliest new note need to be merged.
+        target_start_note = SimpleNamespace()
+        target_start_note.start_tick = int(start_ticks.min())
+        note_protos = self._proto.notes
+        merge_start_index = greater_equal(
+            note_protos,
+            target_start_note,
+            key=lambda x: x.start_tick,
+        )
+        existing_start_ticks = np.fromiter(
+            (note_protos[index].start_tick for index in range(merge_start_index, len(note_protos))),
+            dtype=np.int64, count=len(note_protos) - merge_start_index)
+        # A new note is inserted before all notes with the same start tick, so
+        # reversing the new notes and placing them first mimics inserting them one by one.
+        merge_order = np.argsort(np.concatenate([start_ticks[::-1], existing_start_ticks]), kind='stable')
+        merged_positions = np.empty(len(merge_order), dtype=np.int64)
+        merged_positions[merge_order] = np.arange(merge_start_index, merge_start_index + len(merge_order))
+        # The new notes are appended and then sorted into place, which does not copy the existing notes.
+        start_ticks = start_ticks.tolist()
+        end_ticks = end_ticks.tolist()
+        add_note_proto = note_protos.add
+        created_notes = [
+            Note(proto=add_note_proto(
+                pitch=pitch, velocity=velocity, start_tick=start_tick, end_tick=end_tick, id=id), clip=self)
+            for pitch, velocity, start_tick, end_tick, id in zip(pitches, velocities, start_ticks, end_ticks, ids)]
+        sort_by_keys(note_protos, list(range(merge_start_index)) + np.concatenate(
+            [merged_positions[num_new_notes:], merged_positions[num_new_notes - 1::-1]]).tolist())
+        self._invalidate_note_index()
+        self._invalidate_note_times()
+        return created_notes
+
+    def get_note_by_id(self, note_id: int) -> Note | None:
+        '''
+        Gets a note contained by the clip by its id, including notes that are not within the clip's range.
+
+        Returns None if no note matches the id.
+        '''
+        note_index_by_id = self._get_cached_note_index_by_id()
+        if note_index_by_id is not None:
+            index = note_index_by_id.get(note_id)
+            if index is not None and self._is_note_at(index, note_id):
+                return self.get_raw_note_at(index)
+        # The index is missing or stale, rebuild it.
+        note_index_by_id = {}
+        note_protos = self._proto.notes
+        # Iterate backwards so that the first occurrence wins for duplicate ids.
+        for index in range(len(note_protos) - 1, -1, -1):
+            note_index_by_id[note_protos[index].id] = index
+        key = self._get_clip_key()
+        if key is not None:
+            self.song._note_index_by_clip_key[key] = note_index_by_id
+        index = note_index_by_id.get(note_id)
+        if index is None:
+            return None
+        return self.get_raw_note_at(index)
+
     def get_type(self) -> int:
         return self._proto.type
 
@@ -385,6 +555,37 @@ class Clip:
     def delete_note_at(self, index: int):
         if (index >= 0 and index < len(self._proto.notes)):
             self._proto.notes.pop(index)
+            self._invalidate_note_index()
+
+    def delete_notes(self, ids) -> int:
+        '''
+        Deletes all notes with the given ids in one pass.
+
+        @param ids The ids of the notes to delete.
+        @returns The number of deleted notes.
+        '''
+        ids = set(np.asarray(ids, dtype=np.int64).tolist())
+        if len(ids) == 0:
+            return 0
+        return self._delete_notes_where([note_proto.id in ids for note_proto in self._proto.notes])
+
+    def filter_notes(self, predicate_or_mask) -> int:
+        '''
+        Keeps only the notes that match the given predicate or mask and deletes the rest in one pass.
+
+        @param predicate_or_mask Either a function that takes a `Note` and returns whether to keep it, or a boolean
+        array with one value per raw note, e.g. computed from `get_raw_note_array`.
+        @returns The number of deleted notes.
+        '''
+        if callable(predicate_or_mask):
+            keep_mask = [bool(predicate_or_mask(Note(proto=note_proto, clip=self))) for note_proto in self._proto.notes]
+        else:
+            keep_mask = np.asarray(predicate_or_mask, dtype=bool)
+            if keep_mask.shape != (len(self._proto.notes),):
+                raise Exception(
+                    f'Note mask must have one value per raw note, expected {len(self._proto.notes)} but got {keep_mask.shape}')
+            keep_mask = keep_mask.tolist()
+        return self._delete_notes_where([not keep for keep in keep_mask])
 
     def get_clip_start_tick(self) -> int:
         return self._proto.clip_start_tick
@@ -396,10 +597,33 @@ class Clip:
         return self._proto.HasField("audio_clip_data")
 
     def get_audio_clip_data(self) -> AudioClipData | None:
+        '''
+        NOTE: `audio_data.data` may hold a reference to the audio blob store of the song instead of the audio itself,
+        use `get_audio_data` to read the audio.
+        '''
         if not self.has_audio_clip_data():
             return None
         return self._proto.audio_clip_data
 
+    def get_audio_data(self):
+        '''
+        Gets the content of the temporary audio data of the clip.
+
+        If the audio data is a reference to the audio blob store of the song, it is read from the store
+        lazily, e.g. `LocalAudioBlobStore` returns a read-only memory map of the stored file.
+
+        @returns A bytes-like object, or None if the clip has no audio data.
+        '''
+        if not self.has_audio_clip_data() or not self._proto.audio_clip_data.HasField('audio_data'):
+            return None
+        data = self._proto.audio_clip_data.audio_data.data
+        if not AudioBlobStore.is_reference(data):
+            return data
+        audio_blob_store = self.song._audio_blob_store if self.song is not None else None
+        if audio_blob_store is None:
+            raise Exception('The audio data is stored in an audio blob store, which is not provided to the song.')
+        return audio_blob_store.get(AudioBlobStore.get_key_from_reference(data))
+
     def set_audio_file(self, file_path: str, start_tick: int, duration: float):
         '''
         Sets a new audio file.
@@ -424,6 +648,7 @@ class Clip:
 
     def clear_notes(self):
         del self._proto.notes[:]
+        self._invalidate_note_index()
 
     def delete_from_parent(self, delete_associated_track_automation: bool):
         if self.track is not None:
@@ -457,6 +682,7 @@ class Clip:
                     self.get_clip_end_tick(),
                 )
             self._proto.clip_start_tick = clip_start_tick
+            self._on_clip_range_changed()
 
     def adjust_clip_right(self, clip_end_tick: int, resolve_conflict=True):
         '''
@@ -485,6 +711,7 @@ class Clip:
                 )
 
             self._proto.clip_end_tick = clip_end_tick
+            self._on_clip_range_changed()
 
     def move_clip(self, offset_tick: int, move_associated_track_automation_points: bool):
         '''
@@ -677,7 +904,9 @@ class Clip:
                     right_clip = self.track.create_midi_clip(
                         clip_start_tick=right_clip_start_tick,
                         clip_end_tick=right_clip_end_tick,
+                        insert_clip=False,
                     )
+                    self.track._insert_split_clip(right_clip)
 
                     right_note_protos = Clip._get_notes_in_range(
                         raw_notes=self._proto.notes, start_tick=right_clip_start_tick, end_tick=right_clip_end_tick)
@@ -693,7 +922,7 @@ class Clip:
 
                 elif (self.get_type() == ClipType.AUDIO_CLIP):
                     audio_clip_data = self._proto.audio_clip_data
-                    self.track.create_audio_clip(
+                    right_clip = self.track.create_audio_clip(
                         clip_start_tick=right_clip_start_tick,
                         clip_end_tick=right_clip_end_tick,
                         audio_clip_data={
@@ -702,10 +931,12 @@ class Clip:
                             "duration": audio_clip_data.duration,
                             "audio_data": {
                                 "format": audio_clip_data.audio_data.format,
-                                "data": audio_clip_data.audio_data.data
+                                "data": self._get_shareable_audio_data()
                             } if audio_clip_data.HasField("audio_data") else None
                         },
+                        insert_clip=False,
                     )
+                    self.track._insert_split_clip(right_clip)
             return
 
         # Overlapping part is on the side.
@@ -762,8 +993,176 @@ class Clip:
             # Reassign proto since protobuf created a new copy
             new_note._proto = self._proto.notes[insert_index]
         new_note.clip = self
+        self._invalidate_note_index()
+        self._invalidate_note_times()
+
+    def _get_shareable_audio_data(self):
+        '''
+        Gets the audio data to give to another clip that shares the same audio, e.g. the right part of a split clip.
+
+        The data object itself is returned, which the pure-Python protobuf backend stores without copying,
+        and the audio is put into an audio blob store only once when the song is serialized or saved.
+        '''
+        return self._proto.audio_clip_data.audio_data.data
+
+    def _clone_proto(self):
+        '''
+        Copies the proto of the clip, the copy shares the audio data with this clip instead of copying it.
+        '''
+        if not self._proto.audio_clip_data.HasField('audio_data'):
+            new_proto = song_pb2.Clip()
+            new_proto.CopyFrom(self._proto)
+            return new_proto
+        new_proto = copy_without_field(self._proto, 'audio_clip_data')
+        new_proto.audio_clip_data.CopyFrom(copy_without_field(self._proto.audio_clip_data, 'audio_data'))
+        new_audio_data_proto = new_proto.audio_clip_data.audio_data
+        new_audio_data_proto.CopyFrom(copy_without_field(self._proto.audio_clip_data.audio_data, 'data'))
+        new_audio_data_proto.data = self._get_shareable_audio_data()
+        return new_proto
+
+    def _on_clip_range_changed(self):
+        '''
+        Must be called whenever the clip's range is changed while it may be in a track.
+        '''
+        if self.track is not None:
+            self.track._on_clip_range_changed(self)
+
+    def _get_cached_note_index_by_id(self) -> dict | None:
+        key = self._get_clip_key()
+        if key is None:
+            return None
+        return self.song._note_index_by_clip_key.get(key)
+
+    def _invalidate_note_index(self):
+        '''
+        Must be called whenever notes of the clip are added, removed or reordered.
+        '''
+        key = self._get_clip_key()
+        if key is not None:
+            self.song._note_index_by_clip_key.pop(key, None)
+
+    def _get_clip_key(self):
+        # Clip ids are only unique within a track, cloned tracks keep the ids of their clips.
+        if self.song is None or self.track is None:
+            return None
+        return (self.track.get_id(), self.get_id())
+
+    def _invalidate_note_times(self):
+        '''
+        Must be called whenever notes of the clip are added or their ticks change.
+        '''
+        self._note_times_version = None
+        key = self._get_clip_key()
+        if key is not None:
+            self.song._note_times_version_by_clip_key[key] = None
+
+    def _get_note_times_version(self):
+        '''
+        Gets the tempo version the notes were last timed at, or None if the notes have changed since.
+        '''
+        key = self._get_clip_key()
+        if key is None:
+            return self._note_times_version
+        return self.song._note_times_version_by_clip_key.get(key, self.song._note_times_base_version)
+
+    def _update_note_times(self):
+        '''
+        Re-calculates the start and end time of all notes in one pass,
+        if the tempo or the notes have changed since they were last timed.
+        '''
+        if self.song is None:
+            return
+        song = self.song
+        song._flush_tempo_retiming()
+        if self._get_note_times_version() == song._tempo_version:
+            return
+        note_protos = self._proto.notes
+        ticks = np.fromiter(
+            (tick for note_proto in note_protos for tick in (note_proto.start_tick, note_proto.end_tick)),
+            dtype=np.int64, count=2 * len(note_protos))
+        times = song.ticks_to_seconds_array(ticks).tolist()
+        for index, note_proto in enumerate(note_protos):
+            note_proto.start_time = times[2 * index]
+            note_proto.end_time = times[2 * index + 1]
+        self._note_times_version = song._tempo_version
+        key = self._get_clip_key()
+        if key is not None:
+            song._note_times_version_by_clip_key[key] = song._tempo_version
+
+    def _is_note_at(self, index: int, note_id: int, start_tick: int | None = None):
+        if index < 0 or index >= len(self._proto.notes):
+            return False
+        note_proto = self._proto.notes[index]
+        return note_proto.id == note_id and (start_tick is None or note_proto.start_tick == start_tick)
+
+    def _delete_notes_where(self, delete_mask: List[bool]) -> int:
+        '''
+        Deletes the notes whose mask value is True in place, see `remove_where`.
+        '''
+        num_deleted_notes = remove_where(self._proto.notes, delete_mask)
+        if num_deleted_notes > 0:
+            self._invalidate_note_index()
+        return num_deleted_notes
+
+    @staticmethod
+    def _to_int_array(values, name: str) -> np.ndarray:
+        '''
+        Converts values to an integer array, rejecting non-integer values instead of truncating them.
+        '''
+        array = np.asarray(values)
+        if array.size == 0:
+            return array.astype(np.int64)
+        if not np.issubdtype(array.dtype, np.integer):
+            raise Exception(f'{name} must be integers, got {array.dtype}')
+        return array.astype(np.int64)
+
+    @staticmethod
+    def _note_protos_to_array(note_protos) -> np.ndarray:
+        return np.array(
+            [(note_proto.id, note_proto.pitch, note_proto.velocity, note_proto.start_tick, note_proto.end_tick)
+             for note_proto in note_protos],
+            dtype=Clip.NOTE_ARRAY_DTYPE)
+
+    @staticmethod
+    def _add_note_protos(
+        note_protos,
+        pitches,
+        velocities,
+        start_ticks,
+        end_ticks,
+        ids,
+        start_times=None,
+        end_times=None,
+    ):
+        '''
+        Appends notes given as parallel arrays to a repeated note field in one pass.
+
+        The notes are appended as-is, callers are responsible for validating them and keeping the field sorted.
+        '''
+        add_note_proto = note_protos.add
+        if start_times is None or end_times is None:
+            for pitch, velocity, start_tick, end_tick, id in zip(
+                    np.asarray(pitches).tolist(), np.asarray(velocities).tolist(), np.asarray(start_ticks).tolist(),
+                    np.asarray(end_ticks).tolist(), np.asarray(ids).tolist()):
+                add_note_proto(pitch=pitch, velocity=velocity, start_tick=start_tick, end_tick=end_tick, id=id)
+            return
+        for pitch, velocity, start_tick, start_time, end_tick, end_time, id in zip(
+                np.asarray(pitches).tolist(), np.asarray(velocities).tolist(), np.asarray(start_ticks).tolist(),
+                np.asarray(start_times).tolist(), np.asarray(end_ticks).tolist(), np.asarray(end_times).tolist(),
+                np.asarray(ids).tolist()):
+            add_note_proto(
+                pitch=pitch, velocity=velocity, start_tick=start_tick, start_time=start_time,
+                end_tick=end_tick, end_time=end_time, id=id)
 
     def _get_note_index(self, note: Note):
+        # Use the note id index if it is up to date, rebuilding it here would cost
+        # more than the search below when notes are deleted one by one.
+        note_index_by_id = self._get_cached_note_index_by_id()
+        if note_index_by_id is not None:
+            index = note_index_by_id.get(note.get_id())
+            if index is not None and self._is_note_at(index, note.get_id(), note.get_start_tick()):
+                return index
+
         start_index = lower_than(
             self._proto.notes,
             note._proto,
@@ -806,6 +1205,16 @@ class Clip:
     def _generate_clip_id():
         return generate_nanoid(size=10)
 
+    NOTE_ARRAY_DTYPE = np.dtype([
+        ('id', np.int64),
+        ('pitch', np.int32),
+        ('velocity', np.int32),
+        ('start_tick', np.int64),
+        ('end_tick', np.int64),
+    ])
+    '''
+    The structured dtype of note arrays returned by `get_note_array` and accepted by `set_notes_from_array`.
+    '''
     MIN_AUDIO_SPEED_RATIO = 0.05
     MAX_AUDIO_SPEED_RATIO = 20
     MIN_AUDIO_PITCH_OFFSET = -24
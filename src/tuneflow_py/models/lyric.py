@@ -141,10 +141,12 @@ class LyricLine:
         return len(self._proto.words) == 1 and self._proto.words[0].word == LyricWord.PLACEHOLDER_WORD
 
     def get_words(self) -> Generator:
+        self.lyrics.song._flush_pending_sorts()
         for word_proto in self._proto.words:
             yield LyricWord(line=self, proto=word_proto)
 
     def get_sentence(self) -> str:
+        self.lyrics.song._flush_pending_sorts()
         if self.is_empty():
             return ""
         return "".join(word_proto.word for word_proto in self._proto.words)
@@ -162,6 +164,7 @@ class LyricLine:
         return max(line_proto.words, key=lambda word_proto: word_proto.end_tick).end_tick
 
     def get_start_tick(self) -> int:
+        self.lyrics.song._flush_pending_sorts()
         return LyricLine._get_start_tick(self._proto)
 
     def get_end_tick(self) -> int:
@@ -257,6 +260,7 @@ class LyricLine:
         Return:
             int: The index of the line that contains the tick, or -1 if not found.
         '''
+        self.lyrics.song._flush_pending_sorts()
         return LyricLine._get_index_of_word_at_tick(self._proto, tick)
 
     def create_word(self, word: str, start_tick: int, end_tick: int, resolve_order: bool = True):
@@ -269,6 +273,7 @@ class LyricLine:
         return LyricWord(line=self, proto=proto)
 
     def get_word_at_index(self, index: int) -> LyricWord:
+        self.lyrics.song._flush_pending_sorts()
         if index < 0 or index >= len(self._proto.words):
             raise IndexError("Index out of range")
         return LyricWord(
@@ -290,6 +295,7 @@ class LyricLine:
         )
 
     def remove_word(self, word: LyricWord):
+        self.lyrics.song._flush_pending_sorts()
         search_index = lower_equal(self._proto.words, word._proto, key=lambda word: word.start_tick)
         while search_index >= 0:
             lyric_word = self._proto.words[search_index]
@@ -299,6 +305,7 @@ class LyricLine:
             search_index -= 1
 
     def remove_word_at_index(self, index: int):
+        self.lyrics.song._flush_pending_sorts()
         if index < 0 or index >= len(self._proto.words):
             raise IndexError("Index out of range")
         if len(self._proto.words) == 1:
@@ -309,9 +316,16 @@ class LyricLine:
             self.sort_words()
 
     def sort_words(self):
-        self._proto.words.sort(key=lambda word: word.start_tick)
+        '''
+        Sorts the words and then the lines, deferred to the end of the batch in batch mode.
+        '''
+        self.lyrics.song._sort_or_defer(self._proto.words, LyricLine._get_word_start_tick, priority=0)
         self.lyrics.sort_lines()
 
+    @staticmethod
+    def _get_word_start_tick(word_proto: song_pb2.LyricLine.LyricWord) -> int:
+        return word_proto.start_tick
+
     @staticmethod
     def default_lyric_tokenizer(input: str) -> List[str]:
         '''
@@ -450,15 +464,18 @@ class Lyrics:
         Yields:
             int: The index of the line that contains the tick, or -1 if not found.
         '''
+        self.song._flush_pending_sorts()
         for index in Lyrics._get_index_of_line_at_tick(self._proto, tick):
             yield index
 
     def get_line_at_index(self, index: int):
+        self.song._flush_pending_sorts()
         if index < 0 or index >= len(self._proto.lines):
             raise IndexError("Index out of range")
         return LyricLine(lyrics=self, proto=self._proto.lines[index])
 
     def get_lines(self):
+        self.song._flush_pending_sorts()
         for line_proto in self._proto.lines:
             if len(line_proto.words) == 0:
                 raise Exception("Lyric line has no words")
@@ -468,6 +485,7 @@ class Lyrics:
             )
 
     def remove_line(self, line: LyricLine):
+        self.song._flush_pending_sorts()
         search_index = lower_equal(
             self._proto.lines,
             line._proto,
@@ -491,7 +509,11 @@ class Lyrics:
         return LyricLine(lyrics=self, proto=new_proto)
 
     def sort_lines(self):
-        self._proto.lines.sort(key=lambda line: LyricLine._get_start_tick(line))
+        '''
+        Sorts the lines by their start ticks, deferred to the end of the batch in batch mode.
+        '''
+        # Lines are sorted after words since a line starts at its first word.
+        self.song._sort_or_defer(self._proto.lines, LyricLine._get_start_tick, priority=1)
 
     def clear(self):
         del self._proto.lines[:]
@@ -38,12 +38,14 @@ class Note:
 
     def set_start_tick(self, start_tick: int):
         self._proto.start_tick = start_tick
+        self._invalidate_times()
 
     def get_end_tick(self) -> int:
         return self._proto.end_tick
 
     def set_end_tick(self, end_tick: int):
         self._proto.end_tick = end_tick
+        self._invalidate_times()
 
     def set_pitch(self, pitch: int):
         if not Note.is_valid_pitch(pitch):
@@ -62,9 +64,19 @@ class Note:
             self.delete_from_parent()
 
     def get_start_time(self) -> float:
+        '''
+        The start time of the note in seconds, re-calculated after the tempo or the note changes.
+        '''
+        if self.clip is not None:
+            self.clip._update_note_times()
         return self._proto.start_time
 
     def get_end_time(self) -> float:
+        '''
+        The end time of the note in seconds, re-calculated after the tempo or the note changes.
+        '''
+        if self.clip is not None:
+            self.clip._update_note_times()
         return self._proto.end_time
 
     def get_clip(self):
@@ -101,6 +113,7 @@ class Note:
         Adjusts the end tick of the note by an offset.
         '''
         self._proto.end_tick += offset_tick
+        self._invalidate_times()
         if (not self.is_range_valid()):
             self.delete_from_parent()
 
@@ -141,6 +154,10 @@ class Note:
         self.clip.delete_note(self)
         self.clip = None
 
+    def _invalidate_times(self):
+        if self.clip is not None:
+            self.clip._invalidate_note_times()
+
     def equals(self, note: Note):
         '''
         Returns true if the notes should sound the same.
@@ -4,19 +4,46 @@ from tuneflow_py.models.protos import song_pb2
 from tuneflow_py.models.track import Track, TrackType, TrackOutputType
 from tuneflow_py.models.marker import StructureMarker, StructureType
 from tuneflow_py.models.clip import Clip, ClipType
-from tuneflow_py.models.tempo import TempoEvent
+from tuneflow_py.models.tempo import TempoEvent, TempoMap
+from tuneflow_py.models.song_patch import SongSnapshot, create_patch, apply_patch
+from tuneflow_py.models.song_wire_format import parse_song_lazily, copy_without_field, \
+    encode_length_delimited_field_header, SONG_TRACKS_FIELD_NUMBER
+from tuneflow_py.audio_blob_store import AudioBlobStore
 from tuneflow_py.models.time_signature import TimeSignatureEvent
-from tuneflow_py.models.automation import AutomationTarget, AutomationTargetType
+from tuneflow_py.models.automation import AutomationData, AutomationTarget, AutomationTargetType, AutomationValue
 from tuneflow_py.models.audio_plugin import AudioPlugin, decode_audio_plugin_tuneflow_id
-from tuneflow_py.utils import db_to_volume_value, greater_equal, lower_than, lower_equal
+from tuneflow_py.utils import db_to_volume_value, greater_equal, greater_than, lower_equal
 from miditoolkit.midi import MidiFile, TempoChange as ToolkitTempoChange, TimeSignature as ToolkitTimeSignature, \
     Instrument, Note as ToolkitNote
 from types import SimpleNamespace
-from typing import List
+from contextlib import contextmanager
+from operator import attrgetter
+from typing import BinaryIO, List
+import lzma
+import math
+import mmap as mmap_module
+import numpy as np
+import os
+import struct
+import tempfile
+import zlib
 
 
 class Song:
-    def __init__(self, proto: song_pb2.Song | None = None) -> None:
+    def __init__(self, proto: song_pb2.Song | None = None, audio_blob_store: AudioBlobStore | None = None) -> None:
+        '''
+        @param audio_blob_store The store that the audio data of the song is read from and written to when serializing.
+        '''
+        self._audio_blob_store = audio_blob_store
+        self._snapshot: SongSnapshot | None = None
+        self._tempo_version = 0
+        self._batch_depth = 0
+        self._pending_sorts: dict = {}
+        self._pending_tempo_retiming_index: int | None = None
+        # The ids of the clips whose conflicts are pending by track id, each in the order the clips were last edited.
+        self._pending_clip_conflicts_by_track_id: dict = {}
+        self._unloaded_track_content_by_id: dict = {}
+        self._reset_caches()
         if proto is not None:
             self._proto = proto
         else:
@@ -34,9 +61,14 @@ class Song:
         '''
         @returns End tick of the last note.
         '''
-        if self.get_track_count() == 0:
-            return 0
-        return max([track.get_track_end_tick() for track in self.get_tracks()])
+        if self._track_end_tick_by_id is None:
+            self._load_all_track_contents()
+            self._track_end_tick_by_id = {
+                track_proto.uuid: Song._get_track_proto_end_tick(track_proto) for track_proto in self._proto.tracks}
+            self._last_tick = None
+        if self._last_tick is None:
+            self._last_tick = max(self._track_end_tick_by_id.values(), default=0)
+        return self._last_tick
 
     def get_duration(self):
         return self.tick_to_seconds(self.get_last_tick())
@@ -46,26 +78,23 @@ class Song:
 
     def get_tracks(self):
         for track_proto in self._proto.tracks:
-            yield Track(song=self, proto=track_proto)
+            yield self._get_loaded_track(track_proto)
 
     def get_track_by_id(self, track_id: str) -> Track | None:
-        for track_proto in self._proto.tracks:
-            if track_proto.uuid == track_id:
-                return Track(song=self, proto=track_proto)
-        return None
+        index = self._lookup_track_index(track_id)
+        if index < 0:
+            return None
+        return self._get_loaded_track(self._proto.tracks[index])
 
     def get_track_at(self, index):
-        return Track(song=self, proto=self._proto.tracks[index])
+        return self._get_loaded_track(self._proto.tracks[index])
 
     def get_track_index(self, track_id: str):
         '''
         Get the index of the track within the tracks list.
         Returns -1 if no track matches the track id.
         '''
-        for index, track in enumerate(self.get_tracks()):
-            if track.get_id() == track_id:
-                return index
-        return -1
+        return self._lookup_track_index(track_id)
 
     def remove_track(self, track_id: str):
         '''
@@ -74,12 +103,18 @@ class Song:
         track = self.get_track_by_id(track_id=track_id)
         if not track:
             return None
+        track_rank = track.get_rank()
 
         for i in range(self.get_track_count() - 1, -1, -1):
-            if self.get_track_at(i).get_id() == track_id:
+            if self._proto.tracks[i].uuid == track_id:
                 del self._proto.tracks[i]
-        # Delete dependencies.
-        for dep_track in self.get_tracks():
+        self._unloaded_track_content_by_id.pop(track_id, None)
+        self._invalidate_track_index()
+        self._invalidate_clip_index(track_id)
+        self._clip_range_index_by_track_id.pop(track_id, None)
+        self._on_track_removed(track_id, track_rank)
+        # Delete dependencies, the output of a track is available without loading its content.
+        for dep_track in (Track(song=self, proto=track_proto) for track_proto in self._proto.tracks):
             track_output = dep_track.get_output()
             if track_output is not None and track_output.get_type() == TrackOutputType.TRACK_OUTPUT_TRACK and track_output.get_track_id() == track_id:
                 dep_track.remove_output()
@@ -89,9 +124,11 @@ class Song:
         return self._proto.lyrics
 
     def get_structures(self):
+        self._flush_pending_sorts()
         return [StructureMarker(song=self, proto=structure_proto) for structure_proto in self._proto.structures]
 
     def get_structure_at_index(self, index: int):
+        self._flush_pending_sorts()
         if index < 0 or index >= len(self._proto.structures):
             return None
         return StructureMarker(song=self, proto=self._proto.structures[index])
@@ -127,9 +164,10 @@ class Song:
         if len(self._proto.structures) == 1:
             # If there is only 1 structure, move it to the start.
             structure.set_tick(0)
-        self._proto.structures.sort(key=lambda x: x.tick)
+        self._sort_or_defer(self._proto.structures, Song._get_structure_tick)
 
     def move_structure(self, structure_index: int, move_to_tick: int):
+        self._flush_pending_sorts()
         structure = self.get_structure_at_index(structure_index)
         if not structure:
             return
@@ -145,7 +183,7 @@ class Song:
                 # Moved to another time signature, delete it.
                 self.remove_structure(structure_index + 1)
         structure.set_tick(move_to_tick)
-        self._proto.structures.sort(key=lambda x: x.tick)
+        self._sort_or_defer(self._proto.structures, Song._get_structure_tick)
 
     def update_structure_at_tick(self, tick: int, type: StructureType):
         existing_structure = self.get_structure_at_tick(tick)
@@ -155,6 +193,7 @@ class Song:
             self.create_structure(tick, type)
 
     def remove_structure(self, index: int):
+        self._flush_pending_sorts()
         if index < 0 or index >= len(self._proto.structures):
             return
         self._proto.structures.pop(index)
@@ -162,38 +201,204 @@ class Song:
             # If the first structure of the remaining ones does not start
             # from 0, move it to 0.
             self._proto.structures[0].tick = 0
-        self._proto.structures.sort(key=lambda x: x.tick)
+        self._sort_or_defer(self._proto.structures, Song._get_structure_tick)
 
-    def serialize(self):
-        return b64encode(self._proto.SerializeToString()).decode('ascii')
+    def serialize(self, audio_blob_store: AudioBlobStore | None = None):
+        '''
+        @param audio_blob_store If provided, audio data is put into the store and the serialized song only contains
+        references to it. Defaults to the store the song is created with.
+        '''
+        return b64encode(self.serialize_to_bytestring(audio_blob_store=audio_blob_store)).decode('ascii')
 
-    def serialize_to_bytestring(self) -> str:
+    def serialize_to_bytestring(self, audio_blob_store: AudioBlobStore | None = None) -> str:
         '''
         Note here the returned string is essentially bytes, just using the str form for convenience.
         See https://protobuf.dev/getting-started/pythontutorial/#parsing-serialization
+
+        @param audio_blob_store If provided, audio data is put into the store and the serialized song only contains
+        references to it. Defaults to the store the song is created with.
         '''
-        return self._proto.SerializeToString()
+        self._flush_pending_edits()
+        self._update_note_times()
+        with self._externalize_audio_data(audio_blob_store or self._audio_blob_store):
+            if len(self._unloaded_track_content_by_id) > 0:
+                return self._serialize_with_unloaded_track_contents()
+            return self._proto.SerializeToString()
 
     @staticmethod
-    def deserialize(serialized_song_string: str):
-        song_proto = song_pb2.Song()
-        song_proto.ParseFromString(
-            b64decode(serialized_song_string))  # type: ignore
-        return Song(proto=song_proto)
+    def deserialize(serialized_song_string: str, audio_blob_store: AudioBlobStore | None = None, lazy=False):
+        '''
+        @param audio_blob_store The store that audio data references in the serialized song are resolved from.
+        @param lazy If true, the notes, clips and automation of each track are only parsed when the track
+        is first accessed, tracks that are never accessed are serialized by copying their original bytes,
+        including their audio data. Everything else, including track properties such as volume and output,
+        is parsed right away.
+        '''
+        return Song._parse(b64decode(serialized_song_string), audio_blob_store=audio_blob_store, lazy=lazy)
 
     @staticmethod
-    def deserialize_from_bytestring(serialized_song_bytestring: str):
+    def deserialize_from_bytestring(serialized_song_bytestring: str, audio_blob_store: AudioBlobStore | None = None,
+                                    lazy=False):
         '''
         Note here the input string is essentially bytes, generated by `serialize_to_bytestring` or equivalent method in other languages.
+
+        @param audio_blob_store The store that audio data references in the serialized song are resolved from.
+        @param lazy Same as in `deserialize`.
+        '''
+        return Song._parse(serialized_song_bytestring, audio_blob_store=audio_blob_store, lazy=lazy)
+
+    def write_frame(self, file: BinaryIO, audio_blob_store: AudioBlobStore | None = None):
+        '''
+        Writes the song to a binary file object or pipe as a length-prefixed frame of the protobuf wire format.
+
+        Unlike `serialize`, the payload is not base64 encoded and is written without being copied
+        into a larger buffer, so several songs can be written to the same stream one after another.
+
+        @param audio_blob_store Same as in `serialize`.
+        '''
+        serialized_song = self.serialize_to_bytestring(audio_blob_store=audio_blob_store)
+        file.write(Song.FRAME_HEADER.pack(Song.FRAME_MAGIC, Song.FRAME_VERSION, len(serialized_song)))
+        file.write(serialized_song)
+
+    @staticmethod
+    def read_frame(file: BinaryIO, audio_blob_store: AudioBlobStore | None = None, lazy=False):
+        '''
+        Reads a song written by `write_frame` from a binary file object or pipe.
+
+        The payload is read into a single preallocated buffer and parsed from it directly.
+
+        @param audio_blob_store Same as in `deserialize`.
+        @param lazy Same as in `deserialize`.
+
+        @returns The song, or None if the stream ended before the frame started.
+        '''
+        header = Song._read_exactly(file, Song.FRAME_HEADER.size)
+        if len(header) == 0:
+            return None
+        payload_length = Song._unpack_frame_header(header)
+        payload = Song._read_exactly(file, payload_length)
+        return Song._parse(payload, audio_blob_store=audio_blob_store, lazy=lazy)
+
+    @staticmethod
+    def deserialize_from_frame(buffer, offset: int = 0, audio_blob_store: AudioBlobStore | None = None, lazy=False):
+        '''
+        Reads a song written by `write_frame` from a buffer, e.g. `bytes`, a `memoryview` or an `mmap`.
+
+        The payload is parsed from a view of the buffer without copying it.
+
+        @param offset Where the frame starts in the buffer.
+        @param audio_blob_store Same as in `deserialize`.
+        @param lazy Same as in `deserialize`.
+        @returns The song and the offset right after the frame, where the next frame would start.
+        '''
+        view = memoryview(buffer)
+        header_end = offset + Song.FRAME_HEADER.size
+        if header_end > len(view):
+            raise Exception('The buffer ended before the song frame header.')
+        payload_length = Song._unpack_frame_header(view[offset:header_end])
+        payload_end = header_end + payload_length
+        if payload_end > len(view):
+            raise Exception('The buffer ended before the end of the song frame.')
+        song = Song._parse(view[header_end:payload_end], audio_blob_store=audio_blob_store, lazy=lazy)
+        return song, payload_end
+
+    def take_snapshot(self):
+        '''
+        Records the current state of the song, so that `create_patch` can later describe
+        the changes made since then. Usually called right after the song is deserialized.
         '''
-        song_proto = song_pb2.Song()
-        song_proto.ParseFromString(serialized_song_bytestring)
-        return Song(proto=song_proto)
+        self._load_all_track_contents()
+        self._flush_pending_edits()
+        self._update_note_times()
+        with self._externalize_audio_data(self._audio_blob_store):
+            self._snapshot = SongSnapshot(self._proto)
+
+    def create_patch(self) -> bytes:
+        '''
+        Creates a patch that turns the song as of the last `take_snapshot` into the current song.
+
+        Only the song header (everything except tracks), the track headers (everything of a track
+        except clips) and the clips that changed are included, so the patch of a few edits is much
+        smaller than the serialized song and is much faster to apply than parsing the whole song.
+        '''
+        if self._snapshot is None:
+            raise Exception('take_snapshot must be called before creating a patch.')
+        self._load_all_track_contents()
+        self._flush_pending_edits()
+        self._update_note_times()
+        with self._externalize_audio_data(self._audio_blob_store):
+            return create_patch(self._snapshot, self._proto)
+
+    def apply_patch(self, patch: bytes):
+        '''
+        Applies a patch created by `create_patch` on a song that is the same as the one the snapshot is taken of.
+        '''
+        self._load_all_track_contents()
+        self._flush_pending_edits()
+        apply_patch(self._proto, patch)
+        self._reset_caches()
+
+    def save(self, path: str, compression: str | None = None, audio_blob_store: AudioBlobStore | None = None):
+        '''
+        Writes the song to a file in the protobuf wire format, without base64 encoding it.
+
+        The file is written to a temporary file next to it first, so readers never see a partially written song.
+
+        @param compression None to write the wire format as is, which can be memory-mapped when loading,
+        or 'zlib' or 'lzma' to write it compressed.
+        @param audio_blob_store Same as in `serialize`.
+        '''
+        if compression is not None and compression not in Song.FILE_COMPRESSION_CODES:
+            raise Exception(f'Unsupported compression {compression}.')
+        serialized_song = self.serialize_to_bytestring(audio_blob_store=audio_blob_store)
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                if compression is None:
+                    file.write(serialized_song)
+                else:
+                    file.write(Song.COMPRESSED_FILE_HEADER.pack(
+                        Song.COMPRESSED_FILE_MAGIC, Song.FILE_COMPRESSION_CODES[compression]))
+                    file.write(Song._compress(serialized_song, compression))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
 
     @staticmethod
-    def from_midi(midi_obj: MidiFile):
+    def load(path: str, mmap=True, audio_blob_store: AudioBlobStore | None = None, lazy=False):
+        '''
+        Reads a song saved by `save`, the compression is detected from the file.
+
+        @param mmap Whether to memory-map the file instead of reading it into memory. Uncompressed songs
+        are then parsed directly from the mapped file, and with `lazy`, the content of tracks that are
+        never accessed is never read from disk.
+        @param audio_blob_store Same as in `deserialize`.
+        @param lazy Same as in `deserialize`.
+        '''
+        with open(path, 'rb') as file:
+            if mmap and os.fstat(file.fileno()).st_size > 0:
+                buffer = mmap_module.mmap(file.fileno(), 0, access=mmap_module.ACCESS_READ)
+            else:
+                # Empty files cannot be memory-mapped.
+                buffer = file.read()
+        view = memoryview(buffer)
+        header = bytes(view[:Song.COMPRESSED_FILE_HEADER.size])
+        # A serialized song never starts with the magic, since it would be an invalid field tag.
+        if len(header) == Song.COMPRESSED_FILE_HEADER.size and header[:4] == Song.COMPRESSED_FILE_MAGIC:
+            _, compression_code = Song.COMPRESSED_FILE_HEADER.unpack(header)
+            view = memoryview(Song._decompress(view[Song.COMPRESSED_FILE_HEADER.size:], compression_code))
+        # The memory map is closed when the song no longer refers to it through lazily loaded tracks.
+        return Song._parse(view, audio_blob_store=audio_blob_store, lazy=lazy)
+
+    @staticmethod
+    def from_midi(midi_obj: MidiFile, automation_tolerance: float | None = None):
         '''
         TODO: Replace proto operations with builtin methods.
+
+        @param automation_tolerance If provided, the volume and pan automation converted from CC messages
+        is simplified with this tolerance, see `AutomationValue.simplify`.
         '''
 
         def scale_int_by(value, scale_factor):
@@ -222,19 +427,29 @@ class Song:
             song_track_proto.instrument.is_drum = instrument.is_drum
             track_clip_proto = song_track_proto.clips.add(
                 id=Clip._generate_clip_id(), type=ClipType.MIDI_CLIP, clip_start_tick=0)
-            # Add notes.
-            for note in instrument.notes:
-                start_tick = scale_int_by(
-                    note.start, ppq_scale_factor)
-                end_tick = scale_int_by(note.end, ppq_scale_factor)
-                track_clip_proto.notes.add(
-                    pitch=note.pitch, velocity=note.velocity, start_tick=start_tick, start_time=song.tick_to_seconds(
-                        start_tick),
-                    end_tick=end_tick, end_time=song.tick_to_seconds(end_tick))
-            track_clip_proto.clip_start_tick = min(
-                track_clip_proto.notes, key=lambda x: x.start_tick).start_tick
-            track_clip_proto.clip_end_tick = max(
-                track_clip_proto.notes, key=lambda x: x.end_tick).end_tick
+            # Add notes in bulk, sorted by start tick.
+            note_count = len(instrument.notes)
+            if note_count > 0:
+                # Read one field of all notes at a time, without building an intermediate object per note.
+                pitches, velocities, starts, ends = [
+                    np.fromiter(map(attrgetter(field_name), instrument.notes), dtype=np.int64, count=note_count)
+                    for field_name in ['pitch', 'velocity', 'start', 'end']]
+                start_ticks = np.round(starts * ppq_scale_factor).astype(np.int64)
+                end_ticks = np.round(ends * ppq_scale_factor).astype(np.int64)
+                order = np.argsort(start_ticks, kind='stable')
+                start_ticks = start_ticks[order]
+                end_ticks = end_ticks[order]
+                Clip._add_note_protos(
+                    track_clip_proto.notes,
+                    pitches=pitches[order],
+                    velocities=velocities[order],
+                    start_ticks=start_ticks,
+                    end_ticks=end_ticks,
+                    ids=np.arange(1, note_count + 1),
+                    start_times=song.ticks_to_seconds_array(start_ticks),
+                    end_times=song.ticks_to_seconds_array(end_ticks))
+                track_clip_proto.clip_start_tick = int(start_ticks[0])
+                track_clip_proto.clip_end_tick = int(end_ticks.max())
             song_last_tick = max(
                 song_last_tick, track_clip_proto.clip_end_tick)
             # Add automation.
@@ -255,11 +470,10 @@ class Song:
                 song_track_proto.automation.targets.append(
                     volume_target._proto)
                 volume_target._proto = song_track_proto.automation.targets[-1]
-                volume_target_value = song_pb2.AutomationValue()
-                song_track_proto.automation.target_values[volume_target_id] = volume_target_value
-                for index, cc in enumerate(sorted(volume_ccs, key=lambda x: x.time)):
-                    volume_target_value.points.add(tick=scale_int_by(
-                        cc.time, ppq_scale_factor), value=cc.value / 127.0, id=index + 1)
+                # Accessing a missing key of a message map creates the value.
+                volume_target_value = song_track_proto.automation.target_values[volume_target_id]
+                Song._add_midi_cc_automation_points(
+                    volume_target_value, volume_ccs, ppq_scale_factor, automation_tolerance)
             else:
                 # Volume data missing from midi, set it to default.
                 song_track_proto.volume = db_to_volume_value(0.0)
@@ -271,11 +485,8 @@ class Song:
                 pan_target_id = pan_target.to_tf_automation_target_id()
                 song_track_proto.automation.targets.append(pan_target._proto)
                 pan_target._proto = song_track_proto.automation.targets[-1]
-                pan_target_value = song_pb2.AutomationValue()
-                song_track_proto.automation.target_values[pan_target_id] = pan_target_value
-                for index, cc in enumerate(sorted(pan_ccs, key=lambda x: x.time)):
-                    pan_target_value.points.add(tick=scale_int_by(
-                        cc.time, ppq_scale_factor), value=cc.value / 127.0, id=index + 1)
+                pan_target_value = song_track_proto.automation.target_values[pan_target_id]
+                Song._add_midi_cc_automation_points(pan_target_value, pan_ccs, ppq_scale_factor, automation_tolerance)
 
         song.last_tick = song_last_tick
         song.duration = song.tick_to_seconds(song_last_tick)
@@ -285,6 +496,7 @@ class Song:
         '''
         TODO: Replace proto operations with builtin methods.
         '''
+        self._flush_pending_edits()
         midi_obj = MidiFile()
         midi_obj.ticks_per_beat = self.get_resolution()
         for tempo_proto in self._proto.tempos:
@@ -296,29 +508,165 @@ class Song:
                     numerator=time_signature_proto.numerator,
                     denominator=time_signature_proto.denominator,
                     time=time_signature_proto.ticks))
-        for track_proto in self._proto.tracks:
-            if track_proto.type != TrackType.MIDI_TRACK or len(track_proto.clips) == 0:
-                continue
+        for track_proto in self._get_midi_export_track_protos():
             instrument = Instrument(program=track_proto.instrument.program,
                                     is_drum=track_proto.instrument.is_drum, name=f'Track {track_proto.rank}')
             midi_obj.instruments.append(instrument)
             # Export clips
-            for clip_proto in track_proto.clips:
-                if clip_proto.type != ClipType.MIDI_CLIP:
-                    continue
-                for note_proto in clip_proto.notes:
-                    if not Clip.is_note_in_clip(
-                            note_start_tick=note_proto.start_tick, note_end_tick=note_proto.end_tick,
-                            clip_start_tick=clip_proto.clip_start_tick, clip_end_tick=clip_proto.clip_end_tick):
-                        continue
-                    instrument.notes.append(
-                        ToolkitNote(
-                            pitch=note_proto.pitch, velocity=note_proto.velocity,
-                            start=note_proto.start_tick, end=note_proto.end_tick))
+            instrument.notes.extend([
+                ToolkitNote(
+                    pitch=note_proto.pitch, velocity=note_proto.velocity,
+                    start=note_proto.start_tick, end=note_proto.end_tick)
+                for note_proto in Song._get_midi_export_note_protos(track_proto)])
             # TODO: Export automation
         midi_obj.max_tick = self.get_last_tick()
         return midi_obj
 
+    def write_midi(self, filename: str | None = None, file: BinaryIO | None = None):
+        '''
+        Writes the song as a standard MIDI file, the output is identical to `to_midi().dump(...)`.
+
+        Unlike `to_midi`, this does not build a `MidiFile`, events are encoded track by track directly
+        into the output, so memory use is bounded by the largest track rather than the whole song.
+
+        @param filename The path to write to.
+        @param file A binary file object to write to, used when `filename` is not provided.
+        '''
+        if filename is not None:
+            with open(filename, 'wb') as output_file:
+                self.write_midi(file=output_file)
+            return
+        if file is None:
+            raise Exception('Either filename or file must be provided.')
+
+        self._flush_pending_edits()
+        midi_track_protos = list(self._get_midi_export_track_protos())
+        file.write(b'MThd')
+        file.write(struct.pack('>Lhhh', 6, 1, len(midi_track_protos) + 1, self.get_resolution()))
+
+        # Meta track with time signatures and tempos, tempos go first when they happen at the same tick.
+        meta_events = []
+        if len(self._proto.time_signatures) == 0 or min(
+                [time_signature_proto.ticks for time_signature_proto in self._proto.time_signatures]) > 0:
+            meta_events.append((0, 2, Song._encode_midi_time_signature(4, 4)))
+        for time_signature_proto in self._proto.time_signatures:
+            meta_events.append((time_signature_proto.ticks, 2, Song._encode_midi_time_signature(
+                time_signature_proto.numerator, time_signature_proto.denominator)))
+        if len(self._proto.tempos) == 0 or min([tempo_proto.ticks for tempo_proto in self._proto.tempos]) > 0:
+            meta_events.append((0, 1, Song._encode_midi_tempo(120)))
+        for tempo_proto in self._proto.tempos:
+            meta_events.append((tempo_proto.ticks, 1, Song._encode_midi_tempo(tempo_proto.bpm)))
+        meta_events.sort(key=lambda event: (event[0], event[1]))
+        Song._write_midi_track(file, meta_events)
+
+        # One track per MIDI track, the note events of each track are only kept while that track is written.
+        channels = [channel for channel in range(16) if channel != 9]
+        for index, track_proto in enumerate(midi_track_protos):
+            channel = 9 if track_proto.instrument.is_drum else channels[index % len(channels)]
+            track_name = f'Track {track_proto.rank}'.encode('latin1')
+            track_events = [
+                (0, 0, b'\xff\x03' + Song._encode_midi_variable_int(len(track_name)) + track_name),
+                (0, 6 << 16, bytes([0xc0 | channel, track_proto.instrument.program])),
+            ]
+            note_on_status = 0x90 | channel
+            for note_proto in Song._get_midi_export_note_protos(track_proto):
+                # Note offs are note ons with velocity 0, events at the same tick are
+                # ordered by pitch and then velocity.
+                pitch, velocity = note_proto.pitch, note_proto.velocity
+                track_events.append(
+                    (note_proto.start_tick, (10 << 16) + (pitch << 8) + velocity,
+                     bytes([note_on_status, pitch, velocity])))
+                track_events.append(
+                    (note_proto.end_tick, (10 << 16) + (pitch << 8), bytes([note_on_status, pitch, 0])))
+            track_events.sort(key=lambda event: (event[0], event[1]))
+            Song._write_midi_track(file, track_events)
+
+    @staticmethod
+    def _add_midi_cc_automation_points(automation_value_proto: song_pb2.AutomationValue, control_changes: list,
+                                       ppq_scale_factor: float, tolerance: float | None):
+        '''
+        Converts CC messages to automation points, only adding the points kept by `AutomationValue.simplify`
+        if a tolerance is provided.
+        '''
+        control_changes = sorted(control_changes, key=lambda x: x.time)
+        ticks = [round(control_change.time * ppq_scale_factor) for control_change in control_changes]
+        values = [control_change.value / 127.0 for control_change in control_changes]
+        if tolerance is not None:
+            keep_mask = AutomationValue._get_simplified_point_mask(
+                np.array(ticks, dtype=np.float64), np.array(values, dtype=np.float64), tolerance).tolist()
+            ticks = [tick for tick, is_kept in zip(ticks, keep_mask) if is_kept]
+            values = [value for value, is_kept in zip(values, keep_mask) if is_kept]
+        add_point_proto = automation_value_proto.points.add
+        for index, (tick, value) in enumerate(zip(ticks, values)):
+            add_point_proto(tick=tick, value=value, id=index + 1)
+
+    def _get_midi_export_track_protos(self):
+        self._load_all_track_contents()
+        for track_proto in self._proto.tracks:
+            if track_proto.type != TrackType.MIDI_TRACK or len(track_proto.clips) == 0:
+                continue
+            yield track_proto
+
+    @staticmethod
+    def _get_midi_export_note_protos(track_proto: song_pb2.Track):
+        '''
+        Gets the playable notes of all MIDI clips in a track, clip by clip.
+        '''
+        for clip_proto in track_proto.clips:
+            if clip_proto.type != ClipType.MIDI_CLIP:
+                continue
+            yield from Clip._get_notes_in_range(
+                raw_notes=clip_proto.notes, start_tick=clip_proto.clip_start_tick,
+                end_tick=clip_proto.clip_end_tick)
+
+    @staticmethod
+    def _write_midi_track(file: BinaryIO, events: list):
+        '''
+        Writes a MIDI track chunk.
+
+        @param events A list of (tick, sort key, encoded event) tuples sorted by tick.
+        '''
+        data = bytearray()
+        running_status = None
+        last_tick = 0
+        for tick, _, event_bytes in events:
+            data += Song._encode_midi_variable_int(tick - last_tick)
+            last_tick = tick
+            status = event_bytes[0]
+            if status == 0xff:
+                running_status = None
+                data += event_bytes
+            elif status == running_status:
+                data += event_bytes[1:]
+            else:
+                running_status = status
+                data += event_bytes
+        # End of track.
+        data += b'\x01\xff\x2f\x00'
+        file.write(b'MTrk')
+        file.write(struct.pack('>L', len(data)))
+        file.write(data)
+
+    @staticmethod
+    def _encode_midi_variable_int(value: int):
+        if value < 0:
+            raise ValueError('MIDI event time must be non-negative.')
+        encoded = [value & 0x7f]
+        value >>= 7
+        while value:
+            encoded.append((value & 0x7f) | 0x80)
+            value >>= 7
+        return bytes(reversed(encoded))
+
+    @staticmethod
+    def _encode_midi_tempo(bpm: float):
+        tempo = int(round(60 * 1e6 / bpm))
+        return bytes([0xff, 0x51, 0x03, tempo >> 16, tempo >> 8 & 0xff, tempo & 0xff])
+
+    @staticmethod
+    def _encode_midi_time_signature(numerator: int, denominator: int):
+        return bytes([0xff, 0x58, 0x04, numerator, int(math.log(denominator, 2)), 24, 8])
+
     def get_resolution(self):
         return self._proto.PPQ
 
@@ -360,22 +708,20 @@ class Song:
         if self.get_tempo_event_count() == 0 and ticks != 0:
             raise Exception('The first tempo event must be at tick 0')
 
-        # Calculate time BEFORE the new tempo event is inserted.
-        tempo_change = TempoEvent(
-            ticks=ticks, bpm=bpm, time=self.tick_to_seconds(ticks))
+        # The time of the new tempo event is calculated when retiming.
+        tempo_change = TempoEvent(ticks=ticks, bpm=bpm, time=0)
         insert_index = greater_equal(
             self._proto.tempos,
             tempo_change._proto,
             lambda x: x.ticks
         )
         if insert_index < 0:
-            self._proto.tempos.append(tempo_change._proto)
-            tempo_change._proto = self._proto.tempos[-1]
-        else:
-            self._proto.tempos.insert(insert_index, tempo_change._proto)
-            tempo_change._proto = self._proto.tempos[insert_index]
+            insert_index = len(self._proto.tempos)
+        self._proto.tempos.insert(insert_index, tempo_change._proto)
+        tempo_change._proto = self._proto.tempos[insert_index]
 
-        self.retiming_tempo_events()
+        self._invalidate_tempo_map()
+        self._retime_tempo_events_or_defer(insert_index)
         return tempo_change
 
     def move_tempo(self, tempo_index: int, move_to_tick: int):
@@ -390,83 +736,117 @@ class Song:
         prev_tempo = self.get_tempo_event_at(tempo_index - 1)
         if prev_tempo is None:
             return
+        # Remove overwritten tempos without retiming, the tempos are retimed once below.
         if (prev_tempo.get_ticks() == move_to_tick):
             # Moved to another tempo, delete it.
-            self.remove_tempo_change_at(tempo_index - 1)
+            self._remove_tempo_event_at(tempo_index - 1)
+            tempo_index -= 1
         elif (tempo_index < self.get_tempo_event_count() - 1):
             next_tempo = self.get_tempo_event_at(tempo_index + 1)
             if (next_tempo is not None and next_tempo.get_ticks() == move_to_tick):
                 # Moved to another tempo, delete it.
-                self.remove_tempo_change_at(tempo_index + 1)
+                self._remove_tempo_event_at(tempo_index + 1)
 
         tempo.set_ticks(move_to_tick)
-        self.retiming_tempo_events()
+        new_tempo_index = self._reposition_tempo_event(tempo_index)
+        self._invalidate_tempo_map()
+        self._retime_tempo_events_or_defer(min(tempo_index, new_tempo_index))
 
     def remove_tempo_change_at(self, index: int):
-        if self.get_tempo_event_count() <= 1:
-            raise Exception('Song has to have at least one tempo change. Update the last tempo change instead.')
+        self._remove_tempo_event_at(index)
+        self._retime_tempo_events_or_defer(index)
 
-        if (index == 0):
-            raise Exception('Cannot remove the first tempo.')
+    def retiming_tempo_events(self):
+        '''
+        Sorts the tempo events and re-calculates the time of all of them.
 
-        self._proto.tempos.pop(index)
-        self.retiming_tempo_events()
+        Only needed after modifying tempo events directly, the tempo methods of the song
+        keep the tempo events sorted and timed.
+        '''
+        tempos = self._proto.tempos
+        if any(tempos[index - 1].ticks > tempos[index].ticks for index in range(1, len(tempos))):
+            sorted_tempos = sorted(tempos, key=lambda tempo: tempo.ticks)
+            del tempos[:]
+            tempos.extend(sorted_tempos)
+        self._retime_tempo_events_from(0)
+
+    def set_tempo_curve(self, ticks, bpms):
+        '''
+        Replaces all the tempo events of the song at once, e.g. to import a beat-tracked tempo curve.
+
+        @param ticks The ticks of the tempo events, an array-like of ints, one of them must be 0.
+        @param bpms The tempos in BPM(Beats-per-minute) format, an array-like of the same length as `ticks`.
+        If more than one tempo is given at the same tick, the last one is used.
+        '''
+        if self.get_resolution() <= 0:
+            raise Exception(
+                'Song resolution must be provided before creating tempo changes.')
+        ticks = np.asarray(ticks, dtype=np.int64).reshape(-1)
+        bpms = np.asarray(bpms, dtype=np.float64).reshape(-1)
+        if len(ticks) != len(bpms):
+            raise Exception('ticks and bpms must have the same length.')
+        if len(ticks) == 0:
+            raise Exception('Cannot clear all the tempo events.')
+        order = np.argsort(ticks, kind='stable')
+        ticks = ticks[order]
+        bpms = bpms[order]
+        if ticks[0] != 0:
+            raise Exception('The first tempo event needs to start from tick 0')
+        # Keep the last tempo of each tick.
+        is_last_of_tick = np.append(ticks[1:] != ticks[:-1], True)
+        ticks = ticks[is_last_of_tick]
+        bpms = bpms[is_last_of_tick]
 
-    def retiming_tempo_events(self):
-        sorted_tempos = sorted(
-            self._proto.tempos, key=lambda tempo: tempo.ticks)
         del self._proto.tempos[:]
-        self._proto.tempos.extend(sorted_tempos)
-        # Re-calculate all tempo event time.
-        for tempo_event_proto in self._proto.tempos:
-            tempo_event_proto.time = self.tick_to_seconds(
-                tempo_event_proto.ticks)
+        tempos = self._proto.tempos
+        for tick, bpm in zip(ticks.tolist(), bpms.tolist()):
+            tempos.add(ticks=tick, bpm=bpm)
+        self._retime_tempo_events_from(0)
 
     def tick_to_seconds(self, tick: int):
-        if tick == 0:
-            return 0
-
-        target_tempo = SimpleNamespace()
-        target_tempo.ticks = tick
-        base_tempo_index = lower_than(
-            self._proto.tempos,
-            target_tempo,
-            lambda x: x.ticks
-        )
-        if base_tempo_index == -1:
-            # If no tempo is found before the tick, use the first tempo.
-            base_tempo_index = 0
-
-        base_tempo_change = self._proto.tempos[base_tempo_index]
-        ticks_delta = tick - base_tempo_change.ticks
-        ticks_per_second_since_last_tempo_change = Song._tempo_bpm_to_ticks_per_second(
-            base_tempo_change.bpm,
-            self.get_resolution(),
-        )
-        return base_tempo_change.time + ticks_delta / ticks_per_second_since_last_tempo_change
+        return self._get_tempo_map().tick_to_seconds(tick)
 
     def seconds_to_tick(self, seconds: float):
-        if (seconds == 0):
-            return 0
+        return self._get_tempo_map().seconds_to_tick(seconds)
 
-        target_tempo = SimpleNamespace()
-        target_tempo.time = seconds
-        base_tempo_index = lower_than(
-            self._proto.tempos,
-            target_tempo,
-            key=lambda x: x.time
-        )
-        if (base_tempo_index == -1):
-            # If no tempo is found before the time, use the first tempo.
-            base_tempo_index = 0
-
-        base_tempo_change_proto = self._proto.tempos[base_tempo_index]
-        time_delta = seconds - base_tempo_change_proto.time
-        ticks_per_second_since_last_tempo_change = Song._tempo_bpm_to_ticks_per_second(
-            base_tempo_change_proto.bpm,
-            self.get_resolution(),
-        )
-        return round(base_tempo_change_proto.ticks + time_delta * ticks_per_second_since_last_tempo_change)
+    def ticks_to_seconds_array(self, ticks: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized version of `tick_to_seconds`, converts an array of ticks at once.
+
+        @param ticks An array of ticks of any shape.
+        @returns A float64 array of the same shape, in seconds.
+        '''
+        return self._get_tempo_map().ticks_to_seconds_array(ticks)
+
+    def seconds_to_ticks_array(self, seconds: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized version of `seconds_to_tick`, converts an array of seconds at once.
+
+        @param seconds An array of seconds of any shape.
+        @returns An int64 array of the same shape, in ticks.
+        '''
+        return self._get_tempo_map().seconds_to_ticks_array(seconds)
+
+    def render_automation_envelopes(self, sample_rate: int, num_samples: int | None = None,
+                                    block_size: int | None = None, start_seconds=0.0, track_ids: List[str] | None = None):
+        '''
+        Renders the automation envelopes of many tracks, see `AutomationData.render_envelopes`.
+
+        The times of the samples are converted to ticks once and shared by all tracks.
+
+        @param track_ids The tracks to render, defaults to all tracks.
+        @returns The envelopes by `tf_automation_target_id` by track id, tracks without automation are left out.
+        '''
+        ticks = AutomationData.get_render_ticks(self, sample_rate, num_samples, block_size, start_seconds)
+        tracks = self.get_tracks() if track_ids is None else (self.get_track_by_id(track_id) for track_id in track_ids)
+        envelopes_by_track_id = {}
+        for track in tracks:
+            if track is None:
+                continue
+            envelopes = track.get_automation().sample_all(ticks)
+            if len(envelopes) > 0:
+                envelopes_by_track_id[track.get_id()] = envelopes
+        return envelopes_by_track_id
 
     def overwrite_tempo_changes(self, tempo_events: List[TempoEvent]):
         if len(tempo_events) == 0:
@@ -479,10 +859,12 @@ class Song:
         del self._proto.tempos[:]
         self._proto.tempos.add(
             ticks=0, time=0, bpm=first_tempo_event.get_bpm())
-        for i in range(1, len(sorted_tempo_events)):
-            tempo_event = sorted_tempo_events[i]
-            self.create_tempo_change(
-                ticks=tempo_event.get_ticks(), bpm=tempo_event.get_bpm())
+        self._invalidate_tempo_map()
+        with self.batch():
+            for i in range(1, len(sorted_tempo_events)):
+                tempo_event = sorted_tempo_events[i]
+                self.create_tempo_change(
+                    ticks=tempo_event.get_ticks(), bpm=tempo_event.get_bpm())
         self.retiming_tempo_events()
 
     def overwrite_time_signature_changes(self, time_signatures: List[TimeSignatureEvent]):
@@ -570,10 +952,16 @@ class Song:
             index = len(self._proto.tracks)
         self._proto.tracks.insert(index, new_track._proto)
         new_track._proto = self._proto.tracks[index]
+        self._invalidate_track_index()
+        self._on_track_added(new_track._proto)
         return new_track
 
     def get_next_track_rank(self):
-        return 1 if len(self._proto.tracks) == 0 else max([track.rank for track in self._proto.tracks]) + 1
+        if self._max_track_rank is None:
+            if len(self._proto.tracks) == 0:
+                return 1
+            self._max_track_rank = max([track.rank for track in self._proto.tracks])
+        return self._max_track_rank + 1
 
     def clone_track(self, track: Track) -> Track:
         '''
@@ -583,12 +971,528 @@ class Song:
         new_proto.CopyFrom(track._proto)
         new_proto.rank = self.get_next_track_rank()
         new_proto.uuid = Track._generate_track_id()
+        # The cloned notes are as up to date as the original ones.
+        for clip_proto in new_proto.clips:
+            key = (track.get_id(), clip_proto.id)
+            if key in self._note_times_version_by_clip_key:
+                self._note_times_version_by_clip_key[(new_proto.uuid, clip_proto.id)] = \
+                    self._note_times_version_by_clip_key[key]
         self._proto.tracks.insert(self.get_track_index(track.get_id()), new_proto)
+        self._invalidate_track_index()
+        self._on_track_added(new_proto)
         return self.get_track_by_id(new_proto.uuid)
 
+    @contextmanager
+    def batch(self):
+        '''
+        Defers the sorting and retiming done by mutators until the end of the block, e.g.
+
+        ```
+        with song.batch():
+            for tick, bpm in tempo_changes:
+                song.create_tempo_change(tick, bpm)
+        ```
+
+        Tempo events are retimed once, tempo events, structures, lyric lines, lyric
+        words and automation points are sorted once and clip conflicts are resolved once
+        per track when the outermost batch ends, instead of after every edit. Batches can be nested.
+
+        Reads that depend on the order, such as looking up an item by index or tick,
+        and tick/seconds conversions still see up to date data since they sort or retime
+        whatever is pending first. The times stored in tempo events are only updated when
+        the batch ends or when converting between ticks and seconds.
+
+        Clips may overlap until the batch ends. Conflicts are then resolved by the final
+        range of each edited clip, in the order the clips were last edited, so a clip edited
+        later trims the clips edited before it. Clips that moved within the batch only trim
+        other clips where they end up.
+        '''
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush_pending_edits()
+
     def __repr__(self) -> str:
         return str(self._proto)
 
+    def _sort_or_defer(self, container, key, priority: int = 0):
+        '''
+        Sorts a repeated field now, or at the end of the batch in batch mode.
+
+        @param priority Pending containers are sorted in ascending priority, e.g. lyric
+        words need to be sorted before lyric lines which are sorted by their first word.
+        '''
+        if self._batch_depth == 0:
+            container.sort(key=key)
+            return
+        self._pending_sorts[id(container)] = (priority, container, key)
+
+    def _flush_pending_sorts(self):
+        '''
+        Sorts all containers whose sorting has been deferred in batch mode.
+        '''
+        if len(self._pending_sorts) == 0:
+            return
+        pending_sorts = sorted(self._pending_sorts.values(), key=lambda pending_sort: pending_sort[0])
+        self._pending_sorts = {}
+        for _, container, key in pending_sorts:
+            container.sort(key=key)
+
+    def _update_note_times(self):
+        '''
+        Re-calculates the time of the notes of all clips that have changed since they were last timed.
+
+        Only clips whose notes have changed are retimed unless the tempo has changed, the times of all other notes,
+        e.g. the times deserialized from the host, are kept as they are.
+        '''
+        self._flush_tempo_retiming()
+        if self._tempo_version != self._note_times_base_version:
+            self._load_all_track_contents()
+            for track_proto in self._proto.tracks:
+                for clip in Track(song=self, proto=track_proto).get_clips():
+                    clip._update_note_times()
+        else:
+            for (track_id, clip_id), version in list(self._note_times_version_by_clip_key.items()):
+                if version == self._tempo_version:
+                    continue
+                track = self.get_track_by_id(track_id)
+                clip = track.get_clip_by_id(clip_id) if track is not None else None
+                if clip is not None:
+                    clip._update_note_times()
+        # All clips are timed at the current tempo version now.
+        self._note_times_base_version = self._tempo_version
+        self._note_times_version_by_clip_key = {}
+
+    @staticmethod
+    def _parse(buffer, audio_blob_store: AudioBlobStore | None, lazy: bool):
+        if not lazy:
+            song_proto = song_pb2.Song()
+            song_proto.ParseFromString(buffer)  # type: ignore
+            return Song(proto=song_proto, audio_blob_store=audio_blob_store)
+        song_proto, unloaded_track_content_by_id = parse_song_lazily(buffer)
+        song = Song(proto=song_proto, audio_blob_store=audio_blob_store)
+        song._unloaded_track_content_by_id = unloaded_track_content_by_id
+        return song
+
+    def _get_loaded_track(self, track_proto: song_pb2.Track):
+        self._load_track_content(track_proto)
+        return Track(song=self, proto=track_proto)
+
+    def _load_track_content(self, track_proto: song_pb2.Track):
+        '''
+        Parses the notes, clips and automation of a track if the song is deserialized lazily
+        and the track has not been loaded yet.
+        '''
+        if len(self._unloaded_track_content_by_id) == 0:
+            return
+        unloaded_track = self._unloaded_track_content_by_id.get(track_proto.uuid)
+        if unloaded_track is None or unloaded_track[0] is not track_proto:
+            return
+        del self._unloaded_track_content_by_id[track_proto.uuid]
+        track_proto.MergeFromString(unloaded_track[1].to_bytes())
+
+    def _load_all_track_contents(self):
+        for unloaded_track_proto, track_content in list(self._unloaded_track_content_by_id.values()):
+            unloaded_track_proto.MergeFromString(track_content.to_bytes())
+        self._unloaded_track_content_by_id = {}
+
+    def _serialize_with_unloaded_track_contents(self):
+        '''
+        Serializes the song, copying the serialized content of the tracks that are not loaded as is.
+        '''
+        chunks = [copy_without_field(self._proto, 'tracks').SerializeToString()]
+        for track_proto in self._proto.tracks:
+            serialized_track = track_proto.SerializeToString()
+            unloaded_track = self._unloaded_track_content_by_id.get(track_proto.uuid)
+            if unloaded_track is None or unloaded_track[0] is not track_proto:
+                chunks.append(encode_length_delimited_field_header(SONG_TRACKS_FIELD_NUMBER, len(serialized_track)))
+                chunks.append(serialized_track)
+                continue
+            content_slices = [view[start:end] for view, start, end in unloaded_track[1].slices]
+            track_length = len(serialized_track) + sum(len(content_slice) for content_slice in content_slices)
+            chunks.append(encode_length_delimited_field_header(SONG_TRACKS_FIELD_NUMBER, track_length))
+            chunks.append(serialized_track)
+            chunks.extend(content_slices)
+        return b''.join(chunks)
+
+    @contextmanager
+    def _externalize_audio_data(self, audio_blob_store: AudioBlobStore | None):
+        '''
+        Temporarily replaces the audio data of all clips with references to the store.
+
+        Clips sharing the same data, e.g. parts of a split audio clip, are stored and hashed once.
+        '''
+        if audio_blob_store is None:
+            yield
+            return
+        replaced_audio_data = []
+        key_by_data_id = {}
+        try:
+            for track_proto in self._proto.tracks:
+                for clip_proto in track_proto.clips:
+                    if not clip_proto.audio_clip_data.HasField('audio_data'):
+                        continue
+                    audio_data_proto = clip_proto.audio_clip_data.audio_data
+                    data = audio_data_proto.data
+                    if len(data) == 0 or AudioBlobStore.is_reference(data):
+                        continue
+                    key = key_by_data_id.get(id(data))
+                    if key is None:
+                        key = audio_blob_store.put(data)
+                        key_by_data_id[id(data)] = key
+                    replaced_audio_data.append((audio_data_proto, data))
+                    audio_data_proto.data = AudioBlobStore.to_reference(key)
+            yield
+        finally:
+            for audio_data_proto, data in replaced_audio_data:
+                audio_data_proto.data = data
+
+    def _reset_caches(self):
+        '''
+        Drops all indexes and aggregates derived from the proto, e.g. after the proto is patched.
+        '''
+        self._tempo_map: TempoMap | None = None
+        self._tempo_version += 1
+        self._track_index_by_id: dict | None = None
+        self._clip_index_by_track_id: dict = {}
+        self._clip_range_index_by_track_id: dict = {}
+        self._note_index_by_clip_key: dict = {}
+        # The tempo version the notes of all clips were timed at, except for the clips in the dict below,
+        # which are mapped to the tempo version they were last timed at or to None if their notes have changed.
+        self._note_times_base_version = self._tempo_version
+        self._note_times_version_by_clip_key: dict = {}
+        self._track_end_tick_by_id: dict | None = None
+        self._last_tick: int | None = None
+        self._max_track_rank: int | None = None
+
+    def _flush_pending_edits(self):
+        '''
+        Sorts and retimes everything that has been deferred in batch mode.
+        '''
+        self._flush_pending_sorts()
+        self._flush_tempo_retiming()
+        self._flush_clip_conflicts()
+
+    def _defer_clip_conflict(self, track_id: str, clip_id: str):
+        '''
+        Records that the conflicts of a clip need to be resolved at the end of the batch.
+        '''
+        pending_clip_ids = self._pending_clip_conflicts_by_track_id.setdefault(track_id, {})
+        # Move the clip to the end since it is the one edited last.
+        pending_clip_ids.pop(clip_id, None)
+        pending_clip_ids[clip_id] = None
+
+    def _flush_clip_conflicts(self):
+        '''
+        Resolves the clip conflicts that have been deferred in batch mode.
+        '''
+        # Resolving conflicts can split clips, whose conflicts are deferred again when flushing within a batch.
+        while len(self._pending_clip_conflicts_by_track_id) > 0:
+            pending_clip_conflicts_by_track_id = self._pending_clip_conflicts_by_track_id
+            self._pending_clip_conflicts_by_track_id = {}
+            for track_id, pending_clip_ids in pending_clip_conflicts_by_track_id.items():
+                track = self.get_track_by_id(track_id)
+                if track is None:
+                    continue
+                clip_ids = list(pending_clip_ids)
+                for index, clip_id in enumerate(clip_ids):
+                    clip = track.get_clip_by_id(clip_id)
+                    if clip is None:
+                        continue
+                    # Clips edited later are not trimmed here, they trim this clip when resolved themselves.
+                    track._trim_clips_overlapping_with(
+                        clip.get_clip_start_tick(), clip.get_clip_end_tick(), {clip_id, *clip_ids[index + 1:]})
+                    self._sort_clips_if_needed(track._proto)
+
+    def _sort_clips_if_needed(self, track_proto: song_pb2.Track):
+        '''
+        Restores the order of clips by start tick, which trimming the left side of a clip breaks
+        if another clip overlapping with it starts in between.
+        '''
+        clip_protos = track_proto.clips
+        if all(clip_protos[index - 1].clip_start_tick <= clip_protos[index].clip_start_tick
+               for index in range(1, len(clip_protos))):
+            return
+        clip_protos.sort(key=lambda clip_proto: clip_proto.clip_start_tick)
+        self._invalidate_clip_index(track_proto.uuid)
+        self._clip_range_index_by_track_id.pop(track_proto.uuid, None)
+
+    def _retime_tempo_events_or_defer(self, start_index: int):
+        '''
+        Re-calculates the time of the tempo events from the given index onward, or at the end of the batch in batch mode.
+
+        @param start_index The index of the first tempo event that is added, moved or whose previous event changed.
+        '''
+        if self._pending_tempo_retiming_index is not None:
+            start_index = min(start_index, self._pending_tempo_retiming_index)
+        if self._batch_depth == 0:
+            self._retime_tempo_events_from(start_index)
+        else:
+            self._pending_tempo_retiming_index = start_index
+
+    def _flush_tempo_retiming(self):
+        '''
+        Must be called before relying on the time of tempo events.
+        '''
+        if self._pending_tempo_retiming_index is not None:
+            self._retime_tempo_events_from(self._pending_tempo_retiming_index)
+
+    def _retime_tempo_events_from(self, start_index: int):
+        '''
+        Re-calculates the time of the sorted tempo events from the given index onward,
+        each event is timed from the event right before it, whose time is already up to date.
+        '''
+        self._pending_tempo_retiming_index = None
+        self._invalidate_tempo_map()
+        tempos = self._proto.tempos
+        if start_index <= 0:
+            if len(tempos) > 0 and tempos[0].ticks == 0:
+                tempos[0].time = 0
+            start_index = 1
+        if start_index >= len(tempos):
+            return
+        resolution = self.get_resolution()
+        base_tempo_change = tempos[start_index - 1]
+        base_ticks = base_tempo_change.ticks
+        base_time = base_tempo_change.time
+        ticks_per_second = Song._tempo_bpm_to_ticks_per_second(base_tempo_change.bpm, resolution)
+        for index in range(start_index, len(tempos)):
+            tempo_event_proto = tempos[index]
+            ticks = tempo_event_proto.ticks
+            if ticks == 0:
+                base_time = 0
+            elif ticks != base_ticks:
+                base_time = base_time + (ticks - base_ticks) / ticks_per_second
+            tempo_event_proto.time = base_time
+            # Time the next event from the stored time, which is rounded to float32.
+            base_time = tempo_event_proto.time
+            base_ticks = ticks
+            ticks_per_second = Song._tempo_bpm_to_ticks_per_second(tempo_event_proto.bpm, resolution)
+
+    def _remove_tempo_event_at(self, index: int):
+        '''
+        Removes a tempo event without retiming the tempo events after it.
+        '''
+        if self.get_tempo_event_count() <= 1:
+            raise Exception('Song has to have at least one tempo change. Update the last tempo change instead.')
+
+        if (index == 0):
+            raise Exception('Cannot remove the first tempo.')
+
+        self._proto.tempos.pop(index)
+        self._invalidate_tempo_map()
+
+    def _reposition_tempo_event(self, index: int):
+        '''
+        Moves the tempo event at the index to where a stable sort by ticks would put it.
+
+        @returns The new index of the tempo event.
+        '''
+        tempos = self._proto.tempos
+        tempo_proto = tempos[index]
+        new_index = greater_than(tempos, tempo_proto, lambda x: x.ticks, 0, index - 1)
+        if new_index == index:
+            new_index = greater_equal(tempos, tempo_proto, lambda x: x.ticks, index + 1) - 1
+        if new_index != index:
+            tempos.insert(new_index, tempos.pop(index))
+        return new_index
+
+    @staticmethod
+    def _get_structure_tick(structure_proto: song_pb2.StructureMarker):
+        return structure_proto.tick
+
+    def _on_track_added(self, track_proto: song_pb2.Track):
+        if self._max_track_rank is not None:
+            self._max_track_rank = max(self._max_track_rank, track_proto.rank)
+        self._on_track_end_tick_changed(track_proto)
+
+    def _on_track_removed(self, track_id: str, rank: int):
+        if self._max_track_rank is not None and rank >= self._max_track_rank:
+            self._max_track_rank = None
+        if self._track_end_tick_by_id is None:
+            return
+        old_end_tick = self._track_end_tick_by_id.pop(track_id, None)
+        if old_end_tick is not None and self._last_tick is not None and old_end_tick >= self._last_tick:
+            # The removed track may have been the last one, recompute on next use.
+            self._last_tick = None
+
+    def _on_track_end_tick_changed(self, track_proto: song_pb2.Track):
+        '''
+        Updates the cached last tick after clips of the given track are added, removed or resized.
+        '''
+        if self._track_end_tick_by_id is None:
+            return
+        new_end_tick = Song._get_track_proto_end_tick(track_proto)
+        old_end_tick = self._track_end_tick_by_id.get(track_proto.uuid)
+        self._track_end_tick_by_id[track_proto.uuid] = new_end_tick
+        if self._last_tick is None:
+            return
+        if new_end_tick > self._last_tick:
+            self._last_tick = new_end_tick
+        elif old_end_tick is not None and old_end_tick >= self._last_tick and new_end_tick < old_end_tick:
+            # The track might have been the last one and has shrunk, recompute on next use.
+            self._last_tick = None
+
+    def _check_cached_aggregates(self):
+        '''
+        Raises if the cached last tick or max track rank is inconsistent with the tracks, used in tests.
+        '''
+        expected_last_tick = max([track.get_track_end_tick() for track in self.get_tracks()], default=0)
+        if self.get_last_tick() != expected_last_tick:
+            raise Exception(f'Cached last tick {self.get_last_tick()} does not match actual last tick {expected_last_tick}')
+        expected_next_track_rank = 1 if len(self._proto.tracks) == 0 else max(
+            [track.rank for track in self._proto.tracks]) + 1
+        if self.get_next_track_rank() != expected_next_track_rank:
+            raise Exception(
+                f'Cached next track rank {self.get_next_track_rank()} does not match actual next track rank {expected_next_track_rank}')
+
+    @staticmethod
+    def _get_track_proto_end_tick(track_proto: song_pb2.Track):
+        if len(track_proto.clips) == 0:
+            return 0
+        return track_proto.clips[-1].clip_end_tick
+
+    def _lookup_track_index(self, track_id: str) -> int:
+        '''
+        Looks up the index of a track by its id.
+
+        The id->index map is built lazily and every hit is verified against the
+        tracks list, so it is rebuilt once if it went stale.
+        '''
+        track_protos = self._proto.tracks
+        if self._track_index_by_id is not None:
+            index = self._track_index_by_id.get(track_id)
+            if index is not None and index < len(track_protos) and track_protos[index].uuid == track_id:
+                return index
+        self._track_index_by_id = Song._build_id_index([track_proto.uuid for track_proto in track_protos])
+        return self._track_index_by_id.get(track_id, -1)
+
+    def _invalidate_track_index(self):
+        '''
+        Must be called whenever tracks are added, removed or reordered.
+        '''
+        self._track_index_by_id = None
+
+    def _lookup_clip_index(self, track_proto: song_pb2.Track, clip_id: str) -> int:
+        '''
+        Looks up the index of a clip within the given track by its id.
+
+        Works the same way as `_lookup_track_index`, with one id->index map per track.
+        '''
+        index = self._get_cached_clip_index(track_proto, clip_id)
+        if index is not None:
+            return index
+        clip_protos = track_proto.clips
+        clip_index_by_id = Song._build_id_index([clip_proto.id for clip_proto in clip_protos])
+        self._clip_index_by_track_id[track_proto.uuid] = clip_index_by_id
+        return clip_index_by_id.get(clip_id, -1)
+
+    def _get_cached_clip_index(self, track_proto: song_pb2.Track, clip_id: str) -> int | None:
+        '''
+        Returns the index of the clip if the id->index map of the track is up to date and contains it, otherwise None.
+        '''
+        clip_index_by_id = self._clip_index_by_track_id.get(track_proto.uuid)
+        if clip_index_by_id is None:
+            return None
+        index = clip_index_by_id.get(clip_id)
+        clip_protos = track_proto.clips
+        if index is not None and index < len(clip_protos) and clip_protos[index].id == clip_id:
+            return index
+        return None
+
+    def _invalidate_clip_index(self, track_id: str):
+        '''
+        Must be called whenever clips of the track are added, removed or reordered.
+        '''
+        self._clip_index_by_track_id.pop(track_id, None)
+
+    def _get_clip_range_index(self, track_proto: song_pb2.Track):
+        '''
+        Gets the sorted-endpoint index of the track's clips, builds it if it is missing.
+
+        The index is a pair of lists with one entry per clip: the start ticks, which
+        are sorted, and the running maximum of the end ticks, which are sorted as well.
+        Together they answer overlap queries with binary searches even if clips overlap.
+        '''
+        clip_range_index = self._clip_range_index_by_track_id.get(track_proto.uuid)
+        if clip_range_index is None or len(clip_range_index[0]) != len(track_proto.clips):
+            clip_start_ticks = [clip_proto.clip_start_tick for clip_proto in track_proto.clips]
+            clip_range_index = (clip_start_ticks, [0] * len(clip_start_ticks))
+            Song._update_clip_max_end_ticks(track_proto, clip_range_index, 0)
+            self._clip_range_index_by_track_id[track_proto.uuid] = clip_range_index
+        return clip_range_index
+
+    def _on_clip_inserted(self, track_proto: song_pb2.Track, clip_index: int):
+        clip_range_index = self._clip_range_index_by_track_id.get(track_proto.uuid)
+        if clip_range_index is not None:
+            clip_range_index[0].insert(clip_index, track_proto.clips[clip_index].clip_start_tick)
+            clip_range_index[1].insert(clip_index, 0)
+            self._update_clip_range_index(track_proto, clip_range_index, clip_index)
+        self._on_track_end_tick_changed(track_proto)
+
+    def _on_clip_removed(self, track_proto: song_pb2.Track, clip_index: int):
+        clip_range_index = self._clip_range_index_by_track_id.get(track_proto.uuid)
+        if clip_range_index is not None:
+            del clip_range_index[0][clip_index]
+            del clip_range_index[1][clip_index]
+            self._update_clip_range_index(track_proto, clip_range_index, clip_index)
+        self._on_track_end_tick_changed(track_proto)
+
+    def _on_clip_resized(self, track_proto: song_pb2.Track, clip_index: int):
+        clip_range_index = self._clip_range_index_by_track_id.get(track_proto.uuid)
+        if clip_range_index is not None:
+            clip_range_index[0][clip_index] = track_proto.clips[clip_index].clip_start_tick
+            self._update_clip_range_index(track_proto, clip_range_index, clip_index)
+        self._on_track_end_tick_changed(track_proto)
+
+    def _update_clip_range_index(self, track_proto: song_pb2.Track, clip_range_index, clip_index: int):
+        if len(clip_range_index[0]) != len(track_proto.clips):
+            # The clips were changed without notifying the song, rebuild on next use.
+            del self._clip_range_index_by_track_id[track_proto.uuid]
+            return
+        Song._update_clip_max_end_ticks(track_proto, clip_range_index, clip_index)
+
+    @staticmethod
+    def _update_clip_max_end_ticks(track_proto: song_pb2.Track, clip_range_index, from_index: int):
+        '''
+        Recomputes the running maximum of the end ticks from the given index, stops as soon as it is unchanged.
+        '''
+        clip_protos = track_proto.clips
+        clip_max_end_ticks = clip_range_index[1]
+        for index in range(from_index, len(clip_protos)):
+            max_end_tick = clip_protos[index].clip_end_tick
+            if index > 0:
+                max_end_tick = max(max_end_tick, clip_max_end_ticks[index - 1])
+            if index > from_index and clip_max_end_ticks[index] == max_end_tick:
+                # Later entries only depend on this one.
+                break
+            clip_max_end_ticks[index] = max_end_tick
+
+    @staticmethod
+    def _build_id_index(ids: List[str]):
+        # Iterate backwards so that the first occurrence wins for duplicate ids.
+        return {ids[index]: index for index in range(len(ids) - 1, -1, -1)}
+
+    def _get_tempo_map(self):
+        '''
+        Gets the tempo map used for tick/seconds conversion, builds it if it has been invalidated.
+        '''
+        self._flush_tempo_retiming()
+        if self._tempo_map is None:
+            self._tempo_map = TempoMap(self._proto.tempos, self.get_resolution())
+        return self._tempo_map
+
+    def _invalidate_tempo_map(self):
+        '''
+        Must be called whenever tempo events are modified, the tempo map will be rebuilt on next use
+        and the time of notes will be re-calculated when they are read.
+        '''
+        self._tempo_map = None
+        self._tempo_version += 1
+
     @staticmethod
     def _tempo_bpm_to_ticks_per_second(tempo_bpm: float, PPQ: int):
         return (tempo_bpm * PPQ) / 60
@@ -600,3 +1504,61 @@ class Song:
         '''
         return 480
 
+    @staticmethod
+    def _unpack_frame_header(header):
+        magic, version, payload_length = Song.FRAME_HEADER.unpack(header)
+        if magic != Song.FRAME_MAGIC:
+            raise Exception('The data is not a song frame.')
+        if version != Song.FRAME_VERSION:
+            raise Exception(f'Unsupported song frame version {version}.')
+        return payload_length
+
+    @staticmethod
+    def _read_exactly(file: BinaryIO, size: int):
+        '''
+        Reads the given number of bytes, pipes and sockets may return fewer bytes per read.
+
+        @returns The bytes read, which are empty if the stream has already ended.
+        '''
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        num_read_bytes = 0
+        while num_read_bytes < size:
+            num_bytes = file.readinto(view[num_read_bytes:])  # type: ignore
+            if not num_bytes:
+                break
+            num_read_bytes += num_bytes
+        if num_read_bytes == 0 and size > 0:
+            return b''
+        if num_read_bytes < size:
+            raise Exception(f'The stream ended after {num_read_bytes} of {size} bytes of the song frame.')
+        return buffer
+
+    @staticmethod
+    def _compress(data, compression: str):
+        if compression == 'zlib':
+            return zlib.compress(data)
+        return lzma.compress(data)
+
+    @staticmethod
+    def _decompress(data, compression_code: int):
+        if compression_code == Song.FILE_COMPRESSION_CODES['zlib']:
+            return zlib.decompress(data)
+        if compression_code == Song.FILE_COMPRESSION_CODES['lzma']:
+            return lzma.decompress(data)
+        raise Exception(f'Unsupported compression code {compression_code}.')
+
+    FRAME_MAGIC = b'TFSG'
+    FRAME_VERSION = 1
+    FRAME_HEADER = struct.Struct('>4sBQ')
+    '''
+    Header of the frames written by `write_frame`: a magic, the frame version and the payload length in bytes.
+    '''
+
+    COMPRESSED_FILE_MAGIC = b'TFSC'
+    COMPRESSED_FILE_HEADER = struct.Struct('>4sB')
+    '''
+    Header of the compressed files written by `save`: a magic and the compression code.
+    '''
+
+    FILE_COMPRESSION_CODES = {'zlib': 1, 'lzma': 2}
@@ -0,0 +1,278 @@
+'''
+Patches describe how a song changed since a snapshot of it was taken, at the granularity of the song header
+(everything except tracks), track headers (everything of a track except clips) and clips, so that only
+the changed parts need to be sent and parsed.
+
+A patch is a magic and a version followed by operations, each operation is an op code and a list
+of length-prefixed parts.
+'''
+from __future__ import annotations
+from tuneflow_py.models.protos import song_pb2
+from tuneflow_py.models.song_wire_format import copy_without_field
+from tuneflow_py.utils import remove_where
+from hashlib import blake2b
+import struct
+
+PATCH_MAGIC = b'TFPT'
+PATCH_VERSION = 1
+_PATCH_HEADER = struct.Struct('>4sB')
+_OP_HEADER = struct.Struct('>BH')
+_PART_LENGTH = struct.Struct('>I')
+_ID_SEPARATOR = b'\0'
+
+OP_SET_SONG_HEADER = 1
+OP_SET_TRACK = 2
+OP_REMOVE_TRACK = 3
+OP_SET_TRACK_HEADER = 4
+OP_SET_CLIP = 5
+OP_REMOVE_CLIP = 6
+OP_SET_CLIP_ORDER = 7
+OP_SET_TRACK_ORDER = 8
+
+
+class TrackSnapshot:
+    def __init__(self, header_digest: bytes, clip_ids: list, clip_digest_by_id: dict | None) -> None:
+        self.header_digest = header_digest
+        self.clip_ids = clip_ids
+        # None if clip ids are not unique, in which case the track is diffed as a whole.
+        self.clip_digest_by_id = clip_digest_by_id
+
+
+class SongSnapshot:
+    '''
+    Digests of the parts of a song, taken by `Song.take_snapshot`.
+    '''
+
+    def __init__(self, song_proto: song_pb2.Song) -> None:
+        self.header_digest = _get_digest(copy_without_field(song_proto, 'tracks'))
+        self.track_ids = [track_proto.uuid for track_proto in song_proto.tracks]
+        self.track_snapshot_by_id = {
+            track_proto.uuid: _take_track_snapshot(track_proto) for track_proto in song_proto.tracks}
+
+
+def create_patch(snapshot: SongSnapshot, song_proto: song_pb2.Song) -> bytes:
+    ops = []
+    song_header = copy_without_field(song_proto, 'tracks')
+    if _get_digest(song_header) != snapshot.header_digest:
+        ops.append((OP_SET_SONG_HEADER, [song_header.SerializeToString()]))
+
+    track_ids = [track_proto.uuid for track_proto in song_proto.tracks]
+    track_id_set = set(track_ids)
+    for track_id in snapshot.track_ids:
+        if track_id not in track_id_set:
+            ops.append((OP_REMOVE_TRACK, [_encode_id(track_id)]))
+    for track_proto in song_proto.tracks:
+        track_snapshot = snapshot.track_snapshot_by_id.get(track_proto.uuid)
+        current_track_snapshot = _take_track_snapshot(track_proto)
+        if (track_snapshot is None or track_snapshot.clip_digest_by_id is None or
+                current_track_snapshot.clip_digest_by_id is None):
+            if track_snapshot is None or not _are_track_snapshots_equal(track_snapshot, current_track_snapshot):
+                ops.append((OP_SET_TRACK, [track_proto.SerializeToString(deterministic=True)]))
+            continue
+        encoded_track_id = _encode_id(track_proto.uuid)
+        if current_track_snapshot.header_digest != track_snapshot.header_digest:
+            ops.append((OP_SET_TRACK_HEADER, [
+                encoded_track_id, copy_without_field(track_proto, 'clips').SerializeToString(deterministic=True)]))
+        for clip_id in track_snapshot.clip_ids:
+            if clip_id not in current_track_snapshot.clip_digest_by_id:
+                ops.append((OP_REMOVE_CLIP, [encoded_track_id, _encode_id(clip_id)]))
+        for clip_proto in track_proto.clips:
+            if track_snapshot.clip_digest_by_id.get(clip_proto.id) != current_track_snapshot.clip_digest_by_id[clip_proto.id]:
+                ops.append((OP_SET_CLIP, [encoded_track_id, clip_proto.SerializeToString(deterministic=True)]))
+        if current_track_snapshot.clip_ids != track_snapshot.clip_ids:
+            ops.append((OP_SET_CLIP_ORDER, [encoded_track_id, _encode_ids(current_track_snapshot.clip_ids)]))
+    if track_ids != snapshot.track_ids:
+        ops.append((OP_SET_TRACK_ORDER, [_encode_ids(track_ids)]))
+    return _encode_patch(ops)
+
+
+def apply_patch(song_proto: song_pb2.Song, patch) -> None:
+    track_index = _RepeatedFieldIndex(song_proto.tracks, 'uuid')
+    clip_index_by_track_id = {}
+
+    def get_clip_index(encoded_track_id: bytes):
+        track_id = _decode_id(encoded_track_id)
+        clip_index = clip_index_by_track_id.get(track_id)
+        if clip_index is None:
+            index = track_index.find(track_id)
+            if index < 0:
+                raise Exception(f'Track {track_id} in the patch is not found in the song.')
+            clip_index = _RepeatedFieldIndex(song_proto.tracks[index].clips, 'id')
+            clip_index_by_track_id[track_id] = clip_index
+        return clip_index
+
+    for op, parts in _decode_patch(patch):
+        if op == OP_SET_SONG_HEADER:
+            song_header = song_pb2.Song()
+            song_header.ParseFromString(parts[0])
+            for field, _ in song_proto.ListFields():
+                if field.name != 'tracks':
+                    song_proto.ClearField(field.name)
+            song_proto.MergeFrom(song_header)
+        elif op == OP_SET_TRACK:
+            new_track_proto = song_pb2.Track()
+            new_track_proto.ParseFromString(parts[0])
+            track_index.set(new_track_proto)
+            clip_index_by_track_id.pop(new_track_proto.uuid, None)
+        elif op == OP_REMOVE_TRACK:
+            track_id = _decode_id(parts[0])
+            track_index.remove(track_id)
+            clip_index_by_track_id.pop(track_id, None)
+        elif op == OP_SET_TRACK_HEADER:
+            track_id = _decode_id(parts[0])
+            index = track_index.find(track_id)
+            if index < 0:
+                raise Exception(f'Track {track_id} in the patch is not found in the song.')
+            track_proto = song_proto.tracks[index]
+            track_header = song_pb2.Track()
+            track_header.ParseFromString(parts[1])
+            for field, _ in track_proto.ListFields():
+                if field.name != 'clips':
+                    track_proto.ClearField(field.name)
+            track_proto.MergeFrom(track_header)
+        elif op == OP_SET_CLIP:
+            new_clip_proto = song_pb2.Clip()
+            new_clip_proto.ParseFromString(parts[1])
+            get_clip_index(parts[0]).set(new_clip_proto)
+        elif op == OP_REMOVE_CLIP:
+            get_clip_index(parts[0]).remove(_decode_id(parts[1]))
+        elif op == OP_SET_CLIP_ORDER:
+            get_clip_index(parts[0]).sort_by_ids(_decode_ids(parts[1]))
+        elif op == OP_SET_TRACK_ORDER:
+            track_index.sort_by_ids(_decode_ids(parts[0]))
+        else:
+            raise Exception(f'Unknown song patch operation {op}.')
+    track_index.flush_removals()
+    for clip_index in clip_index_by_track_id.values():
+        clip_index.flush_removals()
+
+
+class _RepeatedFieldIndex:
+    '''
+    Finds the messages of a repeated field by id while applying one patch, so that each operation
+    does not scan the field. Removals are applied together when the field is accessed next.
+    '''
+
+    def __init__(self, protos, id_field_name: str) -> None:
+        self.protos = protos
+        self.id_field_name = id_field_name
+        self._index_by_id: dict | None = None
+        self._removed_ids: set = set()
+
+    def find(self, id: str) -> int:
+        self.flush_removals()
+        if self._index_by_id is None:
+            self._index_by_id = {}
+            for index, proto in enumerate(self.protos):
+                # Keep the first message of each id.
+                self._index_by_id.setdefault(getattr(proto, self.id_field_name), index)
+        return self._index_by_id.get(id, -1)
+
+    def set(self, new_proto) -> None:
+        id = getattr(new_proto, self.id_field_name)
+        index = self.find(id)
+        if index < 0:
+            index = len(self.protos)
+            self.protos.add()
+            self._index_by_id[id] = index  # type: ignore
+        self.protos[index].CopyFrom(new_proto)
+
+    def remove(self, id: str) -> None:
+        self._removed_ids.add(id)
+
+    def sort_by_ids(self, ids: list) -> None:
+        self.flush_removals()
+        _sort_by_ids(self.protos, self.id_field_name, ids)
+        self._index_by_id = None
+
+    def flush_removals(self) -> None:
+        if len(self._removed_ids) == 0:
+            return
+        remove_mask = []
+        for proto in self.protos:
+            id = getattr(proto, self.id_field_name)
+            # Only remove the first message of each id.
+            remove_mask.append(id in self._removed_ids)
+            self._removed_ids.discard(id)
+        self._removed_ids = set()
+        if remove_where(self.protos, remove_mask) > 0:
+            self._index_by_id = None
+
+
+def _take_track_snapshot(track_proto: song_pb2.Track):
+    clip_ids = [clip_proto.id for clip_proto in track_proto.clips]
+    clip_digest_by_id = None
+    if len(set(clip_ids)) == len(clip_ids):
+        clip_digest_by_id = {clip_proto.id: _get_digest(clip_proto) for clip_proto in track_proto.clips}
+    else:
+        # Clip ids are not unique, digest all clips together.
+        clip_ids = [_get_digest(track_proto)]
+    return TrackSnapshot(_get_digest(copy_without_field(track_proto, 'clips')), clip_ids, clip_digest_by_id)
+
+
+def _are_track_snapshots_equal(snapshot1: TrackSnapshot, snapshot2: TrackSnapshot):
+    return (snapshot1.header_digest == snapshot2.header_digest and snapshot1.clip_ids == snapshot2.clip_ids and
+            snapshot1.clip_digest_by_id == snapshot2.clip_digest_by_id)
+
+
+def _get_digest(proto) -> bytes:
+    return blake2b(proto.SerializeToString(deterministic=True), digest_size=16).digest()
+
+
+def _sort_by_ids(protos, id_field_name: str, ids: list):
+    # Sorting the repeated field in place does not copy the messages.
+    position_by_id = {id: position for position, id in enumerate(ids)}
+    protos.sort(key=lambda proto: position_by_id.get(getattr(proto, id_field_name), len(ids)))
+
+
+def _encode_id(id: str) -> bytes:
+    return id.encode('utf-8')
+
+
+def _decode_id(encoded_id) -> str:
+    return bytes(encoded_id).decode('utf-8')
+
+
+def _encode_ids(ids: list) -> bytes:
+    return _ID_SEPARATOR.join(_encode_id(id) for id in ids)
+
+
+def _decode_ids(encoded_ids) -> list:
+    encoded_ids = bytes(encoded_ids)
+    if len(encoded_ids) == 0:
+        return []
+    return [_decode_id(encoded_id) for encoded_id in encoded_ids.split(_ID_SEPARATOR)]
+
+
+def _encode_patch(ops: list) -> bytes:
+    chunks = [_PATCH_HEADER.pack(PATCH_MAGIC, PATCH_VERSION)]
+    for op, parts in ops:
+        chunks.append(_OP_HEADER.pack(op, len(parts)))
+        for part in parts:
+            chunks.append(_PART_LENGTH.pack(len(part)))
+            chunks.append(part)
+    return b''.join(chunks)
+
+
+def _decode_patch(patch):
+    view = memoryview(patch)
+    if len(view) < _PATCH_HEADER.size:
+        raise Exception('The data is not a song patch.')
+    magic, version = _PATCH_HEADER.unpack(view[:_PATCH_HEADER.size])
+    if magic != PATCH_MAGIC:
+        raise Exception('The data is not a song patch.')
+    if version != PATCH_VERSION:
+        raise Exception(f'Unsupported song patch version {version}.')
+    offset = _PATCH_HEADER.size
+    while offset < len(view):
+        op, num_parts = _OP_HEADER.unpack(view[offset:offset + _OP_HEADER.size])
+        offset += _OP_HEADER.size
+        parts = []
+        for _ in range(num_parts):
+            (part_length,) = _PART_LENGTH.unpack(view[offset:offset + _PART_LENGTH.size])
+            offset += _PART_LENGTH.size
+            if offset + part_length > len(view):
+                raise Exception('The song patch is truncated.')
+            parts.append(view[offset:offset + part_length])
+            offset += part_length
+        yield op, parts
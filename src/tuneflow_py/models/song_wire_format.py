@@ -0,0 +1,153 @@
+'''
+Helpers that work on the protobuf wire format of songs directly, so that parts of a serialized
+song can be located, skipped and copied through without being parsed.
+
+See https://protobuf.dev/programming-guides/encoding/
+'''
+from __future__ import annotations
+from tuneflow_py.models.protos import song_pb2
+
+_WIRE_TYPE_VARINT = 0
+_WIRE_TYPE_FIXED64 = 1
+_WIRE_TYPE_LENGTH_DELIMITED = 2
+_WIRE_TYPE_FIXED32 = 5
+
+SONG_TRACKS_FIELD_NUMBER = song_pb2.Song.DESCRIPTOR.fields_by_name['tracks'].number
+
+TRACK_CONTENT_FIELD_NUMBERS = frozenset(
+    song_pb2.Track.DESCRIPTOR.fields_by_name[field_name].number for field_name in ['notes', 'clips', 'automation'])
+'''
+The fields of a track that hold its content, which are parsed when the track is first accessed
+if the song is deserialized lazily. All other fields of the track are parsed eagerly.
+'''
+
+
+class SerializedFields:
+    '''
+    Encoded fields of a message that have not been parsed yet, e.g. the content of a track.
+
+    The slices are views of the buffer the song is deserialized from, so it is not copied.
+    '''
+
+    def __init__(self) -> None:
+        self.slices = []
+
+    def append(self, view: memoryview, start: int, end: int):
+        if len(self.slices) > 0 and self.slices[-1][0] is view and self.slices[-1][2] == start:
+            # Merges adjacent fields, e.g. clips, into one slice.
+            self.slices[-1] = (view, self.slices[-1][1], end)
+            return
+        self.slices.append((view, start, end))
+
+    def to_bytes(self) -> bytes:
+        return b''.join(view[start:end] for view, start, end in self.slices)
+
+
+def parse_song_lazily(buffer):
+    '''
+    Parses everything of a serialized song except the content of its tracks.
+
+    @returns The song proto whose tracks do not contain notes, clips and automation, and
+    a dict of each track proto and its unparsed content by track id.
+    '''
+    view = memoryview(buffer)
+    song_proto = song_pb2.Song()
+    header = SerializedFields()
+    content_by_track_id = {}
+    for field_number, field_start, payload_start, field_end in iterate_fields(view, 0, len(view)):
+        if field_number != SONG_TRACKS_FIELD_NUMBER:
+            header.append(view, field_start, field_end)
+            continue
+        track_header = SerializedFields()
+        track_content = SerializedFields()
+        for track_field_number, track_field_start, _, track_field_end in iterate_fields(view, payload_start, field_end):
+            if track_field_number in TRACK_CONTENT_FIELD_NUMBERS:
+                track_content.append(view, track_field_start, track_field_end)
+            else:
+                track_header.append(view, track_field_start, track_field_end)
+        track_proto = song_proto.tracks.add()
+        track_proto.MergeFromString(track_header.to_bytes())
+        if len(track_content.slices) == 0:
+            continue
+        if track_proto.uuid in content_by_track_id:
+            # Tracks with duplicate ids cannot be told apart later, parse them now.
+            track_proto.MergeFromString(track_content.to_bytes())
+            continue
+        content_by_track_id[track_proto.uuid] = (track_proto, track_content)
+    song_proto.MergeFromString(header.to_bytes())
+    return song_proto, content_by_track_id
+
+
+def iterate_fields(view: memoryview, start: int, end: int):
+    '''
+    Iterates over the encoded fields of a message in `view[start:end]`.
+
+    @returns For each field, its number, where it starts, where its payload starts and where it ends.
+    '''
+    offset = start
+    while offset < end:
+        field_start = offset
+        tag, offset = decode_varint(view, offset)
+        wire_type = tag & 7
+        if wire_type == _WIRE_TYPE_VARINT:
+            _, offset = decode_varint(view, offset)
+            payload_start = field_start
+        elif wire_type == _WIRE_TYPE_LENGTH_DELIMITED:
+            length, payload_start = decode_varint(view, offset)
+            offset = payload_start + length
+        elif wire_type == _WIRE_TYPE_FIXED64:
+            payload_start = offset
+            offset += 8
+        elif wire_type == _WIRE_TYPE_FIXED32:
+            payload_start = offset
+            offset += 4
+        else:
+            raise Exception(f'Unsupported wire type {wire_type}.')
+        if offset > end:
+            raise Exception('The serialized message is truncated.')
+        yield tag >> 3, field_start, payload_start, offset
+
+
+def decode_varint(view: memoryview, offset: int):
+    '''
+    @returns The decoded value and the offset right after it.
+    '''
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(view):
+            raise Exception('The serialized message is truncated.')
+        byte = view[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_varint(value: int) -> bytes:
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_length_delimited_field_header(field_number: int, length: int) -> bytes:
+    return encode_varint((field_number << 3) | _WIRE_TYPE_LENGTH_DELIMITED) + encode_varint(length)
+
+
+def copy_without_field(proto, excluded_field_name: str):
+    '''
+    Copies all fields of a message except one, without copying the excluded field.
+    '''
+    new_proto = type(proto)()
+    for field, value in proto.ListFields():
+        if field.name == excluded_field_name:
+            continue
+        if field.label == field.LABEL_REPEATED or field.cpp_type == field.CPPTYPE_MESSAGE:
+            getattr(new_proto, field.name).MergeFrom(value)
+        else:
+            setattr(new_proto, field.name, value)
+    return new_proto
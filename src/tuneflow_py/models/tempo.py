@@ -1,5 +1,7 @@
 from __future__ import annotations
 from tuneflow_py.models.protos import song_pb2
+from bisect import bisect_left
+import numpy as np
 
 
 class TempoEvent:
@@ -29,3 +31,65 @@ class TempoEvent:
 
     def __repr__(self) -> str:
         return str(self._proto)
+
+
+class TempoMap:
+    '''
+    A read-only index of a song's tempo events for fast tick/seconds conversion.
+
+    It keeps the ticks, times and ticks-per-second of the tempo events in parallel lists
+    so that conversions are a `bisect` on plain lists instead of a binary search over protos.
+
+    IMPORTANT: Do not create it directly, songs build and invalidate it when their tempo events change.
+    '''
+
+    def __init__(self, tempo_protos, resolution: int) -> None:
+        self.ticks = [tempo_proto.ticks for tempo_proto in tempo_protos]
+        self.times = [tempo_proto.time for tempo_proto in tempo_protos]
+        self.ticks_per_second = [(tempo_proto.bpm * resolution) / 60 for tempo_proto in tempo_protos]
+        self._arrays = None
+
+    def tick_to_seconds(self, tick: int):
+        if tick == 0:
+            return 0
+        # Index of the last tempo event strictly before the tick,
+        # if no tempo is found before the tick, use the first tempo.
+        base_index = max(bisect_left(self.ticks, tick) - 1, 0)
+        return self.times[base_index] + (tick - self.ticks[base_index]) / self.ticks_per_second[base_index]
+
+    def seconds_to_tick(self, seconds: float):
+        if seconds == 0:
+            return 0
+        # Index of the last tempo event strictly before the time,
+        # if no tempo is found before the time, use the first tempo.
+        base_index = max(bisect_left(self.times, seconds) - 1, 0)
+        return round(self.ticks[base_index] + (seconds - self.times[base_index]) * self.ticks_per_second[base_index])
+
+    def ticks_to_seconds_array(self, ticks: np.ndarray) -> np.ndarray:
+        ticks = np.asarray(ticks)
+        tempo_ticks, tempo_times, tempo_ticks_per_second = self._get_arrays()
+        base_indices = np.maximum(np.searchsorted(tempo_ticks, ticks, side='left') - 1, 0)
+        seconds = tempo_times[base_indices] + (ticks - tempo_ticks[base_indices]) / tempo_ticks_per_second[base_indices]
+        return np.where(ticks == 0, 0.0, seconds)
+
+    def seconds_to_ticks_array(self, seconds: np.ndarray) -> np.ndarray:
+        return np.round(self.seconds_to_fractional_ticks_array(seconds)).astype(np.int64)
+
+    def seconds_to_fractional_ticks_array(self, seconds: np.ndarray) -> np.ndarray:
+        '''
+        Same as `seconds_to_ticks_array` but without rounding the ticks.
+        '''
+        seconds = np.asarray(seconds, dtype=np.float64)
+        tempo_ticks, tempo_times, tempo_ticks_per_second = self._get_arrays()
+        base_indices = np.maximum(np.searchsorted(tempo_times, seconds, side='left') - 1, 0)
+        ticks = tempo_ticks[base_indices] + (seconds - tempo_times[base_indices]) * tempo_ticks_per_second[base_indices]
+        return np.where(seconds == 0, 0.0, ticks)
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            self._arrays = (
+                np.array(self.ticks, dtype=np.int64),
+                np.array(self.times, dtype=np.float64),
+                np.array(self.ticks_per_second, dtype=np.float64),
+            )
+        return self._arrays
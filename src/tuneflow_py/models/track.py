@@ -5,10 +5,10 @@ from tuneflow_py.models.clip import Clip, ClipType
 from tuneflow_py.models.note import Note
 from tuneflow_py.models.audio_plugin import AudioPlugin
 from tuneflow_py.models.automation import AutomationData
-from tuneflow_py.utils import db_to_volume_value, volume_value_to_db, lower_equal, greater_equal, lower_than, decode_audio_plugin_tuneflow_id
+from tuneflow_py.utils import db_to_volume_value, volume_value_to_db, lower_equal, greater_equal, decode_audio_plugin_tuneflow_id
+from bisect import bisect_left, bisect_right
 import nanoid
 from typing import List
-from types import SimpleNamespace
 
 TrackType = song_pb2.TrackType
 TrackOutputType = song_pb2.TrackOutput.TrackOutputType
@@ -250,10 +250,10 @@ class Track:
         return self.get_clip_at(self.get_clip_count() - 1).get_clip_end_tick()
 
     def get_clip_by_id(self, clip_id: str):
-        for clip_proto in self._proto.clips:
-            if clip_proto.id == clip_id:
-                return self._create_clip_from_proto(proto=clip_proto)
-        return None
+        index = self.song._lookup_clip_index(self._proto, clip_id)
+        if index < 0:
+            return None
+        return self._create_clip_from_proto(proto=self._proto.clips[index])
 
     def create_midi_clip(self, clip_start_tick: int, clip_end_tick: int | None = None, insert_clip=True):
         '''
@@ -333,9 +333,16 @@ class Track:
     def get_clip_index(self, clip: Clip):
         '''
         Get the index of the clip within the clip list.
+        Returns -1 if the clip is not in this track.
 
-        NOTE: This assumes the clip list is sorted.
+        NOTE: Unless the clip id index is up to date, this assumes the clip list is sorted.
         '''
+        # Use the clip id index if it is up to date, rebuilding it here would cost
+        # more than the search below when clips are moved one by one.
+        index = self.song._get_cached_clip_index(self._proto, clip.get_id())
+        if index is not None:
+            return index
+
         start_index = lower_equal(
             self._proto.clips,
             clip._proto,
@@ -366,27 +373,24 @@ class Track:
             self.get_automation().remove_all_points_within_range(clip.get_clip_start_tick(), clip.get_clip_end_tick())
 
         self._proto.clips.pop(index)
+        self.song._invalidate_clip_index(self.get_id())
+        self.song._on_clip_removed(self._proto, index)
 
     def get_clips_overlapping_with(self, start_tick: int, end_tick: int):
         '''
         Gets the clips whose range overlaps with the given range.
         '''
         overlapping_clips: List[Clip] = []
-        target_clip = SimpleNamespace()
-        target_clip.clip_start_tick = start_tick
-        start_index = lower_than(
-            self._proto.clips,
-            target_clip,
-            key=lambda x: x.clip_start_tick,
-        )
-        for i in range(max(start_index, 0), len(self._proto.clips)):
+        clip_start_ticks, clip_max_end_ticks = self.song._get_clip_range_index(self._proto)
+        # Clips from this index on start after the range.
+        end_index = bisect_right(clip_start_ticks, end_tick)
+        # Clips before this index end before the range.
+        start_index = bisect_left(clip_max_end_ticks, start_tick, 0, end_index)
+        for i in range(start_index, end_index):
             current_clip_proto = self._proto.clips[i]
             if (current_clip_proto.clip_end_tick < start_tick):
                 continue
 
-            if current_clip_proto.clip_start_tick > end_tick:
-                break
-
             overlapping_clips.append(self._create_clip_from_proto(proto=current_clip_proto))
 
         return overlapping_clips
@@ -402,7 +406,7 @@ class Track:
         return plugin
 
     def get_automation(self):
-        return AutomationData(self._proto.automation)
+        return AutomationData(self._proto.automation, song=self.song)
 
     def clone_clip(self, clip: Clip):
         '''
@@ -411,8 +415,7 @@ class Track:
         @param clip The clip (not necessarily in this track) to clone.
         @returns The cloned clip.
         '''
-        new_clip_proto = song_pb2.Clip()
-        new_clip_proto.CopyFrom(clip._proto)
+        new_clip_proto = clip._clone_proto()
         new_clip_proto.id = Clip._generate_clip_id()
         return Clip(proto=new_clip_proto, song=self.song)
 
@@ -431,13 +434,28 @@ class Track:
         self._proto.ClearField('output')
 
     def _resolve_clip_conflict(self, clip_id: str, start_tick: int, end_tick: int):
+        if self.song is not None and self.song._batch_depth > 0:
+            # Resolved by the final range of the clip when the batch ends.
+            self.song._defer_clip_conflict(self.get_id(), clip_id)
+            return
+        self._trim_clips_overlapping_with(start_tick, end_tick, {clip_id})
+
+    def _trim_clips_overlapping_with(self, start_tick: int, end_tick: int, excluded_clip_ids: set):
         overlapping_clips = self.get_clips_overlapping_with(
             start_tick, end_tick)
         for clip in overlapping_clips:
-            if clip.get_id() == clip_id:
+            if clip.get_id() in excluded_clip_ids:
                 continue
             clip._trim_conflict_part(start_tick, end_tick)
 
+    def _insert_split_clip(self, right_clip: Clip):
+        '''
+        Inserts the right part of a split clip, which takes the place of the original clip and does not trim
+        other clips, even if they overlap with it until the clip conflicts deferred in a batch are resolved.
+        '''
+        right_clip.track = self
+        self._ordered_insert_clip(right_clip)
+
     def _ordered_insert_clip(self, new_clip: Clip):
         insert_index = greater_equal(
             self._proto.clips,
@@ -448,6 +466,22 @@ class Track:
         self._proto.clips.insert(insert_index, new_clip._proto)
         # Re-assign proto since protobuf created a new copy for the inserted proto
         new_clip._proto = self._proto.clips[insert_index]
+        # The clip may come from another track or no track, whose note times are not tracked under this track.
+        new_clip._invalidate_note_times()
+        self.song._invalidate_clip_index(self.get_id())
+        self.song._on_clip_inserted(self._proto, insert_index)
+
+    def _on_clip_range_changed(self, clip: Clip):
+        '''
+        Must be called whenever a clip of this track is resized so that the song's last tick
+        and the track's clip range index stay up to date.
+        '''
+        clip_index = self.get_clip_index(clip)
+        if clip_index < 0:
+            # The clip list is not sorted if clips were adjusted without resolving conflicts.
+            clip_index = self.song._lookup_clip_index(self._proto, clip.get_id())
+        if clip_index >= 0:
+            self.song._on_clip_resized(self._proto, clip_index)
 
     def _create_clip_from_proto(self, proto: song_pb2.Clip):
         return Clip(song=self.song, track=self, proto=proto)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from math import exp, log10, log, pow
-from typing import Callable
+from typing import Callable, List
 
 
 def db_to_volume_value(db: float):
@@ -41,6 +41,53 @@ def gain_to_volume_value(gain: float):
     return exp((20 * log10(gain) - 6) * (1 / 20)) if gain > 0 else 0
 
 
+def remove_where(repeated_field, remove_mask: List[bool]) -> int:
+    '''
+    Removes the items of a repeated protobuf field whose mask value is True, keeping the order of the remaining items.
+
+    The items are removed in place, so the remaining messages are never copied and wrappers of them stay attached
+    to the field. A few runs of consecutive removed items are removed with one slice deletion each, starting from
+    the back. Many runs, where each deletion would shift most of the field, are moved to the end with one stable
+    sort instead, which reorders the existing messages without copying them, and removed with one slice deletion.
+
+    @returns The number of removed items.
+    '''
+    run_bounds = []
+    run_start_index = None
+    for index, is_removed in enumerate(remove_mask):
+        if is_removed and run_start_index is None:
+            run_start_index = index
+        elif not is_removed and run_start_index is not None:
+            run_bounds.append((run_start_index, index))
+            run_start_index = None
+    if run_start_index is not None:
+        run_bounds.append((run_start_index, len(remove_mask)))
+    if len(run_bounds) == 0:
+        return 0
+    num_removed_items = sum(end_index - start_index for start_index, end_index in run_bounds)
+    if len(run_bounds) <= _MAX_SLICE_DELETIONS:
+        for start_index, end_index in reversed(run_bounds):
+            del repeated_field[start_index:end_index]
+        return num_removed_items
+    sort_by_keys(repeated_field, [bool(is_removed) for is_removed in remove_mask])
+    del repeated_field[len(repeated_field) - num_removed_items:]
+    return num_removed_items
+
+
+_MAX_SLICE_DELETIONS = 256
+
+
+def sort_by_keys(repeated_field, keys: list):
+    '''
+    Stably sorts the items of a repeated protobuf field in place by the given keys, one per item in the current order.
+
+    Sorting reorders the existing messages without copying them, so wrappers of them stay attached to the field.
+    '''
+    # Keys are computed once per item in the order of the items, so they follow the keys by position.
+    key_iterator = iter(keys)
+    repeated_field.sort(key=lambda _: next(key_iterator))
+
+
 def greater_equal(sorted_list: list, val, key: Callable | None = None, low: int | None = None, high: int | None = None):
     '''
     Returns the index of the first item in the array >= val. This is a successor query which also returns the item if present.
@@ -1,4 +1,8 @@
-from tuneflow_py import Song, TrackType, ClipType
+from tuneflow_py import Song, TrackType, ClipType, LocalAudioBlobStore
+from google.protobuf.internal import api_implementation
+from pathlib import Path
+import os
+import tempfile
 import unittest
 import pytest
 
@@ -326,6 +330,75 @@ class TestBasicGetAndSetOperations(BaseTestCase):
         self.assertEqual(clip1.get_audio_clip_data().audio_data.format, 'mp3') #type:ignore
 
 
+class TestAudioBlobStore(BaseTestCase):
+    def test_serialize_with_audio_blob_store(self):
+        data = os.urandom(100000)
+        self.audio_track.create_audio_clip(
+            clip_start_tick=0,
+            clip_end_tick=960,
+            audio_clip_data={
+                "audio_data": {"data": data, "format": "wav"},
+                "start_tick": 0,
+                "duration": 1,
+            },
+        )
+        # Splits the clip into two clips with the same audio data.
+        self.audio_track.create_audio_clip(
+            clip_start_tick=240, clip_end_tick=720, audio_clip_data=TEST_AUDIO_CLIP_DATA)
+        self.assertEqual(self.audio_track.get_clip_count(), 3)
+        with tempfile.TemporaryDirectory() as directory:
+            audio_blob_store = LocalAudioBlobStore(directory)
+            serialized_song = self.song.serialize_to_bytestring(audio_blob_store=audio_blob_store)
+            self.assertLess(len(serialized_song), len(data))
+            self.assertEqual(len([path for path in Path(directory).rglob('*') if path.is_file()]), 1)
+            # The song itself still holds the audio data.
+            self.assertEqual(self.audio_track.get_clip_at(0).get_audio_data(), data)
+
+            song = Song.deserialize_from_bytestring(serialized_song, audio_blob_store=audio_blob_store)
+            audio_track = song.get_track_at(0)
+            self.assertEqual(audio_track.get_clip_at(0).get_audio_data()[:], data)  # type:ignore
+            self.assertEqual(audio_track.get_clip_at(2).get_audio_data()[:], data)  # type:ignore
+            self.assertIsNone(audio_track.get_clip_at(1).get_audio_data())
+            # References are kept when serializing again.
+            self.assertEqual(song.serialize_to_bytestring(), serialized_song)
+            with pytest.raises(Exception):
+                Song.deserialize_from_bytestring(serialized_song).get_track_at(0).get_clip_at(0).get_audio_data()
+
+    def test_split_and_clone_share_audio_data(self):
+        data = os.urandom(100000)
+        with tempfile.TemporaryDirectory() as directory:
+            song = Song(audio_blob_store=LocalAudioBlobStore(directory))
+            audio_track = song.create_track(type=TrackType.AUDIO_TRACK)
+            audio_track.create_audio_clip(
+                clip_start_tick=0,
+                clip_end_tick=960,
+                audio_clip_data={
+                    "audio_data": {"data": data, "format": "wav"},
+                    "start_tick": 0,
+                    "duration": 1,
+                },
+            )
+            audio_track.create_audio_clip(
+                clip_start_tick=240, clip_end_tick=720, audio_clip_data=TEST_AUDIO_CLIP_DATA)
+            self.assertEqual(audio_track.get_clip_count(), 3)
+            left_clip = audio_track.get_clip_at(0)
+            right_clip = audio_track.get_clip_at(2)
+            cloned_clip = audio_track.clone_clip(left_clip)
+            self.assertEqual(cloned_clip.get_audio_clip_data().audio_data.format, "wav")  # type:ignore
+            self.assertEqual(cloned_clip.get_audio_clip_data().duration, 1)  # type:ignore
+            if api_implementation.Type() == 'python':
+                # The pure-Python backend keeps the same bytes object instead of copying the audio.
+                self.assertIs(right_clip.get_audio_data(), left_clip.get_audio_data())
+                self.assertIs(cloned_clip.get_audio_data(), left_clip.get_audio_data())
+            # Nothing is stored until the song is serialized.
+            self.assertEqual(len([path for path in Path(directory).rglob('*') if path.is_file()]), 0)
+            serialized_song = song.serialize_to_bytestring()
+            self.assertLess(len(serialized_song), len(data))
+            self.assertEqual(len([path for path in Path(directory).rglob('*') if path.is_file()]), 1)
+            self.assertEqual(left_clip.get_audio_data(), data)
+            self.assertEqual(right_clip.get_audio_data(), data)
+
+
 class TestTrimLeftAndTrimRight(BaseTestCase):
     def test_trim_left_within_audio_range(self):
         clip1 = self.audio_track.create_audio_clip(
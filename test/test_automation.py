@@ -1,3 +1,5 @@
+import numpy as np
+import time
 import unittest
 from unittest.mock import ANY
 from tuneflow_py import Song, TrackType, AutomationTarget, AutomationTargetType, AutomationValue, AutomationData, AutomationPoint
@@ -260,6 +262,49 @@ class AutomationValueTestCase(unittest.TestCase):
             },
         ])
 
+    def test_removes_points_where(self):
+        automation_value = AutomationValue()
+        automation_value.add_points(ticks=np.arange(10), values=np.arange(10) / 10)
+        self.assertEqual(automation_value.remove_points_where(lambda point: point.tick % 3 == 0), 4)
+        self.assertEqual([point.tick for point in automation_value.get_points()], [1, 2, 4, 5, 7, 8])
+        self.assertEqual(automation_value.remove_points_where(np.array([True, False, False, True, False, True])), 3)
+        self.assertEqual([point.tick for point in automation_value.get_points()], [2, 4, 7])
+        self.assertEqual(automation_value.remove_points([100]), 0)
+        self.assertEqual(automation_value.remove_points([3, 8]), 2)
+        self.assertEqual([point.tick for point in automation_value.get_points()], [4])
+        with self.assertRaises(Exception):
+            automation_value.remove_points_where(np.array([True, False]))
+
+    def test_removes_one_point_of_many_in_place(self):
+        automation_value = AutomationValue()
+        automation_value.add_points(ticks=np.arange(100000), values=np.zeros(100000))
+        point = automation_value.get_points()[-1]
+        start_time = time.perf_counter()
+        point_ids = [point.id for point in automation_value.get_points()]
+        scan_duration = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        self.assertEqual(automation_value.remove_points([point_ids[0]]), 1)
+        remove_duration = time.perf_counter() - start_time
+        # Removing one point costs about one scan over the points, the others are neither copied nor rebuilt.
+        self.assertLess(remove_duration, 10 * scan_duration)
+        self.assertIs(automation_value.get_points()[-1], point)
+        self.assertEqual(len(automation_value.get_points()), 99999)
+
+    def test_simplifies_points(self):
+        automation_value = AutomationValue()
+        # A ramp with a small bump, a jump and a flat tail, points added at the same tick go before existing ones.
+        automation_value.add_points(
+            ticks=[0, 10, 20, 30, 40, 40, 40, 50, 60, 70],
+            values=[0, 0.1, 0.21, 0.3, 1, 0.9, 0.4, 1, 1, 1])
+        original_values = automation_value.sample(np.arange(80))
+        self.assertEqual(automation_value.simplify(0.02), 6)
+        self.assertEqual([(point.tick, point.value) for point in automation_value.get_points()], [
+            (0, 0), (40, CloseFloat(0.4)), (40, 1), (70, 1)])
+        np.testing.assert_allclose(automation_value.sample(np.arange(80)), original_values, atol=0.02)
+        self.assertEqual(automation_value.simplify(0.02), 0)
+        with self.assertRaises(Exception):
+            automation_value.simplify(-1)
+
     def test_remove_points_in_range(self):
         automation_value = AutomationValue()
         self.assertEqual(points_to_objects(automation_value.get_points()), [])
@@ -551,6 +596,86 @@ class AutomationValueTestCase(unittest.TestCase):
             },
         ])
 
+    def test_moves_points_in_batch(self):
+        song, track = create_song()
+        target = AutomationTarget(AutomationTargetType.VOLUME)
+        track.get_automation().add_automation(target)
+        automation_value = track.get_automation().get_automation_value_by_target(target)
+        for tick in range(1, 5):
+            automation_value.add_point(tick=tick, value=0.5)  # type:ignore
+        with song.batch():
+            automation_value.move_points([1], 10, 0, overwrite_values_in_drag_area=False)  # type:ignore
+            automation_value.move_points([2], 5, 0, overwrite_values_in_drag_area=False)  # type:ignore
+            self.assertEqual(len(song._pending_sorts), 1)
+        self.assertEqual(len(song._pending_sorts), 0)
+        self.assertEqual(
+            [(point.id, point.tick) for point in automation_value.get_points()],  # type:ignore
+            [(3, 3), (4, 4), (2, 7), (1, 11)])
+
+    def test_adds_points_in_bulk(self):
+        automation_value = AutomationValue()
+        automation_value.add_point(tick=2, value=0.5)
+        automation_value.add_point(tick=4, value=0.5)
+        added_points = automation_value.add_points(ticks=[5, 2, 1], values=[0.25, 2, 0.75])
+        self.assertEqual([point.id for point in added_points], [3, 4, 5])
+        self.assertEqual(points_to_objects(automation_value.get_points()), [
+            {"id": 5, "tick": 1, "value": 0.75},
+            {"id": 4, "tick": 2, "value": 1},
+            {"id": 1, "tick": 2, "value": 0.5},
+            {"id": 2, "tick": 4, "value": 0.5},
+            {"id": 3, "tick": 5, "value": 0.25},
+        ])
+        added_points = automation_value.add_points(ticks=[2, 3, 2], values=[0, 0.5, 0.25], overwrite=True)
+        self.assertEqual([point.id for point in added_points], [7, 8])
+        self.assertEqual(points_to_objects(automation_value.get_points()), [
+            {"id": 5, "tick": 1, "value": 0.75},
+            {"id": 8, "tick": 2, "value": 0.25},
+            {"id": 7, "tick": 3, "value": 0.5},
+            {"id": 2, "tick": 4, "value": 0.5},
+            {"id": 3, "tick": 5, "value": 0.25},
+        ])
+        self.assertEqual(automation_value.add_points(ticks=[], values=[]), [])
+
+    def test_add_points_keeps_existing_points_attached(self):
+        automation_value = AutomationValue()
+        existing_point = automation_value.add_point(tick=4, value=0.5)
+        added_point = automation_value.add_points(ticks=[2], values=[0.25])[0]
+        automation_value.add_points(ticks=[1, 3], values=[0.25, 0.25])
+        existing_point.value = 1
+        added_point.value = 0
+        self.assertEqual([(point.tick, point.value) for point in automation_value.get_points()], [
+            (1, 0.25), (2, 0), (3, 0.25), (4, 1)])
+
+    def test_samples_points(self):
+        automation_value = AutomationValue()
+        self.assertTrue(np.isnan(automation_value.sample(np.array([0, 1]))).all())
+        self.assertEqual(automation_value.sample(np.array([0, 1]), default_value=0.5).tolist(), [0.5, 0.5])
+        automation_value.add_point(tick=100, value=0.25)
+        automation_value.add_point(tick=200, value=0.75)
+        automation_value.add_point(tick=200, value=0.5)
+        automation_value.add_point(tick=300, value=1)
+        self.assertEqual([point.value for point in automation_value.get_points()], [0.25, 0.5, 0.75, 1])
+        np.testing.assert_allclose(
+            automation_value.sample(np.array([0, 100, 150, 199, 200, 250, 300, 400])),
+            [0.25, 0.25, 0.375, 0.4975, 0.75, 0.875, 1, 1])
+        np.testing.assert_allclose(automation_value.sample(np.array([[125.5]])), [[0.31375]])
+        automation_value.set_disabled(True)
+        self.assertEqual(automation_value.sample(np.array([100]), default_value=0.1).tolist(), [0.1])
+
+    def test_samples_points_in_seconds(self):
+        song, track = create_song()
+        song.create_tempo_change(ticks=song.get_resolution() * 4, bpm=60)
+        target = AutomationTarget(AutomationTargetType.VOLUME)
+        track.get_automation().add_automation(target)
+        automation_value = track.get_automation().get_automation_value_by_target(target)
+        automation_value.add_point(tick=0, value=0)
+        automation_value.add_point(tick=song.get_resolution() * 8, value=1)
+        # 4 beats at 120 bpm take 2 seconds and the next 4 beats at 60 bpm take 4 seconds.
+        np.testing.assert_allclose(automation_value.sample_seconds(np.array([0, 1, 2, 4, 6, 7])),
+                                   [0, 0.25, 0.5, 0.75, 1, 1])
+        with self.assertRaises(Exception):
+            AutomationValue().sample_seconds(np.array([0]))
+
     def test_moves_single_point_overwrite(self):
         automation_value = AutomationValue()
         self.assertEqual(points_to_objects(automation_value.get_points()), [])
@@ -724,6 +849,38 @@ class AutomationDataTestCase(unittest.TestCase):
         track.get_automation().get_automation_value_by_target(target1).set_disabled(True)  # type:ignore
         self.assertTrue(track.get_automation().get_automation_value_by_target(target2).get_disabled())  # type:ignore
 
+    def test_renders_envelopes(self):
+        song, track = create_song()
+        song.create_tempo_change(ticks=song.get_resolution() * 4, bpm=60)
+        volume_target = AutomationTarget(AutomationTargetType.VOLUME)
+        plugin_target = AutomationTarget(AutomationTargetType.AUDIO_PLUGIN, 'pluginId1', 'paramId1')
+        disabled_target = AutomationTarget(AutomationTargetType.PAN)
+        automation = track.get_automation()
+        for target in [volume_target, plugin_target, disabled_target]:
+            automation.add_automation(target)
+        volume_value = automation.get_automation_value_by_target(volume_target)
+        volume_value.add_point(tick=0, value=0)
+        volume_value.add_point(tick=song.get_resolution() * 8, value=1)
+        automation.get_automation_value_by_target(plugin_target).add_point(tick=0, value=0.5)
+        automation.get_automation_value_by_target(disabled_target).add_point(tick=0, value=0.5)
+        automation.get_automation_value_by_target(disabled_target).set_disabled(True)
+
+        envelopes = automation.render_envelopes(sample_rate=4, num_samples=32, block_size=4)
+        self.assertEqual(set(envelopes.keys()), {
+            volume_target.to_tf_automation_target_id(), plugin_target.to_tf_automation_target_id()})
+        # 4 beats at 120 bpm take 2 seconds and the next 4 beats at 60 bpm take 4 seconds.
+        np.testing.assert_allclose(envelopes[volume_target.to_tf_automation_target_id()],
+                                   [0, 0.25, 0.5, 0.625, 0.75, 0.875, 1, 1])
+        np.testing.assert_allclose(envelopes[plugin_target.to_tf_automation_target_id()], [0.5] * 8)
+        envelopes = automation.render_envelopes(sample_rate=4, num_samples=3, start_seconds=1)
+        np.testing.assert_allclose(envelopes[volume_target.to_tf_automation_target_id()], [0.25, 0.3125, 0.375])
+
+        song.create_track(type=TrackType.MIDI_TRACK)
+        envelopes_by_track_id = song.render_automation_envelopes(sample_rate=4, num_samples=32, block_size=4)
+        self.assertEqual(list(envelopes_by_track_id.keys()), [track.get_id()])
+        np.testing.assert_allclose(envelopes_by_track_id[track.get_id()][volume_target.to_tf_automation_target_id()],
+                                   [0, 0.25, 0.5, 0.625, 0.75, 0.875, 1, 1])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,113 @@
+from tuneflow_py import Song, TrackType, TuneflowPlugin
+from tuneflow_py.batch_runner import main, run_plugin_on_directory
+from pathlib import Path
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+
+class CountNotes(TuneflowPlugin):
+    @staticmethod
+    def params(song: Song):
+        return {
+            'pitch': {
+                'displayName': {'en': 'Pitch', 'zh': '音高'},
+                'defaultValue': 60,
+                'widget': {'type': 'Pitch'},
+            },
+        }
+
+    @staticmethod
+    def run(song: Song, params):
+        if song.get_track_count() == 0:
+            raise Exception('The song has no tracks.')
+        if params['pitch'] < 0:
+            time.sleep(10)
+        clip = song.get_track_at(0).get_clip_at(0)
+        clip.create_note(pitch=params['pitch'], velocity=100, start_tick=0, end_tick=480)
+        return clip.get_raw_note_count()
+
+
+class HangOnEmptySongs(CountNotes):
+    @staticmethod
+    def run(song: Song, params):
+        if song.get_track_count() == 0:
+            # Backtracks within the regex engine for hours without returning to Python bytecode.
+            re.match(r'(a+)+$', 'a' * 64 + 'b')
+        return CountNotes.run(song, params)
+
+
+class TestBatchRunner(unittest.TestCase):
+    def _save_songs(self, directory: str):
+        for index in range(3):
+            song = Song()
+            track = song.create_track(type=TrackType.MIDI_TRACK)
+            clip = track.create_midi_clip(clip_start_tick=0, clip_end_tick=1920)
+            for _ in range(index):
+                clip.create_note(pitch=72, velocity=100, start_tick=0, end_tick=480)
+            song.save(str(Path(directory) / f'song{index}.tfsong'))
+        Song().save(str(Path(directory) / 'empty.tfsong'))
+
+    def test_run_plugin_on_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._save_songs(directory)
+            output_directory = str(Path(directory) / 'out')
+            results = run_plugin_on_directory(
+                CountNotes, directory, output_directory=output_directory, max_workers=2)
+            self.assertEqual([Path(result['path']).name for result in results],
+                             ['empty.tfsong', 'song0.tfsong', 'song1.tfsong', 'song2.tfsong'])
+            self.assertIn('The song has no tracks.', results[0]['error'])  # type: ignore
+            self.assertNotIn('output_path', results[0])
+            self.assertEqual([result['result'] for result in results[1:]], [1, 2, 3])  # type: ignore
+            song = Song.load(results[1]['output_path'])  # type: ignore
+            self.assertEqual(song.get_track_at(0).get_clip_at(0).get_raw_note_at(0).get_pitch(), 60)
+
+    def test_params_and_timeout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._save_songs(directory)
+            results = run_plugin_on_directory(CountNotes, directory, params={'pitch': 50}, pattern='song0.*')
+            self.assertEqual(results[0]['result'], 1)  # type: ignore
+            results = run_plugin_on_directory(CountNotes, directory, params={'pitch': -1}, pattern='song0.*',
+                                              timeout=0.5)
+            self.assertIn('TimeoutError', results[0]['error'])  # type: ignore
+            self.assertLess(results[0]['duration'], 5)
+
+    def test_terminates_songs_that_time_out(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._save_songs(directory)
+            start_time = time.perf_counter()
+            results = run_plugin_on_directory(HangOnEmptySongs, directory, max_workers=2, timeout=1)
+            self.assertLess(time.perf_counter() - start_time, 10)
+            self.assertIn('TimeoutError', results[0]['error'])  # type: ignore
+            self.assertEqual([result['result'] for result in results[1:]], [1, 2, 3])  # type: ignore
+
+    def test_is_not_imported_with_the_package(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, tuneflow_py; print("tuneflow_py.batch_runner" in sys.modules)'],
+            env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}, text=True)
+        self.assertEqual(output.strip(), 'False')
+
+    def test_base64_songs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            song = Song()
+            song.create_track(type=TrackType.MIDI_TRACK).create_midi_clip(clip_start_tick=0, clip_end_tick=1920)
+            (Path(directory) / 'song.txt').write_text(song.serialize(), encoding='ascii')
+            output_directory = str(Path(directory) / 'out')
+            results = run_plugin_on_directory(
+                CountNotes, directory, output_directory=output_directory, pattern='*.txt', song_format='base64')
+            self.assertEqual(results[0]['result'], 1)  # type: ignore
+            song = Song.deserialize(Path(results[0]['output_path']).read_text(encoding='ascii'))  # type: ignore
+            self.assertEqual(song.get_track_at(0).get_clip_at(0).get_raw_note_at(0).get_pitch(), 60)
+            with self.assertRaises(Exception):
+                run_plugin_on_directory(CountNotes, directory, song_format='base64', compression='zlib')
+
+    def test_command_line(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self._save_songs(directory)
+            self.assertEqual(main([f'{__name__}:CountNotes', directory, '--pattern', 'song*', '--workers', '1',
+                                   '--params', '{"pitch": 62}', '--compression', 'zlib']), 0)
+            self.assertEqual(main([f'{__name__}:CountNotes', directory, '--workers', '1']), 1)
@@ -428,6 +428,19 @@ class TestLyricWord(unittest.TestCase):
             "end_tick": 2,
         }, lyrics[0])
 
+    def test_move_words_in_batch(self):
+        lyrics = create_lyrics()
+        line = lyrics[0]
+        with lyrics.song.batch():
+            line[0].move_to(700, 720)
+            line[0].move_to(5, 8)
+            self.assertEqual(len(lyrics.song._pending_sorts), 2)
+            self.assertEqual(line.get_start_tick(), 5)
+            self.assertEqual(lyrics[4].get_start_tick(), 600)
+        self.assertEqual(len(lyrics.song._pending_sorts), 0)
+        self.assertEqual([word.get_word() for word in line.get_words()],
+                         [" ", "world", " ", "this", " ", "is", " ", "a", " ", "test", ".", "Hello"])
+
 
 if __name__ == '__main__':
     unittest.main()
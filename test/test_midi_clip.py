@@ -1,5 +1,6 @@
 from tuneflow_py import Song, Clip, TrackType, Note
 from typing import List
+import numpy as np
 import unittest
 
 
@@ -75,6 +76,71 @@ class TestBasicOperations(BaseTestCase):
         self.assertEqual(clip1.get_clip_start_tick(), 0)
         self.assertEqual(clip1.get_clip_end_tick(), 15)
 
+    def test_get_clip_by_id(self):
+        track = self.song.get_track_at(0)
+        clip1 = track.get_clip_at(0)
+        clip3 = track.get_clip_at(2)
+        self.assertEqual(track.get_clip_by_id(clip3.get_id()).get_clip_start_tick(), 40)  # type:ignore
+        self.assertEqual(track.get_clip_index(clip3), 2)
+        self.assertIsNone(track.get_clip_by_id('not-a-clip'))
+        clip3.move_clip(-40, move_associated_track_automation_points=False)
+        self.assertEqual(track.get_clip_index(clip3), 0)
+        self.assertEqual(track.get_clip_by_id(clip3.get_id()).get_clip_start_tick(), 0)  # type:ignore
+        clip1.delete_from_parent(delete_associated_track_automation=False)
+        self.assertIsNone(track.get_clip_by_id(clip1.get_id()))
+        self.assertEqual(track.get_clip_index(clip1), -1)
+
+    def test_get_note_by_id(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note = clip1.get_note_by_id(2)
+        self.assertIsNotNone(note)
+        self.assertEqual(note.get_pitch(), 66)  # type:ignore
+        self.assertEqual(note.get_start_tick(), 15)  # type:ignore
+        self.assertIsNone(clip1.get_note_by_id(4))
+        note.move_note(-15)  # type:ignore
+        self.assertEqual(clip1.get_raw_note_at(0).get_id(), 2)
+        self.assertEqual(clip1.get_note_by_id(2).get_start_tick(), 0)  # type:ignore
+        clip1.get_note_by_id(1).delete_from_parent()  # type:ignore
+        self.assertIsNone(clip1.get_note_by_id(1))
+        self.assertEqual(clip1.get_note_by_id(3).get_pitch(), 68)  # type:ignore
+
+    def test_get_note_by_id_in_cloned_track(self):
+        track = self.song.get_track_at(0)
+        cloned_track = self.song.clone_track(track)
+        clip1 = track.get_clip_at(0)
+        cloned_clip1 = cloned_track.get_clip_at(0)
+        self.assertEqual(cloned_clip1.get_id(), clip1.get_id())
+        cloned_clip1.get_note_by_id(2).move_note(-15)  # type:ignore
+        self.assertEqual(clip1.get_note_by_id(2).get_start_tick(), 15)  # type:ignore
+        self.assertEqual(cloned_clip1.get_note_by_id(2).get_start_tick(), 0)  # type:ignore
+        # Each clip has its own index even though the clips share the same id.
+        self.assertEqual(self.song._note_index_by_clip_key[(track.get_id(), clip1.get_id())][2], 2)
+        self.assertEqual(self.song._note_index_by_clip_key[(cloned_track.get_id(), clip1.get_id())][2], 0)
+
+    def test_note_times_of_clip_outside_track(self):
+        clip = self.song.get_track_at(0).clone_clip(self.song.get_track_at(0).get_clip_at(2))
+        note = clip.get_raw_note_at(0)
+        self.assertAlmostEqual(note.get_start_time(), self.song.tick_to_seconds(40))
+        # The times are only calculated once as long as the notes do not change.
+        clip._proto.notes[0].start_time = 0
+        self.assertEqual(note.get_start_time(), 0)
+        note.move_note(10)
+        self.assertAlmostEqual(note.get_start_time(), self.song.tick_to_seconds(50))
+
+    def test_delete_chord_notes_by_id(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        chord_notes = clip1.create_notes(
+            pitches=list(range(40, 60)),
+            velocities=[80] * 20,
+            start_ticks=[5] * 20,
+            end_ticks=[10] * 20,
+        )
+        for note in chord_notes[::2]:
+            clip1.get_note_by_id(note.get_id()).delete_from_parent()  # type:ignore
+        self.assertEqual(clip1.get_raw_note_count(), 13)
+        for note in chord_notes:
+            self.assertEqual(clip1.get_note_by_id(note.get_id()) is None, note.get_pitch() % 2 == 0)
+
     def test_get_notes_within_clip_range(self):
         track = self.song.get_track_at(0)
         self.assertEqual(track.get_clip_count(), 3)
@@ -529,6 +595,206 @@ class TestCreateNotes(BaseTestCase):
         self.assertEqual(created_note1.get_pitch(), 1)  # type:ignore
 
 
+class TestNoteArray(BaseTestCase):
+    def test_get_note_array(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note_array = clip1.get_note_array()
+        self.assertEqual(note_array.dtype, Clip.NOTE_ARRAY_DTYPE)
+        self.assertEqual(note_array['id'].tolist(), [1, 3])
+        self.assertEqual(note_array['pitch'].tolist(), [64, 68])
+        self.assertEqual(note_array['velocity'].tolist(), [80, 80])
+        self.assertEqual(note_array['start_tick'].tolist(), [0, 14])
+        self.assertEqual(note_array['end_tick'].tolist(), [10, 20])
+
+    def test_get_raw_note_array(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note_array = clip1.get_raw_note_array()
+        self.assertEqual(note_array['id'].tolist(), [1, 3, 2])
+        self.assertEqual(note_array['start_tick'].tolist(), [0, 14, 15])
+
+    def test_get_note_array_of_empty_clip(self):
+        clip = self.song.get_track_at(0).create_midi_clip(clip_start_tick=100, clip_end_tick=200)
+        self.assertEqual(len(clip.get_note_array()), 0)
+
+    def test_set_notes_from_array(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note_array = clip1.get_raw_note_array()
+        note_array['velocity'] = 100
+        note_array['start_tick'][0] = 16
+        note_array['end_tick'][0] = 18
+        clip1.set_notes_from_array(note_array)
+        self.assert_clip_range(clip1, 0, 15)
+        assert_notes_are_equal(
+            list(clip1.get_raw_notes()),
+            create_test_notes(
+                [
+                    {"pitch": 68, "velocity": 100, "start_tick": 14, "end_tick": 20, "id": 3},
+                    {"pitch": 66, "velocity": 100, "start_tick": 15, "end_tick": 20, "id": 2},
+                    {"pitch": 64, "velocity": 100, "start_tick": 16, "end_tick": 18, "id": 1},
+                ],
+                clip1,
+            ),
+        )
+
+    def test_set_notes_from_array_assigns_ids_and_skips_invalid_notes(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note_array = np.array([
+            (0, 60, 80, 5, 8),
+            (2, 128, 80, 1, 2),
+            (7, 62, 80, 3, 4),
+            (7, 64, 80, 1, 2),
+            (-1, 65, 80, 9, 2),
+        ], dtype=Clip.NOTE_ARRAY_DTYPE)
+        clip1.set_notes_from_array(note_array)
+        assert_notes_are_equal(
+            list(clip1.get_raw_notes()),
+            create_test_notes(
+                [
+                    {"pitch": 64, "velocity": 80, "start_tick": 1, "end_tick": 2, "id": 7},
+                    {"pitch": 62, "velocity": 80, "start_tick": 3, "end_tick": 4, "id": 8},
+                    {"pitch": 60, "velocity": 80, "start_tick": 5, "end_tick": 8, "id": 9},
+                ],
+                clip1,
+            ),
+        )
+        created_note = clip1.create_note(pitch=70, velocity=80, start_tick=6, end_tick=7)
+        self.assertEqual(created_note.get_id(), 10)
+
+
+class TestCreateNotesInBatch(BaseTestCase):
+    def test_create_notes(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        created_notes = clip1.create_notes(
+            pitches=[70, 71, 128, 72],
+            velocities=[80, 90, 80, 100],
+            start_ticks=[14, 2, 3, 14],
+            end_ticks=[15, 4, 5, 15],
+        )
+        self.assertEqual([note.get_id() for note in created_notes], [4, 5, 6])
+        self.assertEqual([note.get_pitch() for note in created_notes], [70, 71, 72])
+        self.assert_clip_range(clip1, 0, 15)
+        assert_notes_are_equal(
+            list(clip1.get_raw_notes()),
+            create_test_notes(
+                [
+                    {"pitch": 64, "velocity": 80, "start_tick": 0, "end_tick": 10, "id": 1},
+                    {"pitch": 71, "velocity": 90, "start_tick": 2, "end_tick": 4, "id": 5},
+                    {"pitch": 72, "velocity": 100, "start_tick": 14, "end_tick": 15, "id": 6},
+                    {"pitch": 70, "velocity": 80, "start_tick": 14, "end_tick": 15, "id": 4},
+                    {"pitch": 68, "velocity": 80, "start_tick": 14, "end_tick": 20, "id": 3},
+                    {"pitch": 66, "velocity": 80, "start_tick": 15, "end_tick": 20, "id": 2},
+                ],
+                clip1,
+            ),
+        )
+
+    def test_create_notes_updates_clip_range_once(self):
+        track = self.song.get_track_at(0)
+        clip1 = track.get_clip_at(0)
+        clip1.create_notes(
+            pitches=[70, 71],
+            velocities=[80, 80],
+            start_ticks=[12, 16],
+            end_ticks=[18, 24],
+        )
+        self.assert_clip_range(clip1, 0, 24)
+        # Clip2 is trimmed to resolve the conflict.
+        self.assertEqual(track.get_clip_count(), 3)
+        self.assert_clip_range(track.get_clip_at(1), 25, 30)
+
+    def test_create_notes_without_updating_clip_range(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        created_notes = clip1.create_notes(
+            pitches=[70],
+            velocities=[80],
+            start_ticks=[12],
+            end_ticks=[18],
+            update_clip_range=False,
+        )
+        self.assertEqual(len(created_notes), 1)
+        self.assert_clip_range(clip1, 0, 15)
+        self.assertEqual(clip1.get_raw_note_count(), 4)
+
+    def test_create_notes_matches_creating_notes_one_by_one(self):
+        song = create_song()
+        clip1 = self.song.get_track_at(0).get_clip_at(2)
+        clip2 = song.get_track_at(0).get_clip_at(2)
+        pitches = [60, 62, 64, 60, 62]
+        start_ticks = [50, 41, 55, 45, 50]
+        end_ticks = [60, 70, 56, 47, 51]
+        clip1.create_notes(pitches, [80] * 5, start_ticks, end_ticks)
+        for pitch, start_tick, end_tick in zip(pitches, start_ticks, end_ticks):
+            clip2.create_note(pitch=pitch, velocity=80, start_tick=start_tick, end_tick=end_tick)
+        assert_notes_are_equal(list(clip1.get_raw_notes()), list(clip2.get_raw_notes()))
+        self.assert_clip_range(clip1, clip2.get_clip_start_tick(), clip2.get_clip_end_tick())
+
+    def test_create_notes_keeps_existing_notes_attached(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        existing_note = clip1.create_note(pitch=50, velocity=80, start_tick=12, end_tick=13)
+        clip1.create_notes(pitches=[70, 71], velocities=[80, 80], start_ticks=[5, 15], end_ticks=[6, 16])
+        existing_note.set_pitch(51)  # type:ignore
+        self.assertEqual(clip1.get_note_by_id(existing_note.get_id()).get_pitch(), 51)  # type:ignore
+        self.assertEqual([note.get_start_tick() for note in clip1.get_raw_notes()], [0, 5, 12, 14, 15, 15])
+
+    def test_create_notes_rejects_non_integer_values(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        with self.assertRaises(Exception):
+            clip1.create_notes(pitches=[60.5], velocities=[80], start_ticks=[0], end_ticks=[10])
+        self.assertEqual(clip1.get_raw_note_count(), 3)
+
+
+class TestDeleteNotesInBatch(BaseTestCase):
+    def test_delete_notes(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        clip1.create_notes(
+            pitches=[70, 71, 72],
+            velocities=[80, 80, 80],
+            start_ticks=[1, 2, 3],
+            end_ticks=[4, 5, 6],
+        )
+        self.assertEqual(clip1.delete_notes([1, 5, 2, 100]), 3)
+        assert_notes_are_equal(
+            list(clip1.get_raw_notes()),
+            create_test_notes(
+                [
+                    {"pitch": 70, "velocity": 80, "start_tick": 1, "end_tick": 4, "id": 4},
+                    {"pitch": 72, "velocity": 80, "start_tick": 3, "end_tick": 6, "id": 6},
+                    {"pitch": 68, "velocity": 80, "start_tick": 14, "end_tick": 20, "id": 3},
+                ],
+                clip1,
+            ),
+        )
+        self.assertEqual(clip1.delete_notes([]), 0)
+        self.assertEqual(clip1.get_raw_note_count(), 3)
+
+    def test_delete_notes_keeps_other_notes_attached(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note1 = clip1.get_note_by_id(1)
+        note2 = clip1.get_note_by_id(2)
+        self.assertEqual(clip1.delete_notes([note1.get_id()]), 1)  # type:ignore
+        note2.set_pitch(70)  # type:ignore
+        self.assertEqual(clip1.get_note_by_id(2).get_pitch(), 70)  # type:ignore
+
+    def test_filter_notes_with_predicate(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        self.assertEqual(clip1.filter_notes(lambda note: note.get_pitch() >= 66), 1)
+        self.assertEqual([note.get_id() for note in clip1.get_raw_notes()], [3, 2])
+
+    def test_filter_notes_with_mask(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        note_array = clip1.get_raw_note_array()
+        self.assertEqual(clip1.filter_notes(note_array['start_tick'] >= 14), 1)
+        self.assertEqual([note.get_id() for note in clip1.get_raw_notes()], [3, 2])
+        self.assertEqual(clip1.filter_notes(np.zeros(2, dtype=bool)), 2)
+        self.assertEqual(clip1.get_raw_note_count(), 0)
+
+    def test_filter_notes_rejects_mask_of_wrong_length(self):
+        clip1 = self.song.get_track_at(0).get_clip_at(0)
+        with self.assertRaises(Exception):
+            clip1.filter_notes([True])
+        self.assertEqual(clip1.get_raw_note_count(), 3)
+
+
 class TestMoveClips(BaseTestCase):
     def test_move_clips_no_overlapping(self):
         track = self.song.get_track_at(0)
@@ -627,6 +893,41 @@ class TestMoveClips(BaseTestCase):
         pass
 
 
+class TestGetClipsOverlappingWith(BaseTestCase):
+    def get_overlapping_clip_ranges(self, start_tick: int, end_tick: int):
+        track = self.song.get_track_at(0)
+        return [(clip.get_clip_start_tick(), clip.get_clip_end_tick())
+                for clip in track.get_clips_overlapping_with(start_tick, end_tick)]
+
+    def test_get_clips_overlapping_with(self):
+        self.assertEqual(self.get_overlapping_clip_ranges(16, 20), [])
+        self.assertEqual(self.get_overlapping_clip_ranges(15, 21), [(0, 15), (21, 30)])
+        self.assertEqual(self.get_overlapping_clip_ranges(22, 23), [(21, 30)])
+        self.assertEqual(self.get_overlapping_clip_ranges(0, 100), [(0, 15), (21, 30), (40, 65)])
+        self.assertEqual(self.get_overlapping_clip_ranges(66, 100), [])
+
+    def test_get_clips_overlapping_with_after_clip_changes(self):
+        track = self.song.get_track_at(0)
+        self.assertEqual(self.get_overlapping_clip_ranges(35, 45), [(40, 65)])
+        track.get_clip_at(1).adjust_clip_right(38)
+        self.assertEqual(self.get_overlapping_clip_ranges(35, 45), [(21, 38), (40, 65)])
+        track.get_clip_at(2).move_clip(-30, move_associated_track_automation_points=False)
+        self.assertEqual(self.get_overlapping_clip_ranges(35, 45), [(10, 35), (36, 38)])
+        self.assertEqual(self.get_overlapping_clip_ranges(0, 9), [(0, 9)])
+        track.create_midi_clip(clip_start_tick=36, clip_end_tick=37)
+        self.assertEqual(self.get_overlapping_clip_ranges(36, 45), [(36, 37), (38, 38)])
+        track.get_clip_at(0).delete_from_parent(delete_associated_track_automation=False)
+        self.assertEqual(self.get_overlapping_clip_ranges(0, 10), [(10, 35)])
+
+    def test_get_clips_overlapping_with_overlapping_clips(self):
+        track = self.song.get_track_at(0)
+        # Extend the first clip over the other clips without resolving conflicts.
+        track.get_clip_at(0).adjust_clip_right(50, resolve_conflict=False)
+        self.assertEqual(self.get_overlapping_clip_ranges(45, 46), [(0, 50), (40, 65)])
+        self.assertEqual(self.get_overlapping_clip_ranges(31, 35), [(0, 50)])
+        self.assertEqual(self.get_overlapping_clip_ranges(51, 52), [(40, 65)])
+
+
 class TestAdjustClipRanges(BaseTestCase):
     def test_adjust_clip_left_no_overlapping(self):
         track = self.song.get_track_at(0)
@@ -120,6 +120,45 @@ class TestBasicOperations(BaseTestCase):
             ),
         )
 
+    def test_get_time(self):
+        song = self.song
+        clip1 = song.get_track_at(0).get_clip_at(0)
+        clip1.create_note(pitch=60, velocity=80, start_tick=1920, end_tick=2400)
+        note = clip1.get_note_by_id(4)
+        self.assertAlmostEqual(note.get_start_time(), 2.5)  # type:ignore
+        self.assertAlmostEqual(note.get_end_time(), 3.5)  # type:ignore
+        # Times follow tempo changes.
+        song.create_tempo_change(ticks=480, bpm=240)
+        self.assertAlmostEqual(note.get_start_time(), 2)  # type:ignore
+        song.move_tempo(1, 960)
+        self.assertAlmostEqual(note.get_start_time(), 2.25)  # type:ignore
+        with song.batch():
+            song.remove_tempo_change_at(1)
+            self.assertAlmostEqual(note.get_start_time(), 2.5)  # type:ignore
+        # Times follow note changes.
+        note.move_note(480)  # type:ignore
+        self.assertAlmostEqual(note.get_start_time(), 3.5)  # type:ignore
+        note.adjust_right(480)  # type:ignore
+        self.assertAlmostEqual(note.get_end_time(), 5.5)  # type:ignore
+        note.set_start_tick(0)  # type:ignore
+        self.assertAlmostEqual(note.get_start_time(), 0)  # type:ignore
+        self.assertAlmostEqual(clip1.get_raw_note_at(0).get_end_time(), 10 / 960)
+        # Cloned tracks keep their own times.
+        cloned_clip = song.clone_track(song.get_track_at(0)).get_clip_at(0)
+        cloned_clip.get_raw_note_at(0).set_end_tick(960)
+        self.assertAlmostEqual(cloned_clip.get_raw_note_at(0).get_end_time(), 1)
+        self.assertAlmostEqual(clip1.get_raw_note_at(0).get_end_time(), 10 / 960)
+
+    def test_serialize_updates_times(self):
+        song = self.song
+        song.set_tempo_curve([0], [60])
+        clip1 = song.get_track_at(0).get_clip_at(0)
+        clip1.create_note(pitch=60, velocity=80, start_tick=480, end_tick=960)
+        deserialized_song = Song.deserialize(song.serialize())
+        note = deserialized_song.get_track_at(0).get_clip_at(0).get_raw_note_at(3)
+        self.assertAlmostEqual(note._proto.start_time, 1)
+        self.assertAlmostEqual(note._proto.end_time, 2)
+
 
 class TestAdjustPitch(BaseTestCase):
     def test_reject_if_setting_invalid_pitches(self):
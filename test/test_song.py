@@ -1,6 +1,12 @@
-from tuneflow_py import Song, TrackType, TrackOutputType
+from tuneflow_py import Song, TrackType, TrackOutputType, TempoEvent, StructureType, AutomationTarget, \
+    AutomationTargetType
+from miditoolkit.midi.containers import ControlChange, Instrument, Note as ToolkitNote, TempoChange, TimeSignature
 from miditoolkit.midi import MidiFile
 from pathlib import PurePath, Path
+import io
+import math
+import tempfile
+import numpy as np
 import unittest
 import pytest
 
@@ -63,9 +69,76 @@ class TestImportExportMIDI(unittest.TestCase):
         self.assertEqual(first_note.get_velocity(), 115)
         self.assertEqual(first_note.get_start_time(), 47.659584045410156)
         self.assertAlmostEqual(first_note.get_end_time(), 47.94282913208008)
+        for track in song.get_tracks():
+            clip = track.get_clip_at(0)
+            start_ticks = [note.get_start_tick() for note in clip.get_raw_notes()]
+            self.assertEqual(start_ticks, sorted(start_ticks))
+            self.assertEqual(
+                sorted([note.get_id() for note in clip.get_raw_notes()]),
+                list(range(1, clip.get_raw_note_count() + 1)))
         self.assertEqual(song.last_tick, 1327199)
         self.assertAlmostEqual(song.duration, 595.0945734687816)
 
+    def test_import_midi_automation(self):
+        midi_obj = MidiFile()
+        midi_obj.ticks_per_beat = Song.get_default_resolution()
+        midi_obj.tempo_changes.append(TempoChange(tempo=120, time=0))
+        midi_obj.time_signature_changes.append(TimeSignature(numerator=4, denominator=4, time=0))
+        instrument = Instrument(program=0)
+        instrument.notes.append(ToolkitNote(velocity=100, pitch=60, start=0, end=1920))
+        # A volume fade-in recorded as one CC per 10 ticks, and a pan jump.
+        instrument.control_changes.extend(
+            [ControlChange(number=7, value=round(tick / 1920 * 127), time=tick) for tick in range(0, 1930, 10)])
+        instrument.control_changes.extend([ControlChange(number=10, value=value, time=time)
+                                           for value, time in [(0, 0), (0, 960), (127, 960), (127, 1920)]])
+        midi_obj.instruments.append(instrument)
+
+        song = Song.from_midi(midi_obj)
+        automation = song.get_track_at(0).get_automation()
+        volume_value = automation.get_automation_value_by_target(AutomationTarget(AutomationTargetType.VOLUME))
+        self.assertEqual(len(volume_value.get_points()), 193)  # type:ignore
+        pan_value = automation.get_automation_value_by_target(AutomationTarget(AutomationTargetType.PAN))
+        self.assertEqual(len(pan_value.get_points()), 4)  # type:ignore
+
+        song = Song.from_midi(midi_obj, automation_tolerance=1 / 127)
+        automation = song.get_track_at(0).get_automation()
+        volume_value = automation.get_automation_value_by_target(AutomationTarget(AutomationTargetType.VOLUME))
+        self.assertEqual([(point.tick, point.value) for point in volume_value.get_points()], [(0, 0), (1920, 1)])  # type:ignore
+        pan_value = automation.get_automation_value_by_target(AutomationTarget(AutomationTargetType.PAN))
+        self.assertEqual([point.tick for point in pan_value.get_points()], [0, 960, 960, 1920])  # type:ignore
+
+    def test_import_midi_automation_reduces_points_and_size(self):
+        midi_obj = MidiFile()
+        midi_obj.ticks_per_beat = Song.get_default_resolution()
+        midi_obj.tempo_changes.append(TempoChange(tempo=120, time=0))
+        midi_obj.time_signature_changes.append(TimeSignature(numerator=4, denominator=4, time=0))
+        instrument = Instrument(program=0)
+        instrument.notes.append(ToolkitNote(velocity=100, pitch=60, start=0, end=1920))
+        # 32 bars of a dense CC recording, one message per 8 ticks: volume fades of one bar
+        # and a pan sweep following a sine over 8 bars.
+        ticks = range(0, 32 * 1920, 8)
+        instrument.control_changes.extend(
+            [ControlChange(number=7, value=round(abs(tick % 3840 - 1920) / 1920 * 127), time=tick) for tick in ticks])
+        instrument.control_changes.extend(
+            [ControlChange(number=10, value=round((math.sin(tick / 15360 * 2 * math.pi) + 1) / 2 * 127), time=tick)
+             for tick in ticks])
+        midi_obj.instruments.append(instrument)
+        tolerance = 1 / 127
+
+        song = Song.from_midi(midi_obj)
+        simplified_song = Song.from_midi(midi_obj, automation_tolerance=tolerance)
+        self.assertLess(len(simplified_song.serialize_to_bytestring()), len(song.serialize_to_bytestring()) / 10)
+        all_ticks = np.arange(32 * 1920)
+        for target_type in [AutomationTargetType.VOLUME, AutomationTargetType.PAN]:
+            target = AutomationTarget(target_type)
+            value = song.get_track_at(0).get_automation().get_automation_value_by_target(target)
+            simplified_value = simplified_song.get_track_at(0).get_automation().get_automation_value_by_target(target)
+            self.assertEqual(len(value.get_points()), len(ticks))  # type:ignore
+            self.assertLess(len(simplified_value.get_points()), len(ticks) / 10)  # type:ignore
+            self.assertLessEqual(
+                np.abs(simplified_value.sample(all_ticks) - value.sample(all_ticks)).max(),  # type:ignore
+                tolerance + 1e-9)
+
     def test_export_midi(self):
         golden_midi_path = PurePath(
             Path(__file__).parent, Path('caravan.test.golden.mid'))
@@ -107,8 +180,10 @@ class TestImportExportMIDI(unittest.TestCase):
             self.assertEqual(expected_track.is_drum, actual_track.is_drum)
             self.assertEqual(len(expected_track.notes),
                              len(actual_track.notes))
-            for j in range(len(expected_track.notes)):
-                expected_note = expected_track.notes[j]
+            # Notes are sorted by start tick when imported.
+            expected_notes = sorted(expected_track.notes, key=lambda note: note.start)
+            for j in range(len(expected_notes)):
+                expected_note = expected_notes[j]
                 actual_note = actual_track.notes[j]
                 self.assertEqual(expected_note.start, actual_note.start)
                 self.assertEqual(expected_note.end, actual_note.end)
@@ -116,6 +191,214 @@ class TestImportExportMIDI(unittest.TestCase):
                 self.assertEqual(expected_note.pitch, actual_note.pitch)
             # TODO: Test track automation.
 
+    def test_write_midi(self):
+        midi_obj = MidiFile(filename=PurePath(
+            Path(__file__).parent, Path('caravan.test.golden.mid')))
+        song = Song.from_midi(midi_obj=midi_obj)
+        expected_file = io.BytesIO()
+        song.to_midi().dump(file=expected_file)
+        actual_file = io.BytesIO()
+        song.write_midi(file=actual_file)
+        self.assertEqual(actual_file.getvalue(), expected_file.getvalue())
+
+    def test_export_midi_only_exports_notes_in_clip_range(self):
+        song = Song()
+        track = song.create_track(type=TrackType.MIDI_TRACK)
+        clip = track.create_midi_clip(clip_start_tick=0, clip_end_tick=960)
+        clip.create_note(pitch=60, velocity=100, start_tick=0, end_tick=480, update_clip_range=False)
+        clip.create_note(pitch=62, velocity=100, start_tick=480, end_tick=1200, update_clip_range=False)
+        clip.create_note(pitch=64, velocity=100, start_tick=720, end_tick=960, update_clip_range=False)
+        clip.create_note(pitch=65, velocity=100, start_tick=960, end_tick=1440, update_clip_range=False)
+        clip.adjust_clip_left(240)
+        exported_midi = song.to_midi()
+        self.assertEqual(len(exported_midi.instruments), 1)
+        self.assertEqual([note.pitch for note in exported_midi.instruments[0].notes], [62, 64])
+        expected_file = io.BytesIO()
+        exported_midi.dump(file=expected_file)
+        actual_file = io.BytesIO()
+        song.write_midi(file=actual_file)
+        self.assertEqual(actual_file.getvalue(), expected_file.getvalue())
+
+
+class TestSerialization(BaseTest):
+    def test_frames_round_trip_through_stream(self):
+        track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        track.create_midi_clip(clip_start_tick=0).create_note(pitch=60, velocity=100, start_tick=0, end_tick=480)
+        other_song = Song()
+        stream = io.BytesIO()
+        self.song.write_frame(stream)
+        other_song.write_frame(stream)
+        stream.seek(0)
+        self.assertEqual(Song.read_frame(stream).serialize_to_bytestring(),  # type:ignore
+                         self.song.serialize_to_bytestring())
+        self.assertEqual(Song.read_frame(stream).serialize_to_bytestring(),  # type:ignore
+                         other_song.serialize_to_bytestring())
+        self.assertIsNone(Song.read_frame(stream))
+
+    def test_frames_from_buffer(self):
+        stream = io.BytesIO()
+        self.song.write_frame(stream)
+        Song().write_frame(stream)
+        buffer = memoryview(stream.getvalue())
+        song, offset = Song.deserialize_from_frame(buffer)
+        self.assertEqual(song.serialize_to_bytestring(), self.song.serialize_to_bytestring())
+        song, offset = Song.deserialize_from_frame(buffer, offset)
+        self.assertEqual(song.get_tempo_event_count(), 1)
+        self.assertEqual(offset, len(buffer))
+
+    def test_rejects_invalid_frames(self):
+        stream = io.BytesIO()
+        self.song.write_frame(stream)
+        data = stream.getvalue()
+        with pytest.raises(Exception):
+            Song.read_frame(io.BytesIO(data[:-1]))
+        with pytest.raises(Exception):
+            Song.deserialize_from_frame(data[:-1])
+        with pytest.raises(Exception):
+            Song.deserialize_from_frame(b'XXXX' + data[4:])
+
+    def test_lazy_deserialization(self):
+        for _ in range(3):
+            track = self.song.create_track(type=TrackType.MIDI_TRACK)
+            clip = track.create_midi_clip(clip_start_tick=0, clip_end_tick=1920)
+            clip.create_note(pitch=60, velocity=100, start_tick=0, end_tick=480)
+        serialized_song = self.song.serialize_to_bytestring()
+        song = Song.deserialize_from_bytestring(serialized_song, lazy=True)
+        self.assertEqual(len(song._unloaded_track_content_by_id), song.get_track_count())
+        self.assertEqual(song._proto.tracks[1].volume, self.song._proto.tracks[1].volume)
+        self.assertEqual(len(song._proto.tracks[1].clips), 0)
+
+        track = song.get_track_at(1)
+        self.assertEqual(track.get_clip_at(0).get_raw_note_count(), 1)
+        track.get_clip_at(0).create_note(pitch=72, velocity=100, start_tick=480, end_tick=960)
+        song.remove_track(song.get_track_at(0).get_id())
+        self.assertEqual(len(song._unloaded_track_content_by_id), song.get_track_count() - 1)
+
+        self.song.get_track_at(1).get_clip_at(0).create_note(pitch=72, velocity=100, start_tick=480, end_tick=960)
+        self.song.remove_track(self.song.get_track_at(0).get_id())
+        self.assertEqual(Song.deserialize_from_bytestring(song.serialize_to_bytestring())._proto,
+                         Song.deserialize_from_bytestring(self.song.serialize_to_bytestring())._proto)
+
+    def test_lazy_deserialization_after_tempo_changes(self):
+        track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        clip = track.create_midi_clip(clip_start_tick=0, clip_end_tick=1920)
+        note = clip.create_note(pitch=60, velocity=100, start_tick=960, end_tick=1440)
+        song = Song.deserialize_from_bytestring(self.song.serialize_to_bytestring(), lazy=True)
+        song.create_tempo_change(ticks=480, bpm=60)
+        song = Song.deserialize_from_bytestring(song.serialize_to_bytestring())
+        self.song.create_tempo_change(ticks=480, bpm=60)
+        self.assertAlmostEqual(song.get_track_by_id(track.get_id()).get_clip_at(0).get_raw_note_at(0).get_start_time(),
+                               note.get_start_time())
+        self.assertEqual(song._proto.tracks[-1].clips[0].notes[0].start_time,
+                         self.song._proto.tracks[-1].clips[0].notes[0].start_time)
+
+    def test_keeps_deserialized_note_times(self):
+        track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        for clip_start_tick in [0, 1920]:
+            clip = track.create_midi_clip(clip_start_tick=clip_start_tick, clip_end_tick=clip_start_tick + 1920)
+            clip.create_note(pitch=60, velocity=100, start_tick=clip_start_tick, end_tick=clip_start_tick + 480)
+        song = Song.deserialize_from_bytestring(self.song.serialize_to_bytestring())
+        # Times as sent by the host, which must be kept as long as neither the notes nor the tempos change.
+        for clip_proto in song._proto.tracks[0].clips:
+            clip_proto.notes[0].start_time = 0.25
+        song.get_track_at(0).get_clip_at(1).get_raw_note_at(0).set_start_tick(2160)
+        song = Song.deserialize_from_bytestring(song.serialize_to_bytestring())
+        self.assertEqual(song._proto.tracks[0].clips[0].notes[0].start_time, 0.25)
+        self.assertAlmostEqual(song._proto.tracks[0].clips[1].notes[0].start_time, song.tick_to_seconds(2160))
+
+        song.create_tempo_change(ticks=480, bpm=60)
+        song = Song.deserialize_from_bytestring(song.serialize_to_bytestring())
+        self.assertEqual(song._proto.tracks[0].clips[0].notes[0].start_time, 0)
+        self.assertAlmostEqual(song._proto.tracks[0].clips[1].notes[0].start_time, song.tick_to_seconds(2160))
+
+    def test_save_and_load(self):
+        track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        track.create_midi_clip(clip_start_tick=0).create_note(pitch=60, velocity=100, start_tick=0, end_tick=480)
+        serialized_song = self.song.serialize_to_bytestring()
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(Path(directory) / 'song.tfsong')
+            for compression in [None, 'zlib', 'lzma']:
+                self.song.save(path, compression=compression)
+                for mmap in [True, False]:
+                    song = Song.load(path, mmap=mmap)
+                    self.assertEqual(song.serialize_to_bytestring(), serialized_song)
+                song = Song.load(path, lazy=True)
+                self.assertEqual(song.get_track_by_id(track.get_id()).get_clip_at(0).get_raw_note_count(), 1)
+            self.song.save(path)
+            self.assertEqual(Path(path).read_bytes(), serialized_song)
+            with pytest.raises(Exception):
+                self.song.save(path, compression='zstd')
+            self.assertEqual(len(list(Path(directory).iterdir())), 1)
+
+
+class TestPatch(BaseTest):
+    def _create_song_with_tracks(self):
+        for _ in range(3):
+            track = self.song.create_track(type=TrackType.MIDI_TRACK)
+            for clip_start_tick in [0, 1920, 3840]:
+                clip = track.create_midi_clip(clip_start_tick=clip_start_tick, clip_end_tick=clip_start_tick + 1920)
+                for tick in range(clip_start_tick, clip_start_tick + 1920, 120):
+                    clip.create_note(pitch=60, velocity=100, start_tick=tick, end_tick=tick + 120)
+        return self.song.serialize_to_bytestring()
+
+    def _assert_patch_applies(self, serialized_song):
+        other_song = Song.deserialize_from_bytestring(serialized_song)
+        other_song.apply_patch(self.song.create_patch())
+        self.assertEqual(other_song.serialize_to_bytestring(), self.song.serialize_to_bytestring())
+        return other_song
+
+    def test_empty_patch(self):
+        serialized_song = self._create_song_with_tracks()
+        self.song.take_snapshot()
+        patch = self.song.create_patch()
+        self._assert_patch_applies(serialized_song)
+        self.assertEqual(len(patch), 5)
+
+    def test_patch_notes_and_clips(self):
+        serialized_song = self._create_song_with_tracks()
+        self.song.take_snapshot()
+        track = self.song.get_track_at(1)
+        track.get_clip_at(0).create_note(pitch=72, velocity=100, start_tick=0, end_tick=60)
+        track.delete_clip_at(2, delete_associated_track_automation=False)
+        track.create_midi_clip(clip_start_tick=7680, clip_end_tick=9600)
+        track.set_volume(0.5)
+        self.assertLess(len(self.song.create_patch()), len(self.song.serialize_to_bytestring()) / 3)
+        other_song = self._assert_patch_applies(serialized_song)
+        self.assertEqual(other_song.get_track_at(1).get_clip_at(0).get_raw_note_count(), 17)
+        self.assertEqual(other_song.get_last_tick(), 9600)
+
+    def test_patch_tracks_and_tempos(self):
+        serialized_song = self._create_song_with_tracks()
+        self.song.take_snapshot()
+        self.song.remove_track(self.song.get_track_at(0).get_id())
+        self.song.clone_track(self.song.get_track_at(1))
+        self.song.create_tempo_change(ticks=960, bpm=90)
+        other_song = self._assert_patch_applies(serialized_song)
+        self.assertEqual(other_song.get_track_count(), 3)
+        self.assertEqual(other_song.get_tempo_event_count(), self.song.get_tempo_event_count())
+        self.assertAlmostEqual(other_song.tick_to_seconds(1920), self.song.tick_to_seconds(1920))
+
+    def test_patch_removes_and_reorders_several_tracks_and_clips(self):
+        serialized_song = self._create_song_with_tracks()
+        self.song.take_snapshot()
+        for track in self.song.get_tracks():
+            track.delete_clip_at(0, delete_associated_track_automation=False)
+            track.delete_clip_at(1, delete_associated_track_automation=False)
+            track.get_clip_at(0).move_clip(4000, move_associated_track_automation_points=False)
+            track.create_midi_clip(clip_start_tick=0, clip_end_tick=960)
+        self.song.remove_track(self.song.get_track_at(0).get_id())
+        self.song.remove_track(self.song.get_track_at(1).get_id())
+        self.song.create_track(type=TrackType.MIDI_TRACK, index=0)
+        other_song = self._assert_patch_applies(serialized_song)
+        self.assertEqual(other_song.get_track_count(), 2)
+        self.assertEqual([clip.get_clip_start_tick() for clip in other_song.get_track_at(1).get_clips()], [0, 5920])
+
+    def test_rejects_invalid_patches(self):
+        with pytest.raises(Exception):
+            self.song.create_patch()
+        with pytest.raises(Exception):
+            self.song.apply_patch(b'XXXX\x01')
+
 
 class TestBasicOperations(BaseTest):
     def test_get_track_index(self):
@@ -124,6 +407,23 @@ class TestBasicOperations(BaseTest):
         self.assertEqual(self.song.get_track_index(track.get_id()), 0)
         self.assertEqual(self.song.get_track_index(track2.get_id()), 1)
 
+    def test_get_track_by_id_after_track_changes(self):
+        track1 = self.song.create_track(type=TrackType.MIDI_TRACK)
+        track2 = self.song.create_track(type=TrackType.MIDI_TRACK)
+        self.assertEqual(self.song.get_track_by_id(track2.get_id()).get_rank(), track2.get_rank())  # type:ignore
+        track3 = self.song.create_track(type=TrackType.MIDI_TRACK, index=0)
+        self.assertEqual(self.song.get_track_index(track3.get_id()), 0)
+        self.assertEqual(self.song.get_track_index(track2.get_id()), 2)
+        self.song.remove_track(track1.get_id())
+        self.assertIsNone(self.song.get_track_by_id(track1.get_id()))
+        self.assertEqual(self.song.get_track_index(track1.get_id()), -1)
+        self.assertEqual(self.song.get_track_index(track2.get_id()), 1)
+        # Tracks removed directly through the proto are still looked up correctly.
+        track3_id = track3.get_id()
+        del self.song._proto.tracks[0]
+        self.assertEqual(self.song.get_track_index(track2.get_id()), 0)
+        self.assertEqual(self.song.get_track_index(track3_id), -1)
+
 
 class TestTempo(BaseTest):
     def test_get_tempo_at(self):
@@ -214,6 +514,117 @@ class TestTempo(BaseTest):
             song.remove_tempo_change_at(0)
         self.assertIsNotNone(exception2)
 
+    def test_tick_to_seconds(self):
+        song = self.song
+        self.assertEqual(song.tick_to_seconds(0), 0)
+        self.assertAlmostEqual(song.tick_to_seconds(480), 0.5)
+        self.assertAlmostEqual(song.tick_to_seconds(1440), 1.5)
+        self.assertAlmostEqual(song.tick_to_seconds(1920), 2.5)
+        self.assertAlmostEqual(song.tick_to_seconds(-480), -0.5)
+        self.assertEqual(song.seconds_to_tick(0), 0)
+        self.assertEqual(song.seconds_to_tick(0.5), 480)
+        self.assertEqual(song.seconds_to_tick(1.5), 1440)
+        self.assertEqual(song.seconds_to_tick(2.5), 1920)
+        self.assertEqual(song.seconds_to_tick(-0.5), -480)
+
+    def test_tick_to_seconds_after_tempo_changes(self):
+        song = self.song
+        self.assertAlmostEqual(song.tick_to_seconds(1440), 1.5)
+        song.create_tempo_change(ticks=960, bpm=480)
+        self.assertAlmostEqual(song.tick_to_seconds(1440), 1.125)
+        self.assertEqual(song.seconds_to_tick(1.125), 1440)
+        song.move_tempo(1, 480)
+        self.assertAlmostEqual(song.tick_to_seconds(1440), 0.75)
+        self.assertEqual(song.seconds_to_tick(0.75), 1440)
+        song.remove_tempo_change_at(1)
+        self.assertAlmostEqual(song.tick_to_seconds(1440), 1.5)
+        self.assertEqual(song.seconds_to_tick(1.5), 1440)
+        song.overwrite_tempo_changes([TempoEvent(ticks=0, bpm=60)])
+        self.assertAlmostEqual(song.tick_to_seconds(1440), 3)
+        self.assertEqual(song.seconds_to_tick(3), 1440)
+
+    def test_ticks_to_seconds_array(self):
+        song = self.song
+        song.create_tempo_change(ticks=2880, bpm=240)
+        ticks = np.array([-480, 0, 1, 480, 1439, 1440, 1441, 2880, 9999, 10000])
+        np.testing.assert_array_equal(
+            song.ticks_to_seconds_array(ticks),
+            [song.tick_to_seconds(int(tick)) for tick in ticks])
+        self.assertEqual(song.ticks_to_seconds_array(ticks.reshape(2, 5)).shape, (2, 5))
+        self.assertEqual(song.ticks_to_seconds_array(np.array([], dtype=np.int64)).shape, (0,))
+
+    def test_seconds_to_ticks_array(self):
+        song = self.song
+        song.create_tempo_change(ticks=2880, bpm=240)
+        seconds = np.array([-0.5, 0, 0.0001, 0.5, 1.5, 1.50001, 4.5, 4.5001, 10, 100.3])
+        converted_ticks = song.seconds_to_ticks_array(seconds)
+        self.assertEqual(converted_ticks.dtype, np.int64)
+        np.testing.assert_array_equal(
+            converted_ticks,
+            [song.seconds_to_tick(float(second)) for second in seconds])
+
+    def test_move_tempo_overwrite_moves_tempo(self):
+        song = self.song
+        song.create_tempo_change(ticks=2880, bpm=240)
+        song.move_tempo(2, 1440)
+        self.assertEqual(song.get_tempo_event_at(1).get_ticks(), 1440)  # type:ignore
+        self.assertEqual(song.get_tempo_event_at(1).get_bpm(), 240)  # type:ignore
+        self.assertAlmostEqual(song.get_tempo_event_at(1).get_time(), 1.5)  # type:ignore
+
+    def test_incremental_retiming(self):
+        song = self.song
+        for ticks, bpm in [(4800, 90), (960, 150), (2880, 240), (7200, 75), (2880, 200)]:
+            song.create_tempo_change(ticks=ticks, bpm=bpm)
+        song.move_tempo(2, 6000)
+        song.move_tempo(5, 100)
+        song.remove_tempo_change_at(3)
+        times = [tempo.time for tempo in song._proto.tempos]
+        song.retiming_tempo_events()
+        self.assertEqual([tempo.time for tempo in song._proto.tempos], times)
+        self.assertEqual([tempo.ticks for tempo in song._proto.tempos], [0, 100, 960, 2880, 4800, 7200])
+
+    def test_set_tempo_curve(self):
+        song = self.song
+        song.set_tempo_curve(np.array([2880, 0, 1440, 1440]), [240, 120, 90, 60])
+        self.assertEqual(song.get_tempo_event_count(), 3)
+        self.assertEqual([tempo.ticks for tempo in song._proto.tempos], [0, 1440, 2880])
+        self.assertEqual([tempo.bpm for tempo in song._proto.tempos], [120, 60, 240])
+        expected_song = create_song()
+        expected_song.create_tempo_change(ticks=2880, bpm=240)
+        self.assertEqual([tempo.time for tempo in song._proto.tempos],
+                         [tempo.time for tempo in expected_song._proto.tempos])
+        self.assertAlmostEqual(song.tick_to_seconds(3360), expected_song.tick_to_seconds(3360))
+        with pytest.raises(Exception):
+            song.set_tempo_curve([480, 960], [120, 60])
+        with pytest.raises(Exception):
+            song.set_tempo_curve([0, 960], [120])
+        with pytest.raises(Exception):
+            song.set_tempo_curve([], [])
+        self.assertEqual(song.get_tempo_event_count(), 3)
+
+    def test_tempo_changes_in_batch(self):
+        expected_song = create_song()
+        for ticks, bpm in [(4800, 90), (960, 150), (2880, 240), (4800, 75)]:
+            expected_song.create_tempo_change(ticks=ticks, bpm=bpm)
+        expected_song.move_tempo(2, 3360)
+        expected_song.remove_tempo_change_at(1)
+        song = self.song
+        with song.batch():
+            for ticks, bpm in [(4800, 90), (960, 150), (2880, 240), (4800, 75)]:
+                song.create_tempo_change(ticks=ticks, bpm=bpm)
+            song.move_tempo(2, 3360)
+            song.remove_tempo_change_at(1)
+            # Reads inside the batch see the up-to-date tempo map.
+            self.assertAlmostEqual(song.tick_to_seconds(4800), expected_song.tick_to_seconds(4800))
+        self.assertEqual(song.get_tempo_event_count(), expected_song.get_tempo_event_count())
+        for i in range(song.get_tempo_event_count()):
+            self.assertEqual(song.get_tempo_event_at(i).get_ticks(),  # type:ignore
+                             expected_song.get_tempo_event_at(i).get_ticks())  # type:ignore
+            self.assertEqual(song.get_tempo_event_at(i).get_bpm(),  # type:ignore
+                             expected_song.get_tempo_event_at(i).get_bpm())  # type:ignore
+            self.assertAlmostEqual(song.get_tempo_event_at(i).get_time(),  # type:ignore
+                                   expected_song.get_tempo_event_at(i).get_time())  # type:ignore
+
 
 class TestTimeSignature(BaseTest):
     def test_get_time_signature(self):
@@ -278,6 +689,111 @@ class TestTracks(BaseTest):
         self.assertEqual(self.song.get_track_count(), 1)
         self.assertFalse(dep_track.has_output())
 
+    def test_last_tick_follows_clip_changes(self):
+        self.assertEqual(self.song.get_last_tick(), 0)
+        track1 = self.song.create_track(type=TrackType.MIDI_TRACK)
+        track2 = self.song.create_track(type=TrackType.MIDI_TRACK)
+        clip1 = track1.create_midi_clip(clip_start_tick=0, clip_end_tick=100)
+        clip2 = track2.create_midi_clip(clip_start_tick=50, clip_end_tick=200)
+        self.assertEqual(self.song.get_last_tick(), 200)
+        clip1.adjust_clip_right(300)
+        self.assertEqual(self.song.get_last_tick(), 300)
+        clip1.adjust_clip_right(150)
+        self.assertEqual(self.song.get_last_tick(), 200)
+        clip2.move_clip(-50, move_associated_track_automation_points=False)
+        self.assertEqual(self.song.get_last_tick(), 150)
+        self.song.clone_track(track1).get_clip_at(0).adjust_clip_right(400)
+        self.assertEqual(self.song.get_last_tick(), 400)
+        self.song._check_cached_aggregates()
+        clip1.delete_from_parent(delete_associated_track_automation=False)
+        self.assertEqual(self.song.get_last_tick(), 400)
+        self.song.remove_track(self.song.get_track_at(0).get_id())
+        self.assertEqual(self.song.get_last_tick(), 150)
+        self.song._check_cached_aggregates()
+
+    def test_next_track_rank_follows_track_changes(self):
+        self.assertEqual(self.song.get_next_track_rank(), 1)
+        track1 = self.song.create_track(type=TrackType.MIDI_TRACK)
+        track2 = self.song.create_track(type=TrackType.MIDI_TRACK)
+        self.assertEqual(self.song.get_next_track_rank(), 3)
+        self.song.remove_track(track2.get_id())
+        self.assertEqual(self.song.get_next_track_rank(), 2)
+        self.song.clone_track(track1)
+        self.assertEqual(self.song.get_next_track_rank(), 3)
+        self.song.create_track(type=TrackType.MIDI_TRACK, rank=10)
+        self.assertEqual(self.song.get_next_track_rank(), 11)
+        self.song._check_cached_aggregates()
+
+
+class TestBatch(BaseTest):
+    def test_defers_structure_sorting(self):
+        song = self.song
+        with song.batch():
+            for tick in [0, 3000, 1000, 2000]:
+                song.create_structure(tick=tick, type=StructureType.VERSE)
+            # Sorting is deferred while in the batch.
+            self.assertEqual([structure.tick for structure in song._proto.structures], [0, 3000, 1000, 2000])
+            with song.batch():
+                song.move_structure(1, 4000)
+            self.assertEqual(len(song._pending_sorts), 1)
+        self.assertEqual(len(song._pending_sorts), 0)
+        self.assertEqual([structure.get_tick() for structure in song.get_structures()], [0, 2000, 3000, 4000])
+
+    def test_reads_flush_pending_sorts(self):
+        song = self.song
+        with song.batch():
+            for tick in [0, 3000, 1000]:
+                song.create_structure(tick=tick, type=StructureType.VERSE)
+            self.assertEqual(song.get_structure_at_index(1).get_tick(), 1000)  # type:ignore
+            self.assertEqual(len(song._pending_sorts), 0)
+
+    def test_move_tempo_keeps_other_sorts_pending(self):
+        song = self.song
+        song.create_tempo_change(ticks=2880, bpm=240)
+        with song.batch():
+            for tick in [3000, 1000]:
+                song.create_structure(tick=tick, type=StructureType.VERSE)
+            song.move_tempo(2, 1920)
+            self.assertEqual(len(song._pending_sorts), 1)
+        self.assertEqual([song.get_tempo_event_at(index).get_ticks() for index in range(3)],  # type:ignore
+                         [0, 1440, 1920])
+        self.assertAlmostEqual(song.get_tempo_event_at(2).get_time(), song.tick_to_seconds(1920))  # type:ignore
+
+    def test_defers_clip_conflicts(self):
+        track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        with self.song.batch():
+            track.create_midi_clip(clip_start_tick=0, clip_end_tick=960)
+            track.create_midi_clip(clip_start_tick=480, clip_end_tick=1440)
+            # Clips may overlap until the batch ends.
+            self.assertEqual([(clip.get_clip_start_tick(), clip.get_clip_end_tick()) for clip in track.get_clips()],
+                             [(0, 960), (480, 1440)])
+        self.assertEqual([(clip.get_clip_start_tick(), clip.get_clip_end_tick()) for clip in track.get_clips()],
+                         [(0, 479), (480, 1440)])
+
+    def test_deferred_clip_conflicts_match_resolving_immediately(self):
+        clip_ranges = [(0, 960), (240, 480), (960, 1920), (100, 1000), (1500, 3000), (2000, 2100), (50, 60)]
+        track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        for clip_start_tick, clip_end_tick in clip_ranges:
+            track.create_midi_clip(clip_start_tick=clip_start_tick, clip_end_tick=clip_end_tick)
+        batch_track = self.song.create_track(type=TrackType.MIDI_TRACK)
+        with self.song.batch():
+            for clip_start_tick, clip_end_tick in clip_ranges:
+                batch_track.create_midi_clip(clip_start_tick=clip_start_tick, clip_end_tick=clip_end_tick)
+        self.assertEqual(
+            [(clip.get_clip_start_tick(), clip.get_clip_end_tick()) for clip in batch_track.get_clips()],
+            [(clip.get_clip_start_tick(), clip.get_clip_end_tick()) for clip in track.get_clips()])
+
+    def test_flushes_on_exception(self):
+        song = self.song
+        with pytest.raises(Exception):
+            with song.batch():
+                song.create_structure(tick=0, type=StructureType.VERSE)
+                song.create_structure(tick=3000, type=StructureType.VERSE)
+                song.create_structure(tick=1000, type=StructureType.VERSE)
+                raise Exception('Interrupted')
+        self.assertEqual(song._batch_depth, 0)
+        self.assertEqual([structure.tick for structure in song._proto.structures], [0, 1000, 3000])
+
 
 if __name__ == '__main__':
     unittest.main()